@@ -301,7 +301,7 @@ async def update_memory(req: UpdateMemoryRequest):
         engine = sessions[req.session_id]
         
         # 1. 调用新的GameEngine方法从LLM回复中提取并应用状态更新
-        update_results = engine.extract_updates_from_response(req.llm_response, req.user_input)
+        update_results = await engine.extract_updates_from_response_async(req.llm_response, req.user_input)
         
         # 2. 将当前的用户输入和LLM回复存入对话历史
         engine.memory.add_conversation(req.user_input, req.llm_response)
@@ -349,7 +349,7 @@ async def process_conversation(req: ProcessConversationRequest):
             # 如果没有初始化滑动窗口系统，回退到原始处理方式
             logger.warning(f"Sliding window system not initialized for session {req.session_id}, using fallback")
             engine = sessions[req.session_id]
-            update_results = engine.extract_updates_from_response(req.llm_response, req.user_input)
+            update_results = await engine.extract_updates_from_response_async(req.llm_response, req.user_input)
             engine.memory.add_conversation(req.user_input, req.llm_response)
             engine.memory.save_all_memory()
             
@@ -456,9 +456,10 @@ async def get_session_stats(session_id: str):
             sliding_manager = sliding_window_managers[session_id]
             # 扩展返回的数据，虽然模型定义中没有这些字段，但可以在响应中包含
             stats_dict = stats.dict()
+            window_counts = sliding_manager.sliding_window.get_window_counts()
             stats_dict.update({
-                "sliding_window_size": len(sliding_manager.sliding_window.conversations),
-                "processed_turns": sliding_manager._processed_count if hasattr(sliding_manager, '_processed_count') else 0,
+                "sliding_window_size": window_counts["current_turns"],
+                "processed_turns": window_counts["processed_turns"],
                 "window_capacity": sliding_manager.sliding_window.window_size,
                 "processing_delay": sliding_manager.sliding_window.processing_delay
             })
@@ -16,9 +16,9 @@ from PySide6.QtWidgets import (
     QFormLayout, QLineEdit, QPushButton, QCheckBox, QTabWidget, 
     QMessageBox, QSplitter, QListWidget, QLabel, QTextEdit,
     QGroupBox, QComboBox, QInputDialog, QStyle, QDialog, QFileDialog,
-    QRadioButton, QButtonGroup, QScrollArea, QFrame
+    QRadioButton, QButtonGroup, QScrollArea
 )
-from PySide6.QtCore import Qt, QObject, Signal as pyqtSignal, QUrl, Slot, QTimer, QPropertyAnimation, QRect, QThread
+from PySide6.QtCore import Qt, QObject, QUrl, Slot, QPropertyAnimation, QRect, QThread
 from PySide6.QtWebEngineWidgets import QWebEngineView
 from PySide6.QtWebChannel import QWebChannel
 from PySide6.QtGui import QIcon, QFont, QColor, QIntValidator, QTextCursor, QPainter, QPen, QBrush
@@ -29,330 +29,20 @@ sys.path.append(str(Path(__file__).parent))
 from src.memory import GRAGMemory
 
 # 导入重构后的组件
-from src.ui.widgets.chat_components import ChatDisplayWidget, ChatBubble, LoadingBubble
+from src.ui.widgets.chat_components import ChatDisplayWidget
 from src.ui.managers.conversation_manager import ConversationManager
-from src.ui.workers.llm_worker import LLMWorkerThread
+from src.ui.workers.llm_worker import LLMService
 from src.ui.managers.scenario_manager import ScenarioManager
 from src.ui.managers.window_manager import WindowManager
 from src.ui.managers.resource_cleanup_manager import ResourceCleanupManager
 from src.ui.generators.graph_html_generator import GraphHTMLGenerator
 
-class ChatBubble(QFrame):
-    """聊天气泡组件"""
-    
-    # 添加信号
-    message_clicked = pyqtSignal(object)  # 点击消息时发出信号
-    
-    def __init__(self, message: str, is_user: bool, color: str = None):
-        super().__init__()
-        self.message = message
-        self.is_user = is_user
-        self.delete_mode_enabled = False  # 是否处于删除模式
-        # 统一的深色主题配色
-        if is_user:
-            # 用户消息：简洁的蓝色
-            self.color = color or "#5865f2"  # Discord蓝
-            self.text_color = "#ffffff"
-            self.border_color = "transparent"
-        else:
-            # AI消息：深色背景，浅色文字，微妙边框
-            self.color = color or "#36393f"  # Discord深色
-            self.text_color = "#dcddde"      # 温和的浅色
-            self.border_color = "#40444b"    # 微妙的边框
-        self.setup_ui()
-    
-    def set_delete_mode(self, enabled: bool):
-        """设置删除模式"""
-        self.delete_mode_enabled = enabled
-        if enabled:
-            self.setCursor(Qt.PointingHandCursor)
-            # 添加删除模式的视觉提示
-            self.setStyleSheet(self.styleSheet() + """
-                QFrame:hover {
-                    border: 2px solid #e74c3c !important;
-                    background-color: rgba(231, 76, 60, 0.1) !important;
-                }
-            """)
-        else:
-            self.setCursor(Qt.ArrowCursor)
-            self.setStyleSheet("")  # 重置样式
-            self.setup_ui()  # 重新设置UI样式
-    
-    def mousePressEvent(self, event):
-        """鼠标点击事件"""
-        if self.delete_mode_enabled and event.button() == Qt.LeftButton:
-            self.message_clicked.emit(self)
-        super().mousePressEvent(event)
-    
-    def setup_ui(self):
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(20, 8, 20, 8)
-        
-        # 创建消息标签
-        message_label = QLabel(self.message)
-        message_label.setWordWrap(True)
-        
-        if self.is_user:
-            # 用户消息样式 - 简洁的蓝色
-            message_label.setStyleSheet(f"""
-                QLabel {{
-                    background-color: {self.color};
-                    color: {self.text_color};
-                    border-radius: 18px;
-                    padding: 12px 16px;
-                    font-size: 14px;
-                    line-height: 1.4;
-                    max-width: 400px;
-                    min-height: 20px;
-                    border: none;
-                    font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
-                    font-weight: 500;
-                }}
-            """)
-        else:
-            # AI消息样式 - Discord风格深色
-            message_label.setStyleSheet(f"""
-                QLabel {{
-                    background-color: {self.color};
-                    color: {self.text_color};
-                    border: 1px solid {self.border_color};
-                    border-radius: 8px;
-                    padding: 12px 16px;
-                    font-size: 14px;
-                    line-height: 1.5;
-                    max-width: 450px;
-                    min-height: 20px;
-                    font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
-                }}
-            """)
-        
-        message_label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-        
-        if self.is_user:
-            # 用户消息右对齐
-            layout.addStretch()
-            layout.addWidget(message_label)
-        else:
-            # AI消息左对齐
-            layout.addWidget(message_label)
-            layout.addStretch()
-
-class LoadingBubble(QFrame):
-    """加载动画气泡"""
-    def __init__(self):
-        super().__init__()
-        self.dots_count = 1
-        self.max_dots = 6
-        self.setup_ui()
-        
-        # 设置定时器来更新动画
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_animation)
-        self.timer.start(500)  # 每500ms更新一次
-    
-    def setup_ui(self):
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(20, 8, 20, 8)
-        
-        self.message_label = QLabel("助手正在思考...")
-        self.message_label.setStyleSheet("""
-            QLabel {
-                background-color: #36393f;
-                color: #72767d;
-                border: 1px solid #40444b;
-                border-radius: 8px;
-                padding: 12px 16px;
-                font-size: 14px;
-                min-width: 120px;
-                font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
-                font-style: italic;
-            }
-        """)
-        
-        layout.addWidget(self.message_label)
-        layout.addStretch()
-    
-    def update_animation(self):
-        dots = "." * self.dots_count
-        self.message_label.setText(f"助手正在思考{dots}")
-        self.dots_count = (self.dots_count % self.max_dots) + 1
-    
-    def stop_animation(self):
-        self.timer.stop()
-
-class ChatDisplayWidget(QScrollArea):
-    """聊天显示组件"""
-    def __init__(self):
-        super().__init__()
-        self.messages_layout = QVBoxLayout()
-        self.current_loading_bubble = None
-        self.message_widgets = []  # 存储所有消息组件的引用
-        self.setup_ui()
-    
-    def setup_ui(self):
-        self.setWidgetResizable(True)
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.setMinimumHeight(400)
-        
-        # 创建容器widget
-        container = QWidget()
-        container.setStyleSheet("""
-            QWidget {
-                background-color: #2f3136;
-            }
-        """)
-        container_layout = QVBoxLayout(container)
-        container_layout.setSpacing(5)
-        container_layout.setContentsMargins(0, 10, 0, 10)
-        
-        # 添加消息布局
-        container_layout.addLayout(self.messages_layout)
-        container_layout.addStretch()  # 推到顶部
-        
-        self.setWidget(container)
-        
-        # 设置样式 - 现代深色聊天背景（类似Discord/Slack）
-        self.setStyleSheet("""
-            QScrollArea {
-                border: none;
-                border-radius: 0px;
-                background-color: #2f3136;
-            }
-            QWidget {
-                background-color: #2f3136;
-            }
-            QScrollBar:vertical {
-                width: 8px;
-                border-radius: 4px;
-                background-color: #2f3136;
-                border: none;
-            }
-            QScrollBar::handle:vertical {
-                border-radius: 4px;
-                background-color: #202225;
-                min-height: 20px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #40444b;
-            }
-            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {
-                border: none;
-                background: none;
-                height: 0px;
-            }
-        """)
-    
-    def add_message(self, message: str, is_user: bool, color: str = None):
-        # 限制消息历史大小，防止内存泄漏
-        MAX_MESSAGES = 1000  # 最多保留1000条消息
-        
-        # 如果超过限制，删除最旧的消息
-        if len(self.message_widgets) >= MAX_MESSAGES:
-            old_msg_info = self.message_widgets.pop(0)
-            old_widget = old_msg_info['widget']
-            self.messages_layout.removeWidget(old_widget)
-            old_widget.deleteLater()
-            logger.info(f"🧹 [UI] 删除旧消息以防止内存泄漏，当前消息数: {len(self.message_widgets)}")
-        
-        bubble = ChatBubble(message, is_user, color)
-        bubble.message_clicked.connect(self.on_message_clicked)  # 连接点击信号
-        self.messages_layout.addWidget(bubble)
-        self.message_widgets.append({
-            'widget': bubble,
-            'message': message,
-            'is_user': is_user,
-            'color': color
-        })
-        self.scroll_to_bottom()
-    
-    def set_delete_mode(self, enabled: bool):
-        """设置所有气泡的删除模式"""
-        for msg_info in self.message_widgets:
-            msg_info['widget'].set_delete_mode(enabled)
-    
-    def on_message_clicked(self, bubble):
-        """处理消息气泡点击事件"""
-        # 找到对应的消息信息
-        for i, msg_info in enumerate(self.message_widgets):
-            if msg_info['widget'] == bubble:
-                # 询问确认删除
-                reply = QMessageBox.question(
-                    self,
-                    "确认删除",
-                    f"确定要删除这条{'用户' if msg_info['is_user'] else 'AI'}消息吗？",
-                    QMessageBox.Yes | QMessageBox.No
-                )
-                
-                if reply == QMessageBox.Yes:
-                    # 从布局中移除
-                    self.messages_layout.removeWidget(bubble)
-                    bubble.deleteLater()
-                    
-                    # 从列表中移除
-                    self.message_widgets.pop(i)
-                    
-                    # 发出删除信号通知父组件更新对话历史
-                    # TODO: 实现对话历史同步
-                
-                break
-    
-    def show_loading_animation(self):
-        if self.current_loading_bubble:
-            self.remove_loading_animation()
-        
-        self.current_loading_bubble = LoadingBubble()
-        self.messages_layout.addWidget(self.current_loading_bubble)
-        self.scroll_to_bottom()
-        return self.current_loading_bubble
-    
-    def remove_loading_animation(self):
-        if self.current_loading_bubble:
-            self.current_loading_bubble.stop_animation()
-            self.messages_layout.removeWidget(self.current_loading_bubble)
-            self.current_loading_bubble.deleteLater()
-            self.current_loading_bubble = None
-    
-    def scroll_to_bottom(self):
-        # 延迟滚动以确保布局完成
-        QTimer.singleShot(50, lambda: self.verticalScrollBar().setValue(
-            self.verticalScrollBar().maximum()
-        ))
-    
-    def clear_messages(self):
-        # 清空所有消息
-        while self.messages_layout.count():
-            child = self.messages_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
-        self.remove_loading_animation()
-        self.message_widgets.clear()
-    
-    def remove_last_ai_message(self):
-        """删除最后一条AI回复"""
-        # 从后往前找最后一条AI消息
-        for i in range(len(self.message_widgets) - 1, -1, -1):
-            if not self.message_widgets[i]['is_user']:
-                # 找到最后一条AI消息，删除它
-                widget_to_remove = self.message_widgets[i]['widget']
-                self.messages_layout.removeWidget(widget_to_remove)
-                widget_to_remove.deleteLater()
-                self.message_widgets.pop(i)
-                return True
-        return False
-    
-    def get_last_user_message(self):
-        """获取最后一条用户消息"""
-        for i in range(len(self.message_widgets) - 1, -1, -1):
-            if self.message_widgets[i]['is_user']:
-                return self.message_widgets[i]['message']
-        return None
 from src.core.perception import PerceptionModule
 from src.core.rpg_text_processor import RPGTextProcessor
 from src.core.game_engine import GameEngine
 from src.core.validation import ValidationLayer
 
-from typing import Dict, List, Optional
+from typing import Dict, List
 
 
 class GraphBridge(QObject):
@@ -386,165 +76,6 @@ class GraphBridge(QObject):
         logger.debug(f"JS: {message}")
 
 
-class ConversationManager(QObject):
-    """对话管理器，处理本地对话的CRUD操作"""
-    
-    conversation_changed = pyqtSignal(str)  # 当前对话改变
-    conversation_list_updated = pyqtSignal(list)  # 对话列表更新
-    
-    def __init__(self, storage_path: Path):
-        super().__init__()
-        self.storage_path = storage_path / "conversations"
-        self.storage_path.mkdir(exist_ok=True, parents=True)
-        self.current_conversation_id: Optional[str] = None
-        self.conversations: Dict[str, Dict] = {}
-        self.load_conversations()
-    
-    def load_conversations(self):
-        """加载所有对话"""
-        self.conversations.clear()
-        
-        for conv_file in self.storage_path.glob("*.json"):
-            try:
-                with open(conv_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.conversations[data['id']] = data
-            except Exception as e:
-                logger.error(f"Failed to load conversation {conv_file}: {e}")
-        
-        # 按最后修改时间排序
-        sorted_conversations = sorted(
-            self.conversations.values(), 
-            key=lambda x: x.get('last_modified', 0), 
-            reverse=True
-        )
-        
-        self.conversation_list_updated.emit(sorted_conversations)
-        
-        # 如果没有当前对话，选择最新的（但如果已经有了就不要重复触发）
-        if not self.current_conversation_id and sorted_conversations:
-            self.current_conversation_id = sorted_conversations[0]['id']
-            self.conversation_changed.emit(self.current_conversation_id)
-    
-    def create_conversation(self, name: str = None) -> str:
-        """创建新对话"""
-        import uuid
-        import time
-        
-        conv_id = str(uuid.uuid4())
-        if not name:
-            name = f"新对话 {len(self.conversations) + 1}"
-        
-        conversation = {
-            'id': conv_id,
-            'name': name,
-            'messages': [],
-            'created_time': time.time(),
-            'last_modified': time.time(),
-            'metadata': {}
-        }
-        
-        self.conversations[conv_id] = conversation
-        self._save_conversation(conversation)
-        
-        # 切换到新对话
-        self.current_conversation_id = conv_id
-        
-        # 重新加载更新列表，但不要触发自动选择逻辑
-        self.load_conversations()  
-        
-        # 手动发出对话切换信号
-        self.conversation_changed.emit(conv_id)
-        
-        return conv_id
-    
-    def delete_conversation(self, conv_id: str) -> bool:
-        """删除对话"""
-        if conv_id not in self.conversations:
-            return False
-        
-        try:
-            conv_file = self.storage_path / f"{conv_id}.json"
-            if conv_file.exists():
-                conv_file.unlink()
-            
-            del self.conversations[conv_id]
-            
-            # 如果删除的是当前对话，切换到其他对话
-            if self.current_conversation_id == conv_id:
-                remaining_convs = list(self.conversations.keys())
-                if remaining_convs:
-                    self.current_conversation_id = remaining_convs[0]
-                    self.conversation_changed.emit(self.current_conversation_id)
-                else:
-                    self.current_conversation_id = None
-                    self.conversation_changed.emit("")
-            
-            self.load_conversations()
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to delete conversation {conv_id}: {e}")
-            return False
-    
-    def rename_conversation(self, conv_id: str, new_name: str) -> bool:
-        """重命名对话"""
-        if conv_id not in self.conversations:
-            return False
-        
-        try:
-            import time
-            self.conversations[conv_id]['name'] = new_name
-            self.conversations[conv_id]['last_modified'] = time.time()
-            self._save_conversation(self.conversations[conv_id])
-            self.load_conversations()
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to rename conversation {conv_id}: {e}")
-            return False
-    
-    def switch_conversation(self, conv_id: str):
-        """切换对话"""
-        if conv_id in self.conversations:
-            self.current_conversation_id = conv_id
-            self.conversation_changed.emit(conv_id)
-    
-    def get_current_conversation(self) -> Optional[Dict]:
-        """获取当前对话"""
-        if self.current_conversation_id and self.current_conversation_id in self.conversations:
-            return self.conversations[self.current_conversation_id]
-        return None
-    
-    def add_message(self, message: Dict):
-        """添加消息到当前对话"""
-        conv = self.get_current_conversation()
-        if conv:
-            import time
-            message['timestamp'] = time.time()
-            conv['messages'].append(message)
-            conv['last_modified'] = time.time()
-            self._save_conversation(conv)
-    
-    def clear_current_conversation(self):
-        """清空当前对话的消息"""
-        conv = self.get_current_conversation()
-        if conv:
-            import time
-            conv['messages'] = []
-            conv['last_modified'] = time.time()
-            self._save_conversation(conv)
-    
-    def _save_conversation(self, conversation: Dict):
-        """保存对话到文件"""
-        conv_file = self.storage_path / f"{conversation['id']}.json"
-        try:
-            with open(conv_file, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Failed to save conversation: {e}")
-
-
 class IntegratedPlayPage(QWidget):
     """集成的智能对话页面"""
     
@@ -561,6 +92,14 @@ class IntegratedPlayPage(QWidget):
         self.init_ui()
         self.connect_signals()
         
+        # 常驻LLM服务：所有消息在同一个后台线程中依次处理
+        self.llm_message = None  # 最近提交给LLM服务的用户消息
+        self.llm_service = LLMService(self.engine)
+        self.llm_service.response_ready.connect(self.on_llm_response_ready)
+        self.llm_service.response_chunk.connect(self.chat_display.append_stream_chunk)
+        self.llm_service.error_occurred.connect(self.on_llm_error)
+        self.llm_service.grag_data_ready.connect(self.on_grag_data_ready)
+        
         # 设置初始状态 - 本地测试模式默认激活
         self.update_status_display("本地测试模式已选择")
         self.is_connected_to_api = True
@@ -1113,18 +652,22 @@ class IntegratedPlayPage(QWidget):
         messages = conv.get('messages', [])
         logger.info(f"💬 [UI] 对话包含 {len(messages)} 条消息")
         
-        # 显示消息历史
+        # 显示消息历史（批量添加，结束时统一布局并滚动一次）
         loaded_messages = 0
-        for msg in messages:
-            if msg['role'] == 'user':
-                self.append_message(msg['content'], is_user=True)
-                loaded_messages += 1
-            elif msg['role'] == 'assistant':
-                self.append_message(msg['content'], is_user=False)
-                loaded_messages += 1
-            elif msg['role'] == 'system':
-                self.append_message(f"系统: {msg['content']}", is_user=False)
-                loaded_messages += 1
+        self.chat_display.begin_batch()
+        try:
+            for msg in messages:
+                if msg['role'] == 'user':
+                    self.append_message(msg['content'], is_user=True)
+                    loaded_messages += 1
+                elif msg['role'] == 'assistant':
+                    self.append_message(msg['content'], is_user=False)
+                    loaded_messages += 1
+                elif msg['role'] == 'system':
+                    self.append_message(f"系统: {msg['content']}", is_user=False)
+                    loaded_messages += 1
+        finally:
+            self.chat_display.end_batch()
         
         logger.info(f"✅ [UI] 成功加载 {loaded_messages} 条消息到聊天界面")
     
@@ -1187,31 +730,18 @@ class IntegratedPlayPage(QWidget):
             self.process_tavern_message(message)
     
     def process_test_message(self, message: str):
-        """处理测试模式消息 - 使用多线程避免UI阻塞"""
+        """处理测试模式消息 - 交给常驻LLM服务在后台线程处理，避免UI阻塞"""
         try:
-            # 清理之前的线程
-            if hasattr(self, 'llm_worker') and self.llm_worker is not None:
-                if self.llm_worker.isRunning():
-                    logger.info("🔄 [UI] 停止之前的LLM工作线程")
-                    self.llm_worker.terminate()
-                    self.llm_worker.wait(1000)  # 等待最多1秒
-                self.llm_worker.deleteLater()
-            
-            # 创建并启动工作线程
-            self.llm_worker = LLMWorkerThread(self.engine, message)
-            
-            # 连接信号
-            self.llm_worker.response_ready.connect(self.on_llm_response_ready)
-            self.llm_worker.error_occurred.connect(self.on_llm_error)
-            self.llm_worker.grag_data_ready.connect(self.on_grag_data_ready)
-            self.llm_worker.finished.connect(self.on_llm_worker_finished)  # 新增：线程完成清理
-            
-            # 启动线程
-            logger.info(f"🚀 [UI] 启动LLM工作线程处理消息: {message}")
-            self.llm_worker.start()
+            # 之前被中断的流式回复不再接收后续内容
+            self.chat_display.finish_stream_message()
+            
+            # 提交消息（仍在处理的上一条消息会被取消）
+            logger.info(f"🚀 [UI] 提交消息给LLM服务: {message}")
+            self.llm_message = message
+            self.llm_service.submit(message)
             
         except Exception as e:
-            logger.error(f"❌ [UI] 启动工作线程失败: {e}")
+            logger.error(f"❌ [UI] 提交消息给LLM服务失败: {e}")
             self.remove_loading_animation()
             error_response = "抱歉，系统遇到了一些问题。让我们重新开始吧。"
             self.append_message(error_response, is_user=False)
@@ -1225,9 +755,10 @@ class IntegratedPlayPage(QWidget):
         try:
             logger.info(f"✅ [UI] 收到LLM回复，开始处理UI更新")
             
-            # 移除加载动画并显示回复
-            self.remove_loading_animation()
-            self.append_message(llm_response, is_user=False)
+            # 移除加载动画并显示回复（流式输出时气泡已在逐段显示，只需以完整回复为准）
+            if not self.chat_display.finish_stream_message(llm_response):
+                self.remove_loading_animation()
+                self.append_message(llm_response, is_user=False)
             
             # 添加到对话历史
             self.conversation_manager.add_message({
@@ -1238,8 +769,8 @@ class IntegratedPlayPage(QWidget):
             # 处理LLM回复，更新知识图谱
             try:
                 logger.info(f"🔄 [GRAG] 开始更新知识图谱...")
-                update_results = self.engine.extract_updates_from_response(llm_response, self.llm_worker.message)
-                self.engine.memory.add_conversation(self.llm_worker.message, llm_response)
+                update_results = self.engine.extract_updates_from_response(llm_response, self.llm_message)
+                self.engine.memory.add_conversation(self.llm_message, llm_response)
                 self.engine.memory.save_all_memory()
                 
                 logger.info(f"✅ [GRAG] 知识图谱更新成功: {update_results}")
@@ -1276,17 +807,11 @@ class IntegratedPlayPage(QWidget):
     def on_llm_error(self, error_message: str):
         """LLM处理出错的回调"""
         logger.error(f"❌ [UI] LLM处理出错: {error_message}")
+        self.chat_display.finish_stream_message()
         self.remove_loading_animation()
         error_response = "抱歉，系统遇到了一些问题。让我们重新开始吧。"
         self.append_message(error_response, is_user=False)
     
-    def on_llm_worker_finished(self):
-        """LLM工作线程完成时的清理回调"""
-        logger.info("🧹 [UI] LLM工作线程已完成，进行清理")
-        if hasattr(self, 'llm_worker') and self.llm_worker is not None:
-            self.llm_worker.deleteLater()
-            self.llm_worker = None
-    
     def process_tavern_message(self, message: str):
         """处理酒馆模式消息"""
         # TODO: 实现与SillyTavern的交互
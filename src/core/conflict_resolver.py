@@ -203,7 +203,7 @@ class ConflictResolver:
             
             if old_snapshot.has_changed(temp_turn):
                 result["conflicts_detected"] += 1
-                logger.info(f"检测到对话内容变化: {existing_turn.turn_id[:8]}")
+                logger.info(f"检测到对话内容变化: {existing_turn.short_id}")
                 
                 # 应用冲突解决策略：最新内容获胜
                 success = self.sliding_window.update_turn(
@@ -219,9 +219,9 @@ class ConflictResolver:
                     if updated_turn:
                         self._create_state_snapshot(updated_turn)
                     
-                    logger.info(f"冲突已解决，对话已更新: {existing_turn.turn_id[:8]}")
+                    logger.info(f"冲突已解决，对话已更新: {existing_turn.short_id}")
                 else:
-                    logger.error(f"冲突解决失败: {existing_turn.turn_id[:8]}")
+                    logger.error(f"冲突解决失败: {existing_turn.short_id}")
         
         return result
     
@@ -242,7 +242,7 @@ class ConflictResolver:
         for turn in window_turns:
             if turn.turn_id not in tavern_ids:
                 # 这个对话在酒馆历史中已经不存在了
-                logger.info(f"检测到已删除的对话: {turn.turn_id[:8]}")
+                logger.info(f"检测到已删除的对话: {turn.short_id}")
                 # 注意：我们不从滑动窗口中删除，因为可能只是临时不可见
                 # 实际的删除策略需要更谨慎的处理
                 deleted_count += 1
@@ -287,7 +287,7 @@ class ConflictResolver:
         """创建对话状态快照"""
         snapshot = ConversationState(turn)
         self.state_snapshots[turn.turn_id] = snapshot
-        logger.debug(f"创建状态快照: {turn.turn_id[:8]}")
+        logger.debug(f"创建状态快照: {turn.short_id}")
     
     def handle_conversation_modification(
         self, 
@@ -368,8 +368,7 @@ class ConflictResolver:
         logger.info(f"标记对话为已删除: {turn_id[:8]}")
         
         # 清理状态快照
-        if turn_id in self.state_snapshots:
-            del self.state_snapshots[turn_id]
+        self.state_snapshots.pop(turn_id, None)
         
         return {
             "success": True,
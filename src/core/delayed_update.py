@@ -50,7 +50,7 @@ class DelayedUpdateManager:
         """
         # 1. 添加新对话到滑动窗口
         new_turn = self.sliding_window.add_turn(user_input, llm_response)
-        logger.info(f"新对话已添加到滑动窗口: {new_turn.turn_id[:8]}")
+        logger.info(f"新对话已添加到滑动窗口: {new_turn.short_id}")
         
         # 2. 检查是否有需要处理的目标轮次
         target_turn = self.sliding_window.get_processing_target()
@@ -87,7 +87,7 @@ class DelayedUpdateManager:
         self.update_stats["total_updates_attempted"] += 1
         
         try:
-            logger.info(f"开始处理目标轮次: 序号={target_turn.sequence}, ID={target_turn.turn_id[:8]}")
+            logger.info(f"开始处理目标轮次: 序号={target_turn.sequence}, ID={target_turn.short_id}")
             
             # 获取最近的对话上下文
             recent_context = self.sliding_window.get_recent_context(max_turns=3)
@@ -252,17 +252,17 @@ class DelayedUpdateManager:
             except Exception as e:
                 logger.warning(f"节点更新失败: {e}")
         
-        # 应用边更新
+        # 应用边更新：收集后一次性批量添加
+        edge_batch = []
         for edge_add in execution_format.get("edges_to_add", []):
             try:
-                source = edge_add.get("source")
-                target = edge_add.get("target")
-                relationship = edge_add.get("relationship")
-                
-                self.memory.add_edge(source, target, relationship)
-                update_count += 1
-                logger.debug(f"应用边更新: {source} -> {target}")
-                
+                edge_batch.append((edge_add.get("source"), edge_add.get("target"), edge_add.get("relationship"), {}))
+            except Exception as e:
+                logger.warning(f"边更新失败: {e}")
+        
+        if edge_batch:
+            try:
+                update_count += self.memory.bulk_add_edges(edge_batch)
             except Exception as e:
                 logger.warning(f"边更新失败: {e}")
         
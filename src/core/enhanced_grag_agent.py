@@ -5,12 +5,25 @@
 
 from typing import Dict, Any, List, Optional
 from loguru import logger
+import asyncio
+import functools
 import json
+import re
+import sys
 
 from .grag_update_agent import GRAGUpdateAgent
 from src.core.llm_client import LLMClient
 from src.graph.knowledge_graph import KnowledgeGraph
 
+# 节点ID常见前缀（只移除第一个匹配的前缀）
+_NODE_ID_PREFIX_RE = re.compile(r"^(?:character|item|location|npc|player)_")
+
+# 取值集合很小的分类属性，其字符串值会被intern以便在大量节点间共享
+_INTERNED_ATTRIBUTES = frozenset({
+    "type", "race", "profession", "category", "location_type", "rarity",
+    "disposition", "threat_level", "location", "safety_level", "status",
+})
+
 
 class EnhancedGRAGAgent(GRAGUpdateAgent):
     """
@@ -23,6 +36,18 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
     def __init__(self, llm_client: LLMClient):
         super().__init__(llm_client)
         self.world_context = self._build_world_context()
+        # 预先展开世界观默认属性，避免每次增强时逐层查找world_context
+        self._race_defaults = self._flatten_defaults("races")
+        self._profession_defaults = self._flatten_defaults("professions")
+        self._item_category_defaults = self._flatten_defaults("item_categories")
+        self._location_defaults = self._flatten_defaults("locations")
+        # 节点类型 -> 属性增强函数
+        self._attribute_enhancers = {
+            "character": self._enhance_character_attributes,
+            "item": self._enhance_item_attributes,
+            "location": self._enhance_location_attributes,
+            "event": self._enhance_event_attributes,
+        }
         
     def _build_world_context(self) -> Dict[str, Any]:
         """构建世界观上下文"""
@@ -89,6 +114,13 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
             }
         }
     
+    def _flatten_defaults(self, section: str) -> Dict[str, tuple]:
+        """将world_context中某一类的default_attributes展开为 {key: ((属性, 值), ...)}"""
+        return {
+            key: tuple(entry["default_attributes"].items())
+            for key, entry in self.world_context[section].items()
+        }
+    
     def analyze_conversation_for_updates(
         self, 
         user_input: str, 
@@ -100,30 +132,84 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
         增强版对话分析，确保完整节点创建
         """
         try:
-            # 使用增强prompt进行分析
+            # 使用增强prompt进行分析（父类负责分析结果缓存，命中时返回独立副本）
             analysis_result = super().analyze_conversation_for_updates(
                 user_input, llm_response, current_graph, recent_context
             )
+            return self._apply_enhancement(analysis_result, current_graph)
             
-            if "error" in analysis_result:
-                return analysis_result
-            
-            # 增强操作：确保节点完整性
-            enhanced_operations = self._enhance_operations(
-                analysis_result.get("operations", []),
-                current_graph
+        except Exception as e:
+            logger.error(f"增强GRAG分析失败: {e}")
+            return {"operations": [], "error": str(e)}
+    
+    async def analyze_conversation_for_updates_async(
+        self, 
+        user_input: str, 
+        llm_response: str, 
+        current_graph: KnowledgeGraph,
+        recent_context: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        增强版对话分析的异步版本：LLM请求经异步客户端并发发出，
+        返回后再进行（纯CPU的）节点增强
+        """
+        try:
+            analysis_result = await super().analyze_conversation_for_updates_async(
+                user_input, llm_response, current_graph, recent_context
             )
-            
-            analysis_result["operations"] = enhanced_operations
-            analysis_result["enhanced"] = True
-            
-            logger.info(f"增强分析完成: {len(enhanced_operations)} 个增强操作")
-            return analysis_result
+            return self._apply_enhancement(analysis_result, current_graph)
             
         except Exception as e:
             logger.error(f"增强GRAG分析失败: {e}")
             return {"operations": [], "error": str(e)}
     
+    async def analyze_batch(
+        self,
+        turns: List[Dict[str, Any]],
+        current_graph: KnowledgeGraph
+    ) -> List[Dict[str, Any]]:
+        """
+        并发分析多轮对话
+        
+        Args:
+            turns: 每项包含 user_input、llm_response，可选 recent_context
+            current_graph: 当前知识图谱状态（分析期间只读）
+            
+        Returns:
+            与turns顺序一致的分析结果列表
+        """
+        tasks = [
+            self.analyze_conversation_for_updates_async(
+                turn["user_input"],
+                turn["llm_response"],
+                current_graph,
+                turn.get("recent_context")
+            )
+            for turn in turns
+        ]
+        return list(await asyncio.gather(*tasks))
+    
+    def _apply_enhancement(
+        self,
+        analysis_result: Dict[str, Any],
+        current_graph: KnowledgeGraph
+    ) -> Dict[str, Any]:
+        """对父类的分析结果做节点完整性增强"""
+        if "error" in analysis_result:
+            return analysis_result
+        
+        # 增强操作：确保节点完整性
+        enhanced_operations = self._enhance_operations(
+            analysis_result.get("operations", []),
+            current_graph
+        )
+        
+        analysis_result["operations"] = enhanced_operations
+        analysis_result["enhanced"] = True
+        
+        logger.info("增强分析完成: {} 个增强操作", len(enhanced_operations))
+        return analysis_result
+    
     def _enhance_operations(
         self, 
         operations: List[Dict[str, Any]], 
@@ -132,19 +218,38 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
         """
         增强操作列表，确保节点完整性
         """
+        if not operations:
+            return operations
+        
+        # 快速路径：只有边操作且端点都已存在时无需任何增强
+        # 直接使用NetworkX内部的节点字典做成员检查，省去has_node方法调用
+        graph = current_graph.graph
+        graph_nodes = getattr(graph, "_node", None)
+        if graph_nodes is None:
+            graph_nodes = graph.nodes
+        if all(
+            op.get("type") == "add_edge"
+            and (not op.get("source") or op["source"] in graph_nodes)
+            and (not op.get("target") or op["target"] in graph_nodes)
+            for op in operations
+        ):
+            return operations
+        
         enhanced_ops = []
-        node_creation_queue = {}
         edge_queue = []
+        # 已存在或将要创建的节点ID，一次构建后只做集合成员检查
+        known_nodes = set(graph_nodes)
         
         # 第一轮：处理节点创建和更新，收集边创建请求
         for op in operations:
-            if op.get("type") == "add_node":
+            op_type = op.get("type")
+            if op_type == "add_node":
                 # 增强节点创建
                 enhanced_node = self._enhance_node_creation(op)
                 enhanced_ops.append(enhanced_node)
-                node_creation_queue[op["node_id"]] = enhanced_node
+                known_nodes.add(op["node_id"])
                 
-            elif op.get("type") == "add_edge":
+            elif op_type == "add_edge":
                 # 延迟边处理，确保节点存在
                 edge_queue.append(op)
                 
@@ -152,17 +257,20 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
                 # 其他操作直接添加
                 enhanced_ops.append(op)
         
-        # 第二轮：处理边创建，如果目标节点不存在则创建
+        # 第二轮：处理边创建，如果源/目标节点不存在则创建占位符节点
         for edge_op in edge_queue:
-            missing_nodes = self._check_missing_nodes_for_edge(
-                edge_op, current_graph, node_creation_queue
-            )
-            
-            # 为缺失的节点创建占位符节点
-            for node_id, node_info in missing_nodes.items():
+            for endpoint, inferred_from in (("source", "edge_source"), ("target", "edge_target")):
+                node_id = edge_op.get(endpoint)
+                if not node_id or node_id in known_nodes:
+                    continue
+                
+                node_info = {
+                    "inferred_from": inferred_from,
+                    "relationship": edge_op.get("relationship", "unknown")
+                }
                 placeholder_node = self._create_placeholder_node(node_id, node_info)
                 enhanced_ops.append(placeholder_node)
-                node_creation_queue[node_id] = placeholder_node
+                known_nodes.add(node_id)
                 logger.info(f"为边关系创建占位符节点: {node_id}")
             
             # 添加边操作
@@ -173,211 +281,123 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
     def _enhance_node_creation(self, node_op: Dict[str, Any]) -> Dict[str, Any]:
         """
         增强节点创建，添加基于世界观的完整属性
+        
+        注意：直接在传入的操作字典（及其attributes）上补全属性并返回同一对象，
+        调用方传入的操作会被消费。
         """
-        enhanced_op = node_op.copy()
         node_type = node_op.get("node_type", "unknown")
-        attributes = node_op.get("attributes", {})
+        attributes = node_op.setdefault("attributes", {})
+        original_count = len(attributes)
         
         # 基于节点类型添加默认属性
-        if node_type == "character":
-            enhanced_attributes = self._enhance_character_attributes(attributes)
-        elif node_type == "item":
-            enhanced_attributes = self._enhance_item_attributes(attributes)
-        elif node_type == "location":
-            enhanced_attributes = self._enhance_location_attributes(attributes)
-        elif node_type == "event":
-            enhanced_attributes = self._enhance_event_attributes(attributes)
-        else:
-            enhanced_attributes = self._enhance_generic_attributes(attributes)
-        
-        enhanced_op["attributes"] = enhanced_attributes
-        enhanced_op["enhanced"] = True
-        
-        logger.debug(f"增强节点 {node_op['node_id']}: 添加了 {len(enhanced_attributes) - len(attributes)} 个属性")
-        return enhanced_op
+        enhancer = self._attribute_enhancers.get(node_type, self._enhance_generic_attributes)
+        enhancer(attributes)
+        self._intern_categorical_values(attributes)
+        
+        node_op["enhanced"] = True
+        
+        logger.opt(lazy=True).debug(
+            "增强节点 {}: 添加了 {} 个属性",
+            lambda: node_op["node_id"],
+            lambda: len(attributes) - original_count
+        )
+        return node_op
+    
+    @staticmethod
+    def _intern_categorical_values(attributes: Dict[str, Any]):
+        """intern分类属性的字符串值（LLM返回的JSON值不会被自动intern）"""
+        for key in _INTERNED_ATTRIBUTES.intersection(attributes):
+            value = attributes[key]
+            if isinstance(value, str):
+                attributes[key] = sys.intern(value)
     
     def _enhance_character_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """增强角色节点属性"""
-        enhanced = attributes.copy()
-        
+        """增强角色节点属性（原地补全）"""
         # 必备基础属性
-        if "name" not in enhanced:
-            enhanced["name"] = enhanced.get("node_id", "Unknown Character")
-        if "type" not in enhanced:
-            enhanced["type"] = "character"
-        if "description" not in enhanced:
-            enhanced["description"] = f"A character named {enhanced.get('name', 'Unknown')}"
+        name = attributes.setdefault("name", attributes.get("node_id", "Unknown Character"))
+        attributes.setdefault("type", "character")
+        if "description" not in attributes:
+            attributes["description"] = f"A character named {name}"
         
         # 根据种族添加属性
-        race = enhanced.get("race", "").lower()
-        if race and race in self.world_context["races"]:
-            race_defaults = self.world_context["races"][race]["default_attributes"]
-            for key, value in race_defaults.items():
-                if key not in enhanced:
-                    enhanced[key] = value
+        for key, value in self._race_defaults.get(attributes.get("race", "").lower(), ()):
+            attributes.setdefault(key, value)
         
         # 根据职业添加属性
-        profession = enhanced.get("profession", "").lower()
-        if profession and profession in self.world_context["professions"]:
-            prof_defaults = self.world_context["professions"][profession]["default_attributes"]
-            for key, value in prof_defaults.items():
-                if key not in enhanced:
-                    enhanced[key] = value
+        for key, value in self._profession_defaults.get(attributes.get("profession", "").lower(), ()):
+            attributes.setdefault(key, value)
         
         # 默认状态属性
-        if "health" not in enhanced:
-            enhanced["health"] = enhanced.get("max_health", 100)
-        if "location" not in enhanced:
-            enhanced["location"] = "unknown"
-        if "disposition" not in enhanced:
-            enhanced["disposition"] = "neutral"
-        if "threat_level" not in enhanced:
-            enhanced["threat_level"] = "unknown"
-        
-        return enhanced
+        if "health" not in attributes:
+            attributes["health"] = attributes.get("max_health", 100)
+        attributes.setdefault("location", "unknown")
+        attributes.setdefault("disposition", "neutral")
+        attributes.setdefault("threat_level", "unknown")
+        
+        return attributes
     
     def _enhance_item_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """增强物品节点属性"""
-        enhanced = attributes.copy()
-        
+        """增强物品节点属性（原地补全）"""
         # 必备基础属性
-        if "name" not in enhanced:
-            enhanced["name"] = enhanced.get("node_id", "Unknown Item")
-        if "type" not in enhanced:
-            enhanced["type"] = "item"
-        if "category" not in enhanced:
-            enhanced["category"] = "misc"
-        if "description" not in enhanced:
-            enhanced["description"] = f"An item called {enhanced.get('name', 'Unknown')}"
+        name = attributes.setdefault("name", attributes.get("node_id", "Unknown Item"))
+        attributes.setdefault("type", "item")
+        attributes.setdefault("category", "misc")
+        if "description" not in attributes:
+            attributes["description"] = f"An item called {name}"
         
         # 根据分类添加属性
-        category = enhanced.get("category", "").lower()
-        if category and category in self.world_context["item_categories"]:
-            cat_defaults = self.world_context["item_categories"][category]["default_attributes"]
-            for key, value in cat_defaults.items():
-                if key not in enhanced:
-                    enhanced[key] = value
+        for key, value in self._item_category_defaults.get(attributes.get("category", "").lower(), ()):
+            attributes.setdefault(key, value)
         
         # 默认物品属性
-        if "rarity" not in enhanced:
-            enhanced["rarity"] = "common"
-        if "durability" not in enhanced:
-            enhanced["durability"] = "good"
-        if "value" not in enhanced:
-            enhanced["value"] = "unknown"
-        
-        return enhanced
+        attributes.setdefault("rarity", "common")
+        attributes.setdefault("durability", "good")
+        attributes.setdefault("value", "unknown")
+        
+        return attributes
     
     def _enhance_location_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """增强地点节点属性"""
-        enhanced = attributes.copy()
-        
+        """增强地点节点属性（原地补全）"""
         # 必备基础属性
-        if "name" not in enhanced:
-            enhanced["name"] = enhanced.get("node_id", "Unknown Location")
-        if "type" not in enhanced:
-            enhanced["type"] = "location"
-        if "description" not in enhanced:
-            enhanced["description"] = f"A location called {enhanced.get('name', 'Unknown')}"
+        name = attributes.setdefault("name", attributes.get("node_id", "Unknown Location"))
+        attributes.setdefault("type", "location")
+        if "description" not in attributes:
+            attributes["description"] = f"A location called {name}"
         
         # 根据地点类型添加属性
-        location_type = enhanced.get("location_type", "").lower()
-        if location_type and location_type in self.world_context["locations"]:
-            loc_defaults = self.world_context["locations"][location_type]["default_attributes"]
-            for key, value in loc_defaults.items():
-                if key not in enhanced:
-                    enhanced[key] = value
+        for key, value in self._location_defaults.get(attributes.get("location_type", "").lower(), ()):
+            attributes.setdefault(key, value)
         
         # 默认地点属性
-        if "safety_level" not in enhanced:
-            enhanced["safety_level"] = "unknown"
-        if "accessibility" not in enhanced:
-            enhanced["accessibility"] = "unknown"
+        attributes.setdefault("safety_level", "unknown")
+        attributes.setdefault("accessibility", "unknown")
         
-        return enhanced
+        return attributes
     
     def _enhance_event_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """增强事件节点属性"""
-        enhanced = attributes.copy()
-        
+        """增强事件节点属性（原地补全）"""
         # 必备基础属性
-        if "name" not in enhanced:
-            enhanced["name"] = enhanced.get("node_id", "Unknown Event")
-        if "type" not in enhanced:
-            enhanced["type"] = "event"
-        if "timestamp" not in enhanced:
-            enhanced["timestamp"] = "recent"
-        if "description" not in enhanced:
-            enhanced["description"] = f"An event called {enhanced.get('name', 'Unknown')}"
+        name = attributes.setdefault("name", attributes.get("node_id", "Unknown Event"))
+        attributes.setdefault("type", "event")
+        attributes.setdefault("timestamp", "recent")
+        if "description" not in attributes:
+            attributes["description"] = f"An event called {name}"
         
         # 默认事件属性
-        if "outcome" not in enhanced:
-            enhanced["outcome"] = "ongoing"
-        if "importance" not in enhanced:
-            enhanced["importance"] = "medium"
+        attributes.setdefault("outcome", "ongoing")
+        attributes.setdefault("importance", "medium")
         
-        return enhanced
+        return attributes
     
     def _enhance_generic_attributes(self, attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """增强通用节点属性"""
-        enhanced = attributes.copy()
-        
+        """增强通用节点属性（原地补全）"""
         # 通用必备属性
-        if "name" not in enhanced:
-            enhanced["name"] = enhanced.get("node_id", "Unknown Entity")
-        if "type" not in enhanced:
-            enhanced["type"] = "unknown"
-        if "description" not in enhanced:
-            enhanced["description"] = f"An entity called {enhanced.get('name', 'Unknown')}"
-        
-        return enhanced
-    
-    def _check_missing_nodes_for_edge(
-        self, 
-        edge_op: Dict[str, Any], 
-        current_graph: KnowledgeGraph,
-        node_creation_queue: Dict[str, Dict[str, Any]]
-    ) -> Dict[str, Dict[str, Any]]:
-        """
-        检查边操作中缺失的节点
-        """
-        missing_nodes = {}
-        source = edge_op.get("source")
-        target = edge_op.get("target")
-        
-        # 检查源节点
-        if source and not self._node_exists_or_will_be_created(
-            source, current_graph, node_creation_queue
-        ):
-            missing_nodes[source] = {
-                "inferred_from": "edge_source",
-                "relationship": edge_op.get("relationship", "unknown")
-            }
+        name = attributes.setdefault("name", attributes.get("node_id", "Unknown Entity"))
+        attributes.setdefault("type", "unknown")
+        if "description" not in attributes:
+            attributes["description"] = f"An entity called {name}"
         
-        # 检查目标节点
-        if target and not self._node_exists_or_will_be_created(
-            target, current_graph, node_creation_queue
-        ):
-            missing_nodes[target] = {
-                "inferred_from": "edge_target",
-                "relationship": edge_op.get("relationship", "unknown")
-            }
-        
-        return missing_nodes
-    
-    def _node_exists_or_will_be_created(
-        self, 
-        node_id: str, 
-        current_graph: KnowledgeGraph,
-        node_creation_queue: Dict[str, Dict[str, Any]]
-    ) -> bool:
-        """
-        检查节点是否存在或将要被创建
-        """
-        return (
-            current_graph.graph.has_node(node_id) or 
-            node_id in node_creation_queue
-        )
+        return attributes
     
     def _create_placeholder_node(self, node_id: str, node_info: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -421,8 +441,10 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
         
         return placeholder
     
-    def _infer_node_type_from_id(self, node_id: str) -> str:
-        """从节点ID推断节点类型"""
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _infer_node_type_from_id(node_id: str) -> str:
+        """从节点ID推断节点类型（结果按节点ID缓存）"""
         node_id_lower = node_id.lower()
         
         # 常见角色关键词
@@ -446,16 +468,11 @@ class EnhancedGRAGAgent(GRAGUpdateAgent):
         # 默认为未知
         return "unknown"
     
-    def _infer_node_name_from_id(self, node_id: str) -> str:
-        """从节点ID推断显示名称"""
-        # 移除常见前缀
-        name = node_id
-        for prefix in ["character_", "item_", "location_", "npc_", "player_"]:
-            if name.startswith(prefix):
-                name = name[len(prefix):]
-                break
-        
-        # 替换下划线为空格并首字母大写
-        name = name.replace("_", " ").title()
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _infer_node_name_from_id(node_id: str) -> str:
+        """从节点ID推断显示名称（结果按节点ID缓存）"""
+        # 移除常见前缀，替换下划线为空格并首字母大写
+        name = _NODE_ID_PREFIX_RE.sub("", node_id, count=1).replace("_", " ").title()
         
         return name if name else node_id
\ No newline at end of file
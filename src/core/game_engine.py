@@ -1,6 +1,6 @@
 import json
 import re
-from typing import Dict, Any, List, TYPE_CHECKING
+from typing import Dict, Any, List, Optional, TYPE_CHECKING
 from loguru import logger
 
 from src.utils.config import config
@@ -73,33 +73,27 @@ class GameEngine:
             nodes_added = 0
             edges_added = 0
             
-            for node_data in nodes:
-                try:
-                    self.memory.add_or_update_node(
-                        node_data['node_id'], 
-                        node_data['type'], 
-                        **node_data.get('attributes', {})
-                    )
-                    nodes_added += 1
-                except Exception as e:
-                    logger.warning(f"Failed to add node {node_data.get('node_id', 'unknown')}: {e}")
+            try:
+                nodes_added = self.memory.bulk_add_or_update_nodes([
+                    (node_data['node_id'], node_data['type'], node_data.get('attributes', {}))
+                    for node_data in nodes
+                ])
+            except Exception as e:
+                logger.warning(f"Failed to add nodes: {e}")
             
-            for edge_data in edges:
-                try:
-                    self.memory.add_edge(
-                        edge_data['source'], 
-                        edge_data['target'], 
-                        edge_data['relationship']
-                    )
-                    edges_added += 1
-                except Exception as e:
-                    logger.warning(f"Failed to add edge {edge_data.get('source', '')} -> {edge_data.get('target', '')}: {e}")
+            try:
+                edges_added = self.memory.bulk_add_edges([
+                    (edge_data['source'], edge_data['target'], edge_data['relationship'], {})
+                    for edge_data in edges
+                ])
+            except Exception as e:
+                logger.warning(f"Failed to add edges: {e}")
             
             logger.info(f"Successfully initialized graph: {nodes_added} nodes, {edges_added} edges added.")
             
-            # 保存知识图谱
-            if self.memory.graph_save_path:
-                self.memory.knowledge_graph.save_graph(self.memory.graph_save_path)
+            # 保存知识图谱（仅在有变化时，后台异步写盘）
+            if nodes_added or edges_added:
+                self.memory.schedule_graph_save()
             
             return {
                 "nodes_added": nodes_added,
@@ -142,32 +136,91 @@ class GameEngine:
     def _extract_with_agent(self, user_input: str, llm_response: str) -> Dict[str, Any]:
         """使用GRAG Agent进行智能分析"""
         try:
+            skipped = self._check_agent_analysis(user_input, llm_response)
+            if skipped is not None:
+                return skipped
+            
             # 1. Agent分析对话生成更新指令
-            recent_context = self._get_recent_conversation_context()
             analysis_result = self.grag_agent.analyze_conversation_for_updates(
-                user_input=user_input,
-                llm_response=llm_response, 
-                current_graph=self.memory.knowledge_graph,
-                recent_context=recent_context
+                **self._agent_analysis_args(user_input, llm_response)
             )
             
-            if "error" in analysis_result:
-                logger.warning(f"Agent分析失败，回退到本地处理器: {analysis_result['error']}")
-                return self._extract_with_local_processor(llm_response)
-            
-            # 2. 将Agent结果转换为执行格式
-            execution_format = self.grag_agent.convert_to_execution_format(analysis_result)
+            # 2~4. 转换、验证并应用更新
+            return self._apply_agent_result(analysis_result, llm_response)
             
-            # 3. 验证更新
-            validated_updates = self.validation_layer.validate(execution_format, self.memory.knowledge_graph)
+        except Exception as e:
+            return self._fallback_after_agent_error(e, llm_response)
+    
+    def _check_agent_analysis(self, user_input: str, llm_response: str) -> Optional[Dict[str, Any]]:
+        """
+        Agent分析前的检查，需要调用LLM分析时返回 None，否则直接返回本轮的更新结果：
+        LLM熔断期间使用本地处理器，既无已知实体也无RPG事件关键词的闲聊轮次直接跳过
+        """
+        # LLM熔断期间直接使用本地处理器，不再构建上下文和Prompt
+        if not self.grag_agent.llm_client.is_available():
+            logger.info("LLM暂不可用，使用本地文本处理器提取更新...")
+            return self._extract_with_local_processor(llm_response)
+        
+        if not self.grag_agent.requires_analysis(user_input, llm_response, self.memory.knowledge_graph):
+            logger.info("对话未涉及任何实体或事件，跳过GRAG分析")
+            return {"nodes_updated": 0, "edges_added": 0, "nodes_deleted": 0, "edges_deleted": 0}
+        return None
+    
+    def _agent_analysis_args(self, user_input: str, llm_response: str) -> Dict[str, Any]:
+        """构建 analyze_conversation_for_updates(_async) 的参数"""
+        return {
+            "user_input": user_input,
+            "llm_response": llm_response,
+            "current_graph": self.memory.knowledge_graph,
+            "recent_context": self._get_recent_conversation_context()
+        }
+    
+    def _apply_agent_result(self, analysis_result: Dict[str, Any], llm_response: str) -> Dict[str, Any]:
+        """将Agent分析结果转换、验证并应用到知识图谱；分析失败时回退到本地处理器"""
+        if "error" in analysis_result:
+            logger.warning(f"Agent分析失败，回退到本地处理器: {analysis_result['error']}")
+            return self._extract_with_local_processor(llm_response)
+        
+        # 2. 将Agent结果转换为执行格式
+        execution_format = self.grag_agent.convert_to_execution_format(analysis_result)
+        
+        # 3. 验证更新
+        validated_updates = self.validation_layer.validate(execution_format, self.memory.knowledge_graph)
+        
+        # 4. 应用更新
+        return self._apply_validated_updates(validated_updates, source="grag_agent")
+    
+    def _fallback_after_agent_error(self, error: Exception, llm_response: str) -> Dict[str, Any]:
+        logger.error(f"Agent分析过程出错: {error}")
+        logger.info("回退到本地文本处理器...")
+        return self._extract_with_local_processor(llm_response)
+    
+    async def extract_updates_from_response_async(self, llm_response: str, user_input: str = "") -> Dict[str, Any]:
+        """
+        extract_updates_from_response 的异步版本：GRAG Agent的LLM请求不阻塞事件循环，
+        多个会话的更新分析可以并发进行。
+        """
+        if self.grag_agent:
+            logger.info("使用GRAG智能Agent分析对话更新(异步)...")
+            return await self._extract_with_agent_async(user_input, llm_response)
+        else:
+            logger.info("使用本地文本处理器提取更新...")
+            return self._extract_with_local_processor(llm_response)
+    
+    async def _extract_with_agent_async(self, user_input: str, llm_response: str) -> Dict[str, Any]:
+        """使用GRAG Agent进行智能分析（异步LLM请求）"""
+        try:
+            skipped = self._check_agent_analysis(user_input, llm_response)
+            if skipped is not None:
+                return skipped
             
-            # 4. 应用更新
-            return self._apply_validated_updates(validated_updates, source="grag_agent")
+            analysis_result = await self.grag_agent.analyze_conversation_for_updates_async(
+                **self._agent_analysis_args(user_input, llm_response)
+            )
+            return self._apply_agent_result(analysis_result, llm_response)
             
         except Exception as e:
-            logger.error(f"Agent分析过程出错: {e}")
-            logger.info("回退到本地文本处理器...")
-            return self._extract_with_local_processor(llm_response)
+            return self._fallback_after_agent_error(e, llm_response)
     
     def _extract_with_local_processor(self, llm_response: str) -> Dict[str, Any]:
         """使用本地RPG文本处理器（回退方案）"""
@@ -202,51 +255,67 @@ class GameEngine:
         nodes_deleted_count = deletion_stats.get("nodes_deleted", 0)
         edges_deleted_count = deletion_stats.get("edges_deleted", 0)
 
-        # 应用节点更新
+        # 应用节点更新：按是否已存在划分后批量写入
+        graph = self.memory.knowledge_graph.graph
+        node_batch = []
         for node_update in validated_updates.get("nodes_to_update", []):
+            node_id = node_update.get('node_id')
+            if not node_id:
+                logger.warning(f"Skipping node update without node_id: {node_update}")
+                nodes_updated_count -= 1
+                continue
+            if node_id in graph:
+                # 节点存在，只更新属性
+                node_type = graph.nodes[node_id].get('type', 'unknown')
+            else:
+                # 尝试从属性中推断类型
+                node_type = node_update.get('type', 'unknown')
+                if node_type == 'unknown' and "location" in node_update.get('attributes', {}):
+                    node_type = "character" # 有位置的通常是角色
+            node_batch.append((node_id, node_type, node_update.get('attributes', {})))
+        
+        if node_batch:
             try:
-                # 检查节点是否存在，如果不存在则创建
-                if not self.memory.knowledge_graph.graph.has_node(node_update['node_id']):
-                    # 尝试从属性中推断类型
-                    node_type = node_update.get('type', 'unknown')
-                    if node_type == 'unknown' and "location" in node_update.get('attributes', {}):
-                        node_type = "character" # 有位置的通常是角色
-                    
-                    self.memory.add_or_update_node(
-                        node_update['node_id'], 
-                        node_type, 
-                        **node_update['attributes']
-                    )
-                else:
-                    # 节点存在，只更新属性
-                    existing_node = self.memory.knowledge_graph.get_node(node_update['node_id'])
-                    node_type = existing_node.get('type', 'unknown')
-                    self.memory.add_or_update_node(
-                        node_update['node_id'], 
-                        node_type, 
-                        **node_update['attributes']
-                    )
+                self.memory.bulk_add_or_update_nodes(node_batch)
             except Exception as e:
-                logger.warning(f"Failed to update node {node_update['node_id']}: {e}")
-                nodes_updated_count -= 1
+                # 批量写入失败时逐个重试，只统计实际写入的节点
+                logger.warning(f"Bulk node update failed, retrying one by one: {e}")
+                nodes_updated_count = 0
+                for node_id, node_type, attributes in node_batch:
+                    try:
+                        self.memory.add_or_update_node(node_id, node_type, **attributes)
+                        nodes_updated_count += 1
+                    except Exception as node_error:
+                        logger.warning(f"Failed to update node {node_id}: {node_error}")
         
         # 应用边更新
-        for edge_add in validated_updates.get("edges_to_add", []):
+        edge_batch = [
+            (edge_add['source'], edge_add['target'], edge_add['relationship'], {})
+            for edge_add in validated_updates.get("edges_to_add", [])
+        ]
+        if edge_batch:
             try:
-                self.memory.add_edge(
-                    edge_add['source'], 
-                    edge_add['target'], 
-                    edge_add['relationship']
-                )
+                edges_added_count = self.memory.bulk_add_edges(edge_batch)
             except Exception as e:
-                logger.warning(f"Failed to add edge {edge_add['source']} -> {edge_add['target']}: {e}")
-                edges_added_count -= 1
+                # 批量写入失败时逐个重试，只统计实际添加的边
+                logger.warning(f"Bulk edge update failed, retrying one by one: {e}")
+                edges_added_count = 0
+                for source_node, target_node, relationship, _ in edge_batch:
+                    if source_node not in graph or target_node not in graph:
+                        logger.warning(f"Edge '{source_node}' -> '{target_node}' skipped: endpoint not found.")
+                        continue
+                    try:
+                        self.memory.add_edge(source_node, target_node, relationship)
+                        edges_added_count += 1
+                    except Exception as edge_error:
+                        logger.warning(f"Failed to add edge {source_node} -> {target_node}: {edge_error}")
         
         logger.info(f"成功应用更新({source}): {nodes_updated_count} nodes updated, {edges_added_count} edges added, {nodes_deleted_count} nodes deleted, {edges_deleted_count} edges deleted.")
         
-        # 保存知识图谱
-        if self.memory.graph_save_path:
-            self.memory.knowledge_graph.save_graph(self.memory.graph_save_path)
+        # 保存知识图谱（仅在有变化时，后台异步写盘）
+        has_changes = nodes_updated_count or edges_added_count or nodes_deleted_count or edges_deleted_count
+        if has_changes:
+            self.memory.schedule_graph_save()
         
         return {
             "nodes_updated": nodes_updated_count, 
@@ -257,22 +326,21 @@ class GameEngine:
     
     def _get_recent_conversation_context(self) -> str:
         """获取最近的对话上下文用于Agent分析"""
-        try:
-            recent_history = self.memory.basic_memory.conversation_history[-3:]  # 最近3轮对话
-            context_parts = []
-            
-            for turn in recent_history:
-                user_msg = turn.get("user", "")
-                assistant_msg = turn.get("assistant", "")
-                if user_msg:
-                    context_parts.append(f"用户: {user_msg}")
-                if assistant_msg:
-                    context_parts.append(f"助手: {assistant_msg}")
-            
-            return "\n".join(context_parts) if context_parts else ""
-        except:
-            return ""
+        # 最近3轮对话，由BasicMemory在添加对话时增量维护
+        return self.memory.basic_memory.get_recent_context()
 
+    @staticmethod
+    def _candidate_edges(graph, source: str, target: str):
+        """
+        通配符删边时的候选边：源或目标已知时只取其邻接边（O(度数)），
+        只有源和目标都是通配符时才扫描全图
+        """
+        if source != "*":
+            return graph.out_edges(source, data=True) if source in graph else ()
+        if target != "*":
+            return graph.in_edges(target, data=True) if target in graph else ()
+        return graph.edges(data=True)
+    
     def _process_deletion_events(self, validated_updates: Dict[str, Any]) -> Dict[str, int]:
         """
         处理删除事件，包括节点删除和边删除
@@ -323,22 +391,14 @@ class GameEngine:
                 reason = edge_deletion.get("reason", "No reason provided")
                 
                 # 支持通配符删除
-                if source == "*" or relationship == "*":
-                    # 找到所有匹配的边并删除
+                if source == "*" or target == "*" or relationship == "*":
                     graph = self.memory.knowledge_graph.graph
-                    edges_to_remove = []
-                    
-                    for src, tgt, edge_data in graph.edges(data=True):
-                        match = True
-                        if source != "*" and src != source:
-                            match = False
-                        if target != "*" and tgt != target:
-                            match = False
-                        if relationship != "*" and edge_data.get("relationship") != relationship:
-                            match = False
-                        
-                        if match:
-                            edges_to_remove.append((src, tgt, edge_data.get("relationship")))
+                    edges_to_remove = [
+                        (src, tgt, edge_data.get("relationship"))
+                        for src, tgt, edge_data in self._candidate_edges(graph, source, target)
+                        if (target == "*" or tgt == target)
+                        and (relationship == "*" or edge_data.get("relationship") == relationship)
+                    ]
                     
                     for src, tgt, rel in edges_to_remove:
                         if self.memory.delete_edge(src, tgt, rel):
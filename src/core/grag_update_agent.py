@@ -3,13 +3,201 @@ GRAG更新智能Agent
 使用LLM来智能分析对话并生成精确的知识图谱更新指令
 """
 
+import copy
+import hashlib
+import heapq
 import json
-from typing import Dict, Any, List, Optional
+import operator
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from loguru import logger
 from datetime import datetime
 
 from src.core.llm_client import LLMClient
 from src.graph.knowledge_graph import KnowledgeGraph
+from src.utils.keyword_matcher import KeywordMatcher
+from src.utils import json_utils
+
+# 分析结果缓存的最大条目数（精确层和归一化层各自独立计数）
+_ANALYSIS_CACHE_SIZE = 256
+
+# 分析请求的固定部分：作为系统消息发送，每轮逐字节相同，便于服务端复用Prompt前缀缓存
+_SYSTEM_INSTRUCTIONS = """你是一个专门分析RPG对话并生成知识图谱更新指令的智能Agent，也是RPG知识图谱管理专家。
+用户会提供一轮对话以及当前知识图谱中的相关状态，请确定需要对知识图谱进行的更新操作。
+
+请仔细分析对话内容，确定需要执行的操作。考虑以下方面:
+1. 新出现的实体（角色、物品、地点、组织等）
+2. 实体属性的变化（血量、等级、状态、位置等）
+3. 实体间关系的变化（装备、位置、敌对、友好等）
+4. 实体的消失或删除（死亡、丢失、离开等）
+5. 技能学习、状态获得等事件"""
+
+_JSON_SCHEMA_BLOCK = """请严格按照以下JSON格式返回分析结果:
+
+{
+    "analysis_summary": "对话分析总结",
+    "operations": [
+        {
+            "type": "add_node",
+            "node_id": "实体唯一ID",
+            "node_type": "实体类型(character/item/location/skill/organization/event)",
+            "attributes": {
+                "name": "实体名称",
+                "其他属性": "值"
+            },
+            "reason": "添加此节点的原因"
+        },
+        {
+            "type": "update_node",
+            "node_id": "现有节点ID",
+            "attributes": {
+                "属性名": "新值"
+            },
+            "reason": "更新原因"
+        },
+        {
+            "type": "add_edge",
+            "source": "源节点ID",
+            "target": "目标节点ID", 
+            "relationship": "关系类型",
+            "attributes": {},
+            "reason": "添加关系的原因"
+        },
+        {
+            "type": "delete_node",
+            "node_id": "要删除的节点ID",
+            "deletion_type": "death/lost/destroyed/other",
+            "reason": "删除原因"
+        },
+        {
+            "type": "delete_edge",
+            "source": "源节点ID",
+            "target": "目标节点ID",
+            "relationship": "要删除的关系类型",
+            "reason": "删除关系的原因"
+        }
+    ],
+    "confidence": "分析置信度(0-1)",
+    "notes": "额外说明或不确定的地方"
+}"""
+
+_REMINDERS = """重要提醒:
+- 只有在对话中明确提到变化时才生成操作
+- 不要重复创建已存在的节点或关系
+- 对于模糊或不确定的信息，降低置信度
+- 保持节点ID的一致性和可读性
+- 优先考虑显式信息，谨慎推断隐含信息"""
+
+_FIXED_PROMPT = "\n\n".join((_SYSTEM_INSTRUCTIONS, _JSON_SCHEMA_BLOCK, _REMINDERS))
+
+# 固定采样种子，使相同输入的分析结果尽量可复现
+_ANALYSIS_SEED = 42
+
+# 写入分析Prompt时省略的节点记录字段
+_PROMPT_EXCLUDED_KEYS = frozenset({
+    "created_time", "last_modified", "source", "_deleted_timestamp", "_history"
+})
+
+# 写入分析Prompt的相关节点和关系的数量上限
+_PROMPT_MAX_NODES = 20
+_PROMPT_MAX_EDGES = 10
+
+# LLM回复中被 ``` 或 ```json 包裹的JSON对象
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(\{.*\})\s*```", re.S)
+
+# 不可能引起图谱变化的简短应答（去掉首尾空白和标点、转小写后整句匹配）
+_TRIVIAL_REPLIES = frozenset({
+    "好", "好的", "好吧", "嗯", "嗯嗯", "哦", "噢", "行", "可以", "是的", "对", "明白", "知道了",
+    "谢谢", "多谢", "谢了", "收到", "继续",
+    "ok", "okay", "yes", "no", "yep", "sure", "thanks", "thank you", "thx", "got it", "continue"
+})
+_TRIVIAL_STRIP_CHARS = " \t\r\n.,!?~…。，！？～、"
+
+# 归一化文本时合并的连续空白（标点、正负号和小数点会影响数值含义，全部保留）
+_NORMALIZE_RE = re.compile(r"\s+")
+
+
+# convert_to_execution_format 的操作处理函数：按操作类型一次字典查找分发。
+# pending[列表名] 是 去重键 -> 执行项 的字典，重复的新增/更新合并属性，重复的删除保留第一条。
+
+_EXECUTION_KEYS = ("nodes_to_add", "nodes_to_update", "edges_to_add", "nodes_to_delete", "edges_to_delete")
+
+_node_id_of = operator.itemgetter("node_id")
+_edge_key_of = operator.itemgetter("source", "target", "relationship")
+
+
+def _convert_add_node(operation: Dict[str, Any], pending: Dict[str, Dict]):
+    node_id = _node_id_of(operation)
+    attributes = operation.get("attributes") or {}
+    entry = pending["nodes_to_add"].get(node_id)
+    if entry is None:
+        pending["nodes_to_add"][node_id] = {
+            "node_id": node_id,
+            "type": operation["node_type"],
+            "attributes": dict(attributes)
+        }
+    else:
+        entry["attributes"].update(attributes)
+
+
+def _convert_update_node(operation: Dict[str, Any], pending: Dict[str, Dict]):
+    node_id = _node_id_of(operation)
+    attributes = operation.get("attributes") or {}
+    entry = pending["nodes_to_update"].get(node_id)
+    if entry is None:
+        pending["nodes_to_update"][node_id] = {
+            "node_id": node_id,
+            "attributes": dict(attributes)
+        }
+    else:
+        entry["attributes"].update(attributes)
+
+
+def _convert_add_edge(operation: Dict[str, Any], pending: Dict[str, Dict]):
+    edge_key = _edge_key_of(operation)
+    attributes = operation.get("attributes") or {}
+    entry = pending["edges_to_add"].get(edge_key)
+    if entry is None:
+        pending["edges_to_add"][edge_key] = {
+            "source": edge_key[0],
+            "target": edge_key[1],
+            "relationship": edge_key[2],
+            "attributes": dict(attributes)
+        }
+    else:
+        entry["attributes"].update(attributes)
+
+
+def _convert_delete_node(operation: Dict[str, Any], pending: Dict[str, Dict]):
+    node_id = _node_id_of(operation)
+    if node_id not in pending["nodes_to_delete"]:
+        pending["nodes_to_delete"][node_id] = {
+            "node_id": node_id,
+            "deletion_type": operation.get("deletion_type", "other"),
+            "reason": operation["reason"]
+        }
+
+
+def _convert_delete_edge(operation: Dict[str, Any], pending: Dict[str, Dict]):
+    edge_key = (operation["source"], operation["target"], operation.get("relationship"))
+    if edge_key not in pending["edges_to_delete"]:
+        pending["edges_to_delete"][edge_key] = {
+            "source": edge_key[0],
+            "target": edge_key[1],
+            "relationship": edge_key[2],
+            "reason": operation["reason"]
+        }
+
+
+_EXECUTION_HANDLERS = {
+    "add_node": _convert_add_node,
+    "update_node": _convert_update_node,
+    "add_edge": _convert_add_edge,
+    "delete_node": _convert_delete_node,
+    "delete_edge": _convert_delete_edge,
+}
 
 
 class GRAGUpdateAgent:
@@ -20,6 +208,20 @@ class GRAGUpdateAgent:
     
     def __init__(self, llm_client: LLMClient):
         self.llm_client = llm_client
+        # 两级分析结果缓存（LRU）：精确匹配 + 忽略大小写和空白差异的归一化匹配
+        self._exact_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._normalized_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 节点名称/ID匹配器，按 (图对象, 版本号, 节点数) 失效重建
+        self._node_matcher: Optional[KeywordMatcher] = None
+        self._node_matcher_key: Optional[Tuple[int, int, int]] = None
+        # 节点ID -> 在图中的位置，与匹配器一同重建，用于保持上下文中的节点顺序
+        self._node_order: Dict[str, int] = {}
+        # 最近一次对话文本的节点提及扫描结果：(匹配器键, 用户输入, AI回复, 节点ID集合)
+        self._last_mention_scan: Optional[Tuple[Tuple[int, int, int], str, str, Dict[str, int]]] = None
+        # 节点最近一次出现在分析操作中的轮次，用于给相关节点排序
+        self._analysis_turn = 0
+        self._last_touched: Dict[str, int] = {}
         
     def analyze_conversation_for_updates(
         self, 
@@ -41,35 +243,169 @@ class GRAGUpdateAgent:
             结构化的更新指令
         """
         try:
-            # 1. 获取相关的图谱上下文
-            relevant_context = self._extract_relevant_graph_context(
-                user_input, llm_response, current_graph
-            )
-            
-            # 2. 构建分析Prompt
-            analysis_prompt = self._build_analysis_prompt(
-                user_input, llm_response, relevant_context, recent_context
+            cache_keys, cached_result, analysis_prompt = self._prepare_analysis(
+                user_input, llm_response, current_graph, recent_context
             )
+            if cached_result is not None:
+                return cached_result
             
-            # 3. 请求LLM进行分析
+            # 4. 请求LLM进行分析
             logger.info("正在请求GRAG更新分析...")
             analysis_result = self.llm_client.generate_response(
                 analysis_prompt,
                 max_tokens=2000,
                 temperature=0.1,  # 低温度确保一致性
-                system_message="你是一个专门分析RPG对话并生成知识图谱更新指令的智能Agent。请严格按照JSON格式返回分析结果。"
+                system_message=_FIXED_PROMPT,
+                seed=_ANALYSIS_SEED
             )
             
-            # 4. 解析LLM返回的更新指令
-            update_instructions = self._parse_llm_analysis(analysis_result)
+            return self._finish_analysis(analysis_result, cache_keys)
+            
+        except Exception as e:
+            logger.error(f"GRAG更新分析失败: {e}")
+            return {"operations": [], "error": str(e)}
+    
+    async def analyze_conversation_for_updates_async(
+        self, 
+        user_input: str, 
+        llm_response: str, 
+        current_graph: KnowledgeGraph,
+        recent_context: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        analyze_conversation_for_updates 的异步版本：LLM请求通过异步客户端发出，
+        多个会话的分析可以在同一事件循环中并发进行
+        """
+        try:
+            cache_keys, cached_result, analysis_prompt = self._prepare_analysis(
+                user_input, llm_response, current_graph, recent_context
+            )
+            if cached_result is not None:
+                return cached_result
+            
+            # 4. 请求LLM进行分析
+            logger.info("正在请求GRAG更新分析(异步)...")
+            analysis_result = await self.llm_client.agenerate_response(
+                analysis_prompt,
+                max_tokens=2000,
+                temperature=0.1,  # 低温度确保一致性
+                system_message=_FIXED_PROMPT,
+                seed=_ANALYSIS_SEED
+            )
             
-            logger.info(f"GRAG分析完成: {len(update_instructions.get('operations', []))} 个操作")
-            return update_instructions
+            return self._finish_analysis(analysis_result, cache_keys)
             
         except Exception as e:
             logger.error(f"GRAG更新分析失败: {e}")
             return {"operations": [], "error": str(e)}
     
+    def requires_analysis(
+        self,
+        user_input: str,
+        llm_response: str,
+        current_graph: KnowledgeGraph
+    ) -> bool:
+        """
+        廉价预判本轮对话是否可能改变图谱：只有用户输入和回复都是简短应答（如"谢谢"、"好的"）时
+        返回False，调用方可以直接跳过LLM分析；其余轮次（包括引入新实体的轮次）都需要分析
+        """
+        return not (self._is_trivial_reply(user_input) and self._is_trivial_reply(llm_response))
+    
+    @staticmethod
+    def _is_trivial_reply(text: str) -> bool:
+        return text.strip(_TRIVIAL_STRIP_CHARS).lower() in _TRIVIAL_REPLIES
+    
+    def _prepare_analysis(
+        self,
+        user_input: str,
+        llm_response: str,
+        current_graph: KnowledgeGraph,
+        recent_context: Optional[str]
+    ) -> Tuple[Tuple[str, str], Optional[Dict[str, Any]], Optional[str]]:
+        """
+        LLM调用前的准备步骤
+        
+        Returns:
+            (缓存键, 缓存命中的结果或None, 未命中时的分析Prompt)
+        """
+        # 1. 获取相关的图谱上下文
+        relevant_context = self._extract_relevant_graph_context(
+            user_input, llm_response, current_graph
+        )
+        
+        # 2. 查询分析结果缓存，命中则跳过LLM调用
+        cache_keys = self._analysis_cache_keys(
+            user_input, llm_response, relevant_context, recent_context
+        )
+        cached_result = self._get_cached_analysis(cache_keys)
+        if cached_result is not None:
+            logger.info(f"命中GRAG分析缓存: {len(cached_result.get('operations', []))} 个操作")
+            return cache_keys, cached_result, None
+        
+        # 3. 构建分析Prompt
+        analysis_prompt = self._build_analysis_prompt(
+            user_input, llm_response, relevant_context, recent_context
+        )
+        return cache_keys, None, analysis_prompt
+    
+    def _finish_analysis(self, analysis_result: str, cache_keys: Tuple[str, str]) -> Dict[str, Any]:
+        """解析LLM返回的更新指令并写入缓存"""
+        # 5. 解析LLM返回的更新指令
+        update_instructions = self._parse_llm_analysis(analysis_result)
+        if "error" not in update_instructions:
+            self._store_cached_analysis(cache_keys, update_instructions)
+            self._record_touched_nodes(update_instructions)
+        
+        logger.info(f"GRAG分析完成: {len(update_instructions.get('operations', []))} 个操作")
+        return update_instructions
+    
+    def _analysis_cache_keys(
+        self,
+        user_input: str,
+        llm_response: str,
+        relevant_context: Dict[str, Any],
+        recent_context: Optional[str]
+    ) -> Tuple[str, str]:
+        """
+        生成 (精确键, 归一化键)。两者都包含相关图谱上下文的指纹，
+        图谱中相关实体变化后不会命中旧结果。
+        """
+        context_fingerprint = repr((relevant_context["nodes"], relevant_context["edges"]))
+        texts = (user_input, llm_response, recent_context or "")
+        exact_key = self._digest(*texts, context_fingerprint)
+        normalized_key = self._digest(
+            *(_NORMALIZE_RE.sub(" ", text).strip().lower() for text in texts),
+            context_fingerprint
+        )
+        return exact_key, normalized_key
+    
+    @staticmethod
+    def _digest(*parts: str) -> str:
+        return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _get_cached_analysis(self, cache_keys: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        """按精确层、归一化层顺序查找缓存；返回深拷贝，调用方可以自由修改"""
+        exact_key, normalized_key = cache_keys
+        with self._cache_lock:
+            for cache, key in ((self._exact_cache, exact_key), (self._normalized_cache, normalized_key)):
+                cached = cache.get(key)
+                if cached is not None:
+                    cache.move_to_end(key)
+                    break
+            else:
+                return None
+        return copy.deepcopy(cached)
+    
+    def _store_cached_analysis(self, cache_keys: Tuple[str, str], analysis_result: Dict[str, Any]):
+        """将分析结果写入两级缓存"""
+        snapshot = copy.deepcopy(analysis_result)
+        with self._cache_lock:
+            for cache, key in zip((self._exact_cache, self._normalized_cache), cache_keys):
+                cache[key] = snapshot
+                cache.move_to_end(key)
+                while len(cache) > _ANALYSIS_CACHE_SIZE:
+                    cache.popitem(last=False)
+    
     def _extract_relevant_graph_context(
         self, 
         user_input: str, 
@@ -81,34 +417,115 @@ class GRAGUpdateAgent:
         """
         # 使用简单的关键词匹配找到相关实体
         # 在实际生产中，这里可以使用更高级的实体识别
-        combined_text = f"{user_input} {llm_response}".lower()
-        
+        graph = current_graph.graph
         relevant_nodes = {}
         relevant_edges = []
         
-        # 遍历图中的所有节点，找到可能相关的
-        for node_id, node_data in current_graph.graph.nodes(data=True):
-            node_name = node_data.get('name', node_id).lower()
-            if node_name in combined_text or node_id.lower() in combined_text:
-                relevant_nodes[node_id] = node_data
-                
-                # 获取相关的边
-                for src, tgt, edge_data in current_graph.graph.edges(data=True):
-                    if src == node_id or tgt == node_id:
-                        relevant_edges.append({
-                            "source": src,
-                            "target": tgt, 
-                            "relationship": edge_data.get("relationship", "unknown"),
-                            "data": edge_data
-                        })
+        # 名称或ID出现在对话中的节点；过多时只保留得分最高的若干个
+        hit_counts = self._find_mentioned_node_ids(user_input, llm_response, current_graph)
+        selected_ids = hit_counts.keys()
+        if len(hit_counts) > _PROMPT_MAX_NODES:
+            selected_ids = heapq.nlargest(
+                _PROMPT_MAX_NODES, hit_counts,
+                key=lambda node_id: self._relevance_score(node_id, hit_counts[node_id])
+            )
+        
+        # 按匹配器构建时记录的节点位置排序（保持图中的节点顺序），只访问命中的节点，无需遍历全图
+        node_order = self._node_order
+        for node_id in sorted(selected_ids, key=node_order.__getitem__):
+            if node_id not in graph:
+                continue
+            relevant_edges.extend(self._collect_incident_edges(graph, node_id, relevant_nodes))
+            relevant_nodes[node_id] = graph.nodes[node_id]
         
         return {
             "nodes": relevant_nodes,
             "edges": relevant_edges,
+            "elided_nodes": len(hit_counts) - len(relevant_nodes),
             "total_nodes": len(current_graph.graph.nodes()),
             "total_edges": len(current_graph.graph.edges())
         }
     
+    def _relevance_score(self, node_id: str, hits: int) -> float:
+        """相关节点得分：对话中的命中次数，最近几轮分析中涉及过的节点适当加权"""
+        last_touched = self._last_touched.get(node_id)
+        if last_touched is None:
+            return float(hits)
+        return hits * (1.0 + 0.5 / (1 + self._analysis_turn - last_touched))
+    
+    def _record_touched_nodes(self, update_instructions: Dict[str, Any]):
+        """记录本轮分析操作涉及的节点"""
+        self._analysis_turn += 1
+        turn = self._analysis_turn
+        for operation in update_instructions.get("operations", ()):
+            for key in ("node_id", "source", "target"):
+                node_id = operation.get(key)
+                if node_id:
+                    self._last_touched[node_id] = turn
+    
+    def _find_mentioned_node_ids(
+        self,
+        user_input: str,
+        llm_response: str,
+        current_graph: KnowledgeGraph
+    ) -> Dict[str, int]:
+        """
+        一次扫描对话文本，找出名称或ID被提到的节点及其命中次数。
+        同一轮对话的预判和上下文提取共用最近一次的扫描结果，不重复小写化和扫描。
+        """
+        matcher = self._get_node_matcher(current_graph)
+        last_scan = self._last_mention_scan
+        if (last_scan is not None and last_scan[0] == self._node_matcher_key
+                and last_scan[1] == user_input and last_scan[2] == llm_response):
+            return last_scan[3]
+        
+        hit_counts = matcher.count_values(f"{user_input} {llm_response}".lower())
+        self._last_mention_scan = (self._node_matcher_key, user_input, llm_response, hit_counts)
+        return hit_counts
+    
+    def _get_node_matcher(self, current_graph: KnowledgeGraph) -> KeywordMatcher:
+        """获取（必要时重建）节点名称/ID的多关键词匹配器"""
+        graph = current_graph.graph
+        matcher_key = (id(graph), current_graph.version, graph.number_of_nodes())
+        if self._node_matcher is None or self._node_matcher_key != matcher_key:
+            keywords = []
+            node_order = {}
+            for position, (node_id, node_data) in enumerate(graph.nodes(data=True)):
+                keywords.append((node_data.get('name') or node_id, node_id))
+                keywords.append((node_id, node_id))
+                node_order[node_id] = position
+            self._node_matcher = KeywordMatcher(keywords)
+            self._node_order = node_order
+            self._node_matcher_key = matcher_key
+        return self._node_matcher
+    
+    @staticmethod
+    def _collect_incident_edges(graph, node_id: str, collected=()) -> List[Dict[str, Any]]:
+        """
+        通过邻接表直接取出节点的入边和出边（O(度数)），无需扫描全图的边。
+        另一端位于 collected 中的边已随该节点收集过，不再重复加入。
+        """
+        edges = []
+        for src, tgt, edge_data in graph.out_edges(node_id, data=True):
+            if tgt in collected:
+                continue
+            edges.append({
+                "source": src,
+                "target": tgt,
+                "relationship": edge_data.get("relationship", "unknown"),
+                "data": edge_data
+            })
+        for src, tgt, edge_data in graph.in_edges(node_id, data=True):
+            if src == tgt or src in collected:
+                continue  # 自环已作为出边收集
+            edges.append({
+                "source": src,
+                "target": tgt,
+                "relationship": edge_data.get("relationship", "unknown"),
+                "data": edge_data
+            })
+        return edges
+    
     def _build_analysis_prompt(
         self, 
         user_input: str, 
@@ -121,95 +538,56 @@ class GRAGUpdateAgent:
         """
         current_nodes_desc = ""
         if relevant_context["nodes"]:
-            current_nodes_desc = "当前相关节点:\n"
-            for node_id, node_data in relevant_context["nodes"].items():
-                current_nodes_desc += f"- {node_id}: {node_data}\n"
+            node_lines = ["当前相关节点:"]
+            node_lines.extend(
+                f"- {node_id}: {self._prompt_node_attributes(node_data)}"
+                for node_id, node_data in relevant_context["nodes"].items()
+            )
+            elided_nodes = relevant_context.get("elided_nodes", 0)
+            if elided_nodes:
+                node_lines.append(f"- …另有 {elided_nodes} 个相关节点未列出")
+            node_lines.append("")
+            current_nodes_desc = "\n".join(node_lines)
         
         current_edges_desc = ""
         if relevant_context["edges"]:
-            current_edges_desc = "当前相关关系:\n"
-            for edge in relevant_context["edges"][:10]:  # 限制显示数量
-                current_edges_desc += f"- {edge['source']} --{edge['relationship']}--> {edge['target']}\n"
+            edge_lines = ["当前相关关系:"]
+            edge_lines.extend(
+                f"- {edge['source']} --{edge['relationship']}--> {edge['target']}"
+                for edge in relevant_context["edges"][:_PROMPT_MAX_EDGES]  # 限制显示数量
+            )
+            elided_edges = len(relevant_context["edges"]) - _PROMPT_MAX_EDGES
+            if elided_edges > 0:
+                edge_lines.append(f"- …另有 {elided_edges} 条相关关系未列出")
+            edge_lines.append("")
+            current_edges_desc = "\n".join(edge_lines)
         
         context_section = ""
         if recent_context:
             context_section = f"\n最近对话上下文:\n{recent_context}\n"
         
-        prompt = f"""你是一个RPG知识图谱管理专家。请分析以下对话，确定需要对知识图谱进行的更新操作。
-
-{context_section}
+        # 固定的说明、JSON格式和提醒放在系统消息中（_FIXED_PROMPT），这里只包含本轮的动态数据
+        prompt = f"""{context_section}
 用户输入: {user_input}
 AI回复: {llm_response}
 
 当前知识图谱状态:
 {current_nodes_desc}
 {current_edges_desc}
-
-请仔细分析对话内容，确定需要执行的操作。考虑以下方面:
-1. 新出现的实体（角色、物品、地点、组织等）
-2. 实体属性的变化（血量、等级、状态、位置等）
-3. 实体间关系的变化（装备、位置、敌对、友好等）
-4. 实体的消失或删除（死亡、丢失、离开等）
-5. 技能学习、状态获得等事件
-
-请严格按照以下JSON格式返回分析结果:
-
-{{
-    "analysis_summary": "对话分析总结",
-    "operations": [
-        {{
-            "type": "add_node",
-            "node_id": "实体唯一ID",
-            "node_type": "实体类型(character/item/location/skill/organization/event)",
-            "attributes": {{
-                "name": "实体名称",
-                "其他属性": "值"
-            }},
-            "reason": "添加此节点的原因"
-        }},
-        {{
-            "type": "update_node",
-            "node_id": "现有节点ID",
-            "attributes": {{
-                "属性名": "新值"
-            }},
-            "reason": "更新原因"
-        }},
-        {{
-            "type": "add_edge",
-            "source": "源节点ID",
-            "target": "目标节点ID", 
-            "relationship": "关系类型",
-            "attributes": {{}},
-            "reason": "添加关系的原因"
-        }},
-        {{
-            "type": "delete_node",
-            "node_id": "要删除的节点ID",
-            "deletion_type": "death/lost/destroyed/other",
-            "reason": "删除原因"
-        }},
-        {{
-            "type": "delete_edge",
-            "source": "源节点ID",
-            "target": "目标节点ID",
-            "relationship": "要删除的关系类型",
-            "reason": "删除关系的原因"
-        }}
-    ],
-    "confidence": "分析置信度(0-1)",
-    "notes": "额外说明或不确定的地方"
-}}
-
-重要提醒:
-- 只有在对话中明确提到变化时才生成操作
-- 不要重复创建已存在的节点或关系
-- 对于模糊或不确定的信息，降低置信度
-- 保持节点ID的一致性和可读性
-- 优先考虑显式信息，谨慎推断隐含信息"""
+请分析以上对话，按照系统提示中的JSON格式返回需要执行的更新操作。"""
 
         return prompt
     
+    @staticmethod
+    def _prompt_node_attributes(node_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        节点写入Prompt时省略时间戳、来源、历史等记录字段，减少token
+        """
+        return {
+            key: value for key, value in node_data.items()
+            if key not in _PROMPT_EXCLUDED_KEYS
+        }
+    
     def _parse_llm_analysis(self, analysis_result: str) -> Dict[str, Any]:
         """
         解析LLM返回的分析结果
@@ -219,19 +597,11 @@ AI回复: {llm_response}
             analysis_result = analysis_result.strip()
             
             # 如果包含代码块，提取JSON
-            if "```json" in analysis_result:
-                start = analysis_result.find("```json") + 7
-                end = analysis_result.find("```", start)
-                json_str = analysis_result[start:end].strip()
-            elif "```" in analysis_result:
-                start = analysis_result.find("```") + 3
-                end = analysis_result.rfind("```")
-                json_str = analysis_result[start:end].strip()
-            else:
-                json_str = analysis_result
+            fence_match = _JSON_FENCE_RE.search(analysis_result)
+            json_str = fence_match.group(1) if fence_match else analysis_result
             
             # 解析JSON
-            parsed_result = json.loads(json_str)
+            parsed_result = json_utils.loads(json_str)
             
             # 验证必要字段
             if "operations" not in parsed_result:
@@ -292,57 +662,16 @@ AI回复: {llm_response}
         """
         将Agent分析结果转换为执行格式
         """
-        nodes_to_add = []
-        nodes_to_update = []
-        edges_to_add = []
-        nodes_to_delete = []
-        edges_to_delete = []
+        # LLM常会重复输出同一操作：按键去重，同一节点/关系的多次属性写入合并为一次
+        pending = {key: {} for key in _EXECUTION_KEYS}
         
-        for operation in analysis_result.get("operations", []):
-            op_type = operation["type"]
-            
-            if op_type == "add_node":
-                nodes_to_add.append({
-                    "node_id": operation["node_id"],
-                    "type": operation["node_type"],
-                    "attributes": operation["attributes"]
-                })
-            
-            elif op_type == "update_node":
-                nodes_to_update.append({
-                    "node_id": operation["node_id"],
-                    "attributes": operation["attributes"]
-                })
-            
-            elif op_type == "add_edge":
-                edges_to_add.append({
-                    "source": operation["source"],
-                    "target": operation["target"],
-                    "relationship": operation["relationship"],
-                    "attributes": operation.get("attributes", {})
-                })
-            
-            elif op_type == "delete_node":
-                nodes_to_delete.append({
-                    "node_id": operation["node_id"],
-                    "deletion_type": operation.get("deletion_type", "other"),
-                    "reason": operation["reason"]
-                })
-            
-            elif op_type == "delete_edge":
-                edges_to_delete.append({
-                    "source": operation["source"],
-                    "target": operation["target"],
-                    "relationship": operation.get("relationship"),
-                    "reason": operation["reason"]
-                })
+        for operation in analysis_result.get("operations", ()):
+            handler = _EXECUTION_HANDLERS.get(operation["type"])
+            if handler is not None:
+                handler(operation, pending)
         
         return {
-            "nodes_to_add": nodes_to_add,
-            "nodes_to_update": nodes_to_update,
-            "edges_to_add": edges_to_add,
-            "nodes_to_delete": nodes_to_delete,
-            "edges_to_delete": edges_to_delete,
+            **{key: list(entries.values()) for key, entries in pending.items()},
             "analysis_summary": analysis_result.get("analysis_summary", ""),
             "confidence": analysis_result.get("confidence", 0.5),
             "notes": analysis_result.get("notes", "")
@@ -1,20 +1,155 @@
 from typing import List, Dict, Any, Optional, Iterator
+import asyncio
+import importlib.util
+import threading
+import time
+import httpx
 import openai
 from loguru import logger
 from src.utils.config import config
 
+# HTTP/2 需要安装 h2（httpx[http2]），未安装时使用 HTTP/1.1 连接池
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 熔断：连续失败达到次数后，在冷却时间内直接返回兜底回复，不再请求API
+_BREAKER_FAIL_MAX = 3
+_BREAKER_RESET_TIMEOUT = 30.0
+
+_FALLBACK_REPLY = "抱歉，系统暂时无法响应。"
+
+
+class _CircuitBreaker:
+    """
+    简单的熔断器：连续失败 fail_max 次后打开，reset_timeout 秒后放行一次试探请求（半开），
+    试探成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """熔断器打开且仍在冷却期内"""
+        opened_at = self._opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.reset_timeout
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True  # 半开：只放行一个试探请求
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.fail_max:
+                if self._opened_at is None:
+                    logger.warning(f"LLM连续失败{self._failures}次，熔断{self.reset_timeout:.0f}秒")
+                self._opened_at = time.monotonic()
+
+
 class LLMClient:
     def __init__(self):
+        # 复用长连接：同一端点上的对话请求和GRAG分析请求共享TLS连接
+        self._http_client = httpx.Client(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300),
+            timeout=config.llm.request_timeout
+        )
         self.client = openai.OpenAI(
             api_key=config.llm.api_key,
-            base_url=config.llm.base_url
+            base_url=config.llm.base_url,
+            http_client=self._http_client
         )
         self.model = config.llm.model
         self.max_tokens = config.llm.max_tokens
         self.temperature = config.llm.temperature
+        self._breaker = _CircuitBreaker(_BREAKER_FAIL_MAX, _BREAKER_RESET_TIMEOUT)
+
+        # 异步客户端按事件循环懒加载（连接池和信号量都绑定在所属事件循环上）
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self.aclient: Optional[openai.AsyncOpenAI] = None
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
     
+    async def _ensure_async_client(self):
+        """为当前事件循环创建（或复用）异步客户端和并发信号量，事件循环变化时关闭旧客户端"""
+        loop = asyncio.get_running_loop()
+        if self.aclient is None or self._async_loop is not loop:
+            old_http_client = self._async_http_client
+            self._async_loop = loop
+            self._async_http_client = httpx.AsyncClient(
+                http2=_HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300),
+                timeout=config.llm.request_timeout
+            )
+            self.aclient = openai.AsyncOpenAI(
+                api_key=config.llm.api_key,
+                base_url=config.llm.base_url,
+                http_client=self._async_http_client
+            )
+            # 限制同时在途的LLM请求数量
+            self._async_semaphore = asyncio.Semaphore(config.llm.max_concurrency)
+            if old_http_client is not None:
+                await self._close_async_http_client(old_http_client)
+
+    @staticmethod
+    async def _close_async_http_client(http_client: httpx.AsyncClient):
+        try:
+            await http_client.aclose()
+        except Exception as e:
+            # 旧事件循环已关闭时连接可能无法正常关闭，不影响新客户端
+            logger.debug(f"关闭旧的异步HTTP客户端失败: {e}")
+
+    def is_available(self) -> bool:
+        """API当前是否可用（熔断期间返回False，调用方可以提前走本地回退路径）"""
+        return not self._breaker.is_open
+
+    def close(self):
+        """关闭底层HTTP连接池（异步客户端的连接池需在其事件循环中调用 aclose 关闭）"""
+        self._http_client.close()
+
+    async def aclose(self):
+        """关闭当前事件循环上的异步客户端连接池"""
+        http_client = self._async_http_client
+        self._async_loop = None
+        self._async_http_client = None
+        self.aclient = None
+        self._async_semaphore = None
+        if http_client is not None:
+            await self._close_async_http_client(http_client)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _optional_params(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """只透传调用方显式给出的可选参数（部分兼容端点不接受 null 值）"""
+        return {key: kwargs[key] for key in ("seed",) if kwargs.get(key) is not None}
+
     def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
         """单次LLM调用 - 严格JSON模式"""
+        if not self._breaker.allow_request():
+            logger.warning("LLM熔断中，跳过调用")
+            return _FALLBACK_REPLY
         try:
             response = self.client.chat.completions.create(
                 model=kwargs.get('model', self.model),
@@ -22,16 +157,91 @@ class LLMClient:
                 max_tokens=kwargs.get('max_tokens', self.max_tokens),
                 temperature=kwargs.get('temperature', self.temperature),
                 timeout=config.llm.request_timeout,
-                response_format={"type": "json_object"} # 启用JSON模式
+                response_format={"type": "json_object"}, # 启用JSON模式
+                **self._optional_params(kwargs)
             )
             content = response.choices[0].message.content
+            self._breaker.record_success()
             logger.info(f"LLM调用成功，返回{len(content)}字符")
             return content
         except Exception as e:
+            self._breaker.record_failure()
             logger.error(f"LLM调用失败: {e}")
-            return "抱歉，系统暂时无法响应。"
+            return _FALLBACK_REPLY
 
-    def generate_response(self, prompt: str, max_tokens: int = None, temperature: float = None, system_message: str = None) -> str:
+    def stream_chat(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """流式LLM调用 - 严格JSON模式，逐段产出回复文本；调用失败且尚未产出内容时产出兜底回复"""
+        if not self._breaker.allow_request():
+            logger.warning("LLM熔断中，跳过调用")
+            yield _FALLBACK_REPLY
+            return
+        received = 0
+        settled = False
+        stream = None
+        try:
+            stream = self.client.chat.completions.create(
+                model=kwargs.get('model', self.model),
+                messages=messages,
+                max_tokens=kwargs.get('max_tokens', self.max_tokens),
+                temperature=kwargs.get('temperature', self.temperature),
+                timeout=config.llm.request_timeout,
+                response_format={"type": "json_object"}, # 启用JSON模式
+                stream=True,
+                **self._optional_params(kwargs)
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    received += len(content)
+                    yield content
+            settled = True
+            self._breaker.record_success()
+            logger.info(f"LLM流式调用成功，返回{received}字符")
+        except Exception as e:
+            settled = True
+            self._breaker.record_failure()
+            logger.error(f"LLM流式调用失败: {e}")
+            if not received:
+                yield _FALLBACK_REPLY
+        finally:
+            if stream is not None:
+                stream.close()
+            if not settled:
+                # 调用方提前停止读取（例如取消），按已收到的内容判定这次请求是否成功
+                if received:
+                    self._breaker.record_success()
+                else:
+                    self._breaker.record_failure()
+
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """单次LLM调用的异步版本 - 严格JSON模式，多个调用可在同一事件循环中并发"""
+        if not self._breaker.allow_request():
+            logger.warning("LLM熔断中，跳过调用")
+            return _FALLBACK_REPLY
+        try:
+            await self._ensure_async_client()
+            async with self._async_semaphore:
+                response = await self.aclient.chat.completions.create(
+                    model=kwargs.get('model', self.model),
+                    messages=messages,
+                    max_tokens=kwargs.get('max_tokens', self.max_tokens),
+                    temperature=kwargs.get('temperature', self.temperature),
+                    timeout=config.llm.request_timeout,
+                    response_format={"type": "json_object"}, # 启用JSON模式
+                    **self._optional_params(kwargs)
+                )
+            content = response.choices[0].message.content
+            self._breaker.record_success()
+            logger.info(f"LLM异步调用成功，返回{len(content)}字符")
+            return content
+        except Exception as e:
+            self._breaker.record_failure()
+            logger.error(f"LLM异步调用失败: {e}")
+            return _FALLBACK_REPLY
+
+    def generate_response(self, prompt: str, max_tokens: int = None, temperature: float = None, system_message: str = None, seed: int = None) -> str:
         """
         兼容GRAG Agent调用的统一接口
         将单个prompt转换为消息格式进行调用
@@ -46,5 +256,38 @@ class LLMClient:
         return self.chat(
             messages=messages,
             max_tokens=max_tokens or self.max_tokens,
-            temperature=temperature or self.temperature
+            temperature=temperature or self.temperature,
+            seed=seed
+        )
+
+    def stream_response(self, prompt: str, max_tokens: int = None, temperature: float = None, system_message: str = None, seed: int = None) -> Iterator[str]:
+        """generate_response 的流式版本，逐段产出回复文本"""
+        messages = []
+        
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+            
+        messages.append({"role": "user", "content": prompt})
+        
+        return self.stream_chat(
+            messages=messages,
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=temperature or self.temperature,
+            seed=seed
+        )
+
+    async def agenerate_response(self, prompt: str, max_tokens: int = None, temperature: float = None, system_message: str = None, seed: int = None) -> str:
+        """generate_response 的异步版本"""
+        messages = []
+        
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+            
+        messages.append({"role": "user", "content": prompt})
+        
+        return await self.achat(
+            messages=messages,
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=temperature or self.temperature,
+            seed=seed
         )
@@ -1,7 +1,8 @@
 import re
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 from src.graph import KnowledgeGraph
+from src.utils.keyword_matcher import KeywordMatcher
 
 class PerceptionModule:
     """
@@ -16,6 +17,15 @@ class PerceptionModule:
             "action": ["go to", "pick up", "talk to", "attack", "use", "去", "前往", "捡起", "对话", "攻击", "使用"],
             "describe": ["look at", "describe", "check", "观察", "查看", "描述"],
         }
+        # 每种意图的关键词编译成一个交替正则，按意图优先级依次各做一次扫描
+        self._intent_patterns = [
+            (intent, re.compile("|".join(map(re.escape, keywords))))
+            for intent, keywords in self.intent_keywords.items()
+        ]
+        
+        # 实体名称/ID/别名的多关键词匹配器，按 (图对象, 版本号, 节点数) 失效重建
+        self._entity_matcher: Optional[KeywordMatcher] = None
+        self._entity_matcher_key: Optional[Tuple[int, int, int]] = None
 
     def analyze(self, text: str, kg: KnowledgeGraph) -> Dict[str, Any]:
         """
@@ -33,37 +43,26 @@ class PerceptionModule:
         
         # 1. 实体提取 (Entity Extraction)
         extracted_entities = []
-        # 创建一个包含所有待搜索名称的列表 (ID, name, aliases)
-        search_candidates = []
-        for node_id, attrs in kg.graph.nodes(data=True):
-            # 1. 添加节点ID本身
-            search_candidates.append((node_id, node_id))
-            # 2. 添加name属性
-            if attrs.get('name'):
-                search_candidates.append((attrs.get('name'), node_id))
-            # 3. 添加aliases列表中的所有别名
-            if attrs.get('aliases'):
-                for alias in attrs.get('aliases'):
-                    search_candidates.append((alias, node_id))
+        # 一次扫描找出文本中出现的所有实体名称（含相互重叠的匹配）
+        matches = list(self._get_entity_matcher(kg).iter_matches(normalized_text))
         
-        # 按名称长度降序排序，优先匹配更长的实体名 (e.g., "elara's shop" vs "elara")
-        search_candidates.sort(key=lambda x: len(x[0]), reverse=True)
-
-        temp_text = normalized_text
-        for name, node_id in search_candidates:
-            # 如果在文本中找到了实体名称
-            if name.lower() in temp_text:
+        # 按名称长度降序处理，优先匹配更长的实体名 (e.g., "elara's shop" vs "elara")；
+        # 已被更长名称覆盖的位置不再匹配，避免子字符串重复匹配
+        matches.sort(key=lambda match: (match[0] - match[1], match[0]))
+        covered = bytearray(len(normalized_text))
+        for start, end, _, node_ids in matches:
+            if covered.find(1, start, end) != -1:
+                continue
+            covered[start:end] = b"\x01" * (end - start)
+            for node_id in node_ids:
                 # 将找到的实体ID加入结果列表 (确保不重复)
                 if node_id not in extracted_entities:
                     extracted_entities.append(node_id)
-                # 从文本中移除已找到的实体名，避免子字符串重复匹配
-                # 例如，找到 "elara's shop" 后，将其移除，以免再次匹配到 "elara"
-                temp_text = temp_text.replace(name.lower(), "")
 
         # 2. 意图分析 (Intent Analysis)
         detected_intent = "unknown"
-        for intent, keywords in self.intent_keywords.items():
-            if any(keyword in normalized_text for keyword in keywords):
+        for intent, pattern in self._intent_patterns:
+            if pattern.search(normalized_text):
                 detected_intent = intent
                 break
         
@@ -76,3 +75,25 @@ class PerceptionModule:
             "entities": extracted_entities,
             "intent": detected_intent,
         }
+
+    def _get_entity_matcher(self, kg: KnowledgeGraph) -> KeywordMatcher:
+        """获取（必要时重建）包含所有节点ID、name属性和aliases别名的匹配器"""
+        graph = kg.graph
+        matcher_key = (id(graph), kg.version, graph.number_of_nodes())
+        if self._entity_matcher is None or self._entity_matcher_key != matcher_key:
+            keywords = []
+            append = keywords.append
+            for node_id, attrs in graph.nodes(data=True):
+                # 1. 节点ID本身
+                append((node_id, node_id))
+                # 2. name属性
+                name = attrs.get('name')
+                if name:
+                    append((name, node_id))
+                # 3. aliases列表中的所有别名
+                aliases = attrs.get('aliases')
+                if aliases:
+                    keywords.extend((alias, node_id) for alias in aliases)
+            self._entity_matcher = KeywordMatcher(keywords)
+            self._entity_matcher_key = matcher_key
+        return self._entity_matcher
@@ -2,16 +2,121 @@
 RPG专用文本处理器 - 专门处理角色扮演游戏中的复杂元素
 支持数值属性、装备系统、技能树、复杂关系等RPG核心机制
 """
+import copy
+import functools
+import hashlib
+import os
 import re
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Any, List, Tuple, Optional
 from loguru import logger
 
+# 装备数值提取：四类数值放在一个零宽先行断言的交替中，一次扫描找出每类的所有出现位置。
+# 各分支的首字符互不相同，同一位置至多一个分支匹配，且零宽匹配不消耗文本，
+# 因此每类的第一次出现与分别调用 re.search 的结果相同
+_EQUIP_STATS_RE = re.compile(
+    r"(?=(?:攻击力|伤害|ATK)[+\-]?(?P<attack>\d+)"
+    r"|(?:防御力|防御|DEF|护甲)[+\-]?(?P<defense>\d+)"
+    r"|[+](?P<enhancement_level>\d+)"
+    r"|(?P<rarity>史诗|传说|稀有|普通|魔法))"
+)
+
+# 角色等级提取
+_CHARACTER_LEVEL_RE = re.compile(r"(?:等级|Lv\.?|Level)\s*(\d+)")
+
+# 数值属性名判断：一个带命名组的交替正则，组名即属性名；组的顺序即判断优先级
+_ATTRIBUTE_NAME_RE = re.compile(
+    r"(?P<attack>攻击力|伤害|ATK)|(?P<defense>防御力|防御|DEF)|(?P<health>血量|生命|HP)|"
+    r"(?P<mana>魔法|法力|MP)|(?P<level>等级|级别|Lv)|(?P<experience>经验|EXP)"
+)
+_ATTRIBUTE_PRIORITY = dict(_ATTRIBUTE_NAME_RE.groupindex)
+
+# RPG专用的翻译映射
+_RPG_TRANSLATION_MAP = {
+    # 职业
+    "战士": "warrior", "法师": "mage", "盗贼": "thief", "牧师": "priest",
+    "骑士": "knight", "弓箭手": "archer", "刺客": "assassin", "德鲁伊": "druid",
+    
+    # 装备
+    "长剑": "longsword", "战斧": "battleaxe", "法杖": "staff", "匕首": "dagger",
+    "盔甲": "armor", "盾牌": "shield", "头盔": "helmet", "靴子": "boots",
+    
+    # 地点
+    "酒馆": "tavern", "铁匠铺": "blacksmith", "魔法塔": "magic_tower",
+    "地牢": "dungeon", "城堡": "castle", "森林": "forest", "沙漠": "desert",
+    
+    # 通用
+    "玩家": "player", "敌人": "enemy", "NPC": "npc",
+}
+
+# 各模式的必需字面量（小写）：任一匹配中必定出现其中至少一个。
+# 文本中一个都不包含时无需运行该正则。顺序与 __init__ 中对应的模式表一一对应。
+_LOCATION_SUFFIXES = ("城镇", "村庄", "地牢", "迷宫", "森林", "山脉", "沙漠", "洞穴", "神殿", "遗迹",
+                      "要塞", "城堡", "酒馆", "商店", "铁匠铺", "魔法塔")
+_CLASS_NAMES = ("战士", "法师", "盗贼", "牧师", "骑士", "弓箭手", "刺客", "德鲁伊")
+
+_ENTITY_REQUIRED_LITERALS = {
+    "character": [("角色", "人物", "npc", "玩家", "敌人"), _CLASS_NAMES, _CLASS_NAMES],
+    "weapon": [("装备", "使用", "拿着", "挥舞"), ("攻击力", "伤害"), ("武器", "装备")],
+    "armor": [("穿着", "装备"), ("防御力", "护甲值")],
+    "consumable": [("药水", "药剂", "卷轴", "食物", "毒药"), ("恢复", "回复", "增加", "提升")],
+    "location": [("前往", "到达", "进入", "离开"), _LOCATION_SUFFIXES],
+    "guild_organization": [("加入", "退出", "创建"), ("成员", "会长", "长老")],
+}
+
+_NUMERICAL_REQUIRED_LITERALS = {
+    "stats": [
+        ("攻击力", "伤害", "atk"), ("防御", "def", "护甲"), ("血量", "生命", "hp", "血条"),
+        ("魔法", "法力", "mp", "蓝条"), ("等级", "级别", "lv", "level"), ("经验", "exp"),
+        ("力量", "str"), ("敏捷", "agi", "dex"), ("智力", "智慧", "int", "wis"), ("体质", "耐力", "con", "sta"),
+    ],
+    "changes": [
+        ("攻击力", "伤害", "atk"), ("防御", "def"), ("血量", "生命", "hp"),
+        ("魔法", "法力", "mp"), ("伤害", "损伤"), ("经验", "exp"),
+    ],
+}
+
+_RELATION_REQUIRED_LITERALS = [
+    ("的成员",), ("会长", "队长", "首领"), ("敌对", "为敌", "对立", "仇视"), ("攻击", "战斗", "对战"),
+    ("友好", "结盟", "合作"), ("信任", "尊敬", "崇拜"), ("买", "交易"), ("卖给", "出售给"),
+    ("装备", "佩戴", "使用"), ("背包里", "物品栏里", "仓库里"), ("地区", "区域", "地图", "层"), ("守护", "保卫", "镇守"),
+]
+
+_DELETION_REQUIRED_LITERALS = [
+    ("死", "阵亡", "倒下"), ("血量",), ("丢失", "失去", "损坏", "销毁", "破碎"), ("偷走", "抢走", "没收", "丢弃"),
+    ("断绝关系", "决裂", "敌对", "反目"), ("离开", "退出"), ("离开", "撤离", "逃离"),
+]
+
+_SKILL_REQUIRED_LITERALS = [("学会", "习得", "掌握", "解锁"), ("释放", "使用", "施展"), ("获得", "受到")]
+
+# 提取结果缓存的最大条目数
+_RESULT_CACHE_SIZE = 256
+
+# 批量提取时，文本数少于该值直接在当前进程串行处理（进程池启动开销更大）
+_MIN_PARALLEL_TEXTS = 8
+
+# 正则中的命名组开头 (?P<name>
+_NAMED_GROUP_RE = re.compile(r"\(\?P<\w+>")
+
+# 文本中是否含有汉字（与模式中的 \u4e00-\u9fa5 字符范围一致）
+_CJK_CHAR_RE = re.compile(r"[\u4e00-\u9fa5]")
+
+# 生成实体ID时替换为下划线的字符
+_ENTITY_ID_CLEAN_RE = re.compile(r'[^\w\u4e00-\u9fa5]+')
+
+
 class RPGTextProcessor:
     """RPG专用文本处理器，能够识别和提取复杂的RPG游戏元素"""
     
     def __init__(self):
         # RPG专用实体识别模式
+        # 提取结果缓存（LRU），键为文本的blake2b摘要
+        self._result_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+        
         self.rpg_entity_patterns = {
             "character": [
                 # 基础角色识别
@@ -47,6 +152,7 @@ class RPGTextProcessor:
                 r"([\u4e00-\u9fa5A-Za-z]+)(?:公会|工会|组织|团队|军团|联盟|阵营|教会|商会)的(?:成员|会长|副会长|长老)",
             ],
         }
+        self.rpg_entity_patterns = self._compile_pattern_groups(self.rpg_entity_patterns)
         
         # RPG数值属性识别模式
         self.numerical_patterns = {
@@ -73,50 +179,59 @@ class RPGTextProcessor:
                 r"(?:经验|经验值|EXP)\s*[+]?(\d+)\s*(?:点|pts?)?",
             ],
         }
+        self.numerical_patterns = self._compile_pattern_groups(self.numerical_patterns)
         
         # RPG复杂关系模式
         self.rpg_relation_patterns = [
             # 公会关系
-            (r"([\w\u4e00-\u9fa5]+)(?:加入|成为)([\w\u4e00-\u9fa5]+)(?:公会|工会|组织|团队|军团)的成员", "member_of"),
-            (r"([\w\u4e00-\u9fa5]+)(?:是|担任)([\w\u4e00-\u9fa5]+)(?:公会|工会|组织|团队|军团)的(?:会长|队长|首领)", "leader_of"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:加入|成为)(?P<target>[\w\u4e00-\u9fa5]+)(?:公会|工会|组织|团队|军团)的成员", "member_of"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:是|担任)(?P<target>[\w\u4e00-\u9fa5]+)(?:公会|工会|组织|团队|军团)的(?:会长|队长|首领)", "leader_of"),
             
             # 敌对关系
-            (r"([\w\u4e00-\u9fa5]+)(?:与|和)([\w\u4e00-\u9fa5]+)(?:敌对|为敌|对立|仇视)", "hostile_to"),
-            (r"([\w\u4e00-\u9fa5]+)(?:攻击|战斗|对战)([\w\u4e00-\u9fa5]+)", "fighting"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:与|和)(?P<target>[\w\u4e00-\u9fa5]+)(?:敌对|为敌|对立|仇视)", "hostile_to"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:攻击|战斗|对战)(?P<target>[\w\u4e00-\u9fa5]+)", "fighting"),
             
             # 友好关系
-            (r"([\w\u4e00-\u9fa5]+)(?:与|和)([\w\u4e00-\u9fa5]+)(?:友好|结盟|合作)", "allied_with"),
-            (r"([\w\u4e00-\u9fa5]+)(?:信任|尊敬|崇拜)([\w\u4e00-\u9fa5]+)", "respects"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:与|和)(?P<target>[\w\u4e00-\u9fa5]+)(?:友好|结盟|合作)", "allied_with"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:信任|尊敬|崇拜)(?P<target>[\w\u4e00-\u9fa5]+)", "respects"),
             
             # 交易关系
-            (r"([\w\u4e00-\u9fa5]+)(?:从|向)([\w\u4e00-\u9fa5]+)(?:购买|买|交易)([\w\u4e00-\u9fa5]+)", "trades_with"),
-            (r"([\w\u4e00-\u9fa5]+)(?:卖给|出售给)([\w\u4e00-\u9fa5]+)([\w\u4e00-\u9fa5]+)", "sells_to"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:从|向)(?P<target>[\w\u4e00-\u9fa5]+)(?:购买|买|交易)(?P<item>[\w\u4e00-\u9fa5]+)", "trades_with"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:卖给|出售给)(?P<target>[\w\u4e00-\u9fa5]+)(?P<item>[\w\u4e00-\u9fa5]+)", "sells_to"),
             
             # 装备关系
-            (r"([\w\u4e00-\u9fa5]+)(?:装备|佩戴|使用)([\w\u4e00-\u9fa5]+)", "equipped_with"),
-            (r"([\w\u4e00-\u9fa5]+)(?:在|位于)([\w\u4e00-\u9fa5]+)(?:的背包|物品栏|仓库)里", "stored_in"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:装备|佩戴|使用)(?P<target>[\w\u4e00-\u9fa5]+)", "equipped_with"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:在|位于)(?P<target>[\w\u4e00-\u9fa5]+)(?:的背包|物品栏|仓库)里", "stored_in"),
             
             # 位置关系 
-            (r"([\w\u4e00-\u9fa5]+)(?:在|位于|处于)([\w\u4e00-\u9fa5]+)(?:地区|区域|地图|层)", "located_in"),
-            (r"([\w\u4e00-\u9fa5]+)(?:守护|保卫|镇守)([\w\u4e00-\u9fa5]+)", "guards"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:在|位于|处于)(?P<target>[\w\u4e00-\u9fa5]+)(?:地区|区域|地图|层)", "located_in"),
+            (r"(?P<source>[\w\u4e00-\u9fa5]+)(?:守护|保卫|镇守)(?P<target>[\w\u4e00-\u9fa5]+)", "guards"),
+        ]
+        self.rpg_relation_patterns = [
+            (re.compile(pattern, re.IGNORECASE), relation_type)
+            for pattern, relation_type in self.rpg_relation_patterns
         ]
 
         # RPG删除/死亡/丢失事件识别模式
         self.deletion_patterns = [
             # 角色死亡
-            (r"([\w\u4e00-\u9fa5]+)(?:死了|死亡|阵亡|被杀死|倒下)", "character_death"),
-            (r"([\w\u4e00-\u9fa5]+)(?:的)?血量(?:归零|为0|耗尽)", "character_death"),
+            (r"(?P<character>[\w\u4e00-\u9fa5]+)(?:死了|死亡|阵亡|被杀死|倒下)", "character_death"),
+            (r"(?P<character>[\w\u4e00-\u9fa5]+)(?:的)?血量(?:归零|为0|耗尽)", "character_death"),
             
             # 物品丢失/销毁
-            (r"(?:丢失|失去|损坏|销毁|破碎)(?:了)?([\w\u4e00-\u9fa5]+)", "item_lost"),
-            (r"([\w\u4e00-\u9fa5]+)(?:被)?(?:偷走|抢走|没收|丢弃)", "item_stolen"),
+            (r"(?:丢失|失去|损坏|销毁|破碎)(?:了)?(?P<item>[\w\u4e00-\u9fa5]+)", "item_lost"),
+            (r"(?P<item>[\w\u4e00-\u9fa5]+)(?:被)?(?:偷走|抢走|没收|丢弃)", "item_stolen"),
             
             # 关系断绝
-            (r"([\w\u4e00-\u9fa5]+)(?:与|和)([\w\u4e00-\u9fa5]+)(?:断绝关系|决裂|敌对|反目)", "relationship_broken"),
-            (r"([\w\u4e00-\u9fa5]+)(?:离开|退出)([\w\u4e00-\u9fa5]+)(?:公会|组织|团队)", "left_organization"),
+            (r"(?P<entity1>[\w\u4e00-\u9fa5]+)(?:与|和)(?P<entity2>[\w\u4e00-\u9fa5]+)(?:断绝关系|决裂|敌对|反目)", "relationship_broken"),
+            (r"(?P<character>[\w\u4e00-\u9fa5]+)(?:离开|退出)(?P<organization>[\w\u4e00-\u9fa5]+)(?:公会|组织|团队)", "left_organization"),
             
             # 位置离开
-            (r"([\w\u4e00-\u9fa5]+)(?:离开|撤离|逃离)([\w\u4e00-\u9fa5]+)", "left_location"),
+            (r"(?P<character>[\w\u4e00-\u9fa5]+)(?:离开|撤离|逃离)(?P<location>[\w\u4e00-\u9fa5]+)", "left_location"),
+        ]
+        self.deletion_patterns = [
+            (re.compile(pattern, re.IGNORECASE), event_type)
+            for pattern, event_type in self.deletion_patterns
         ]
 
         # 技能和状态效果模式
@@ -125,21 +240,125 @@ class RPGTextProcessor:
             r"(?:释放|使用|施展)([\u4e00-\u9fa5A-Za-z]+)(?:技能|法术|魔法)(?:消耗|花费)(\d+)(?:点|%)(?:MP|魔法|法力)",
             r"(?:获得|受到)([\u4e00-\u9fa5A-Za-z]+)(?:状态|效果|BUFF|DEBUFF)(?:持续|维持)(\d+)(?:回合|秒|分钟)",
         ]
+        self.skill_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.skill_patterns]
+        
+        # 每组模式合并成一个交替正则作为预检：一次扫描确认整组都不可能命中时，跳过组内逐个模式的扫描
+        self._entity_gates = {
+            entity_type: self._combine_patterns(patterns)
+            for entity_type, patterns in self.rpg_entity_patterns.items()
+        }
+        self._numerical_gates = {
+            category: self._combine_patterns(patterns)
+            for category, patterns in self.numerical_patterns.items()
+        }
+        self._relation_gate = self._combine_patterns([pattern for pattern, _ in self.rpg_relation_patterns])
+        self._deletion_gate = self._combine_patterns([pattern for pattern, _ in self.deletion_patterns])
+        self._skill_gate = self._combine_patterns(self.skill_patterns)
+        
+        # 已编译模式 -> 必需字面量
+        self._required_literals: Dict["re.Pattern", Tuple[str, ...]] = {}
+        for entity_type, patterns in self.rpg_entity_patterns.items():
+            self._required_literals.update(zip(patterns, _ENTITY_REQUIRED_LITERALS[entity_type]))
+        for category, patterns in self.numerical_patterns.items():
+            self._required_literals.update(zip(patterns, _NUMERICAL_REQUIRED_LITERALS[category]))
+        self._required_literals.update(
+            zip((pattern for pattern, _ in self.rpg_relation_patterns), _RELATION_REQUIRED_LITERALS)
+        )
+        self._required_literals.update(
+            zip((pattern for pattern, _ in self.deletion_patterns), _DELETION_REQUIRED_LITERALS)
+        )
+        self._required_literals.update(zip(self.skill_patterns, _SKILL_REQUIRED_LITERALS))
+        # 必需字面量全部含汉字的模式：不含汉字的文本（如纯英文输入）可整体跳过
+        self._cjk_only_patterns = frozenset(
+            pattern for pattern, literals in self._required_literals.items()
+            if all(_CJK_CHAR_RE.search(literal) for literal in literals)
+        )
+
+    def __getstate__(self):
+        # 发送到 extract_many 的工作进程时不携带结果缓存和锁（锁不可pickle）
+        state = self.__dict__.copy()
+        del state["_result_cache"], state["_result_cache_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._result_cache = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+
+    @staticmethod
+    def _compile_pattern_groups(pattern_groups: Dict[str, List[str]]) -> Dict[str, List["re.Pattern"]]:
+        """预编译 {类别: [模式, ...]} 中的全部正则，避免每次调用时重新解析"""
+        return {
+            category: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            for category, patterns in pattern_groups.items()
+        }
 
-    def extract_rpg_entities_and_relations(self, text: str) -> Dict[str, Any]:
+    def _may_match(self, pattern: "re.Pattern", lowered_text: str, has_cjk: bool = True) -> bool:
+        """
+        廉价预检：文本（已小写）中不含该模式的任何必需字面量时，该模式不可能匹配。
+        has_cjk 为False时，只能由汉字字面量触发的模式直接跳过。
+        """
+        if not has_cjk and pattern in self._cjk_only_patterns:
+            return False
+        literals = self._required_literals.get(pattern)
+        return literals is None or any(literal in lowered_text for literal in literals)
+
+    @staticmethod
+    def _combine_patterns(patterns: List["re.Pattern"]) -> "re.Pattern":
+        """将多个已编译模式合并为一个交替正则（仅用于判断是否可能命中，不用于提取）"""
+        # 不同模式中的同名命名组不能出现在同一个正则里，合并时改为非捕获组
+        return re.compile(
+            "|".join(f"(?:{_NAMED_GROUP_RE.sub('(?:', pattern.pattern)})" for pattern in patterns),
+            re.IGNORECASE
+        )
+
+    def extract_rpg_entities_and_relations(self, text: str, cache: bool = True) -> Dict[str, Any]:
         """
         从RPG文本中提取实体、数值属性和复杂关系
         返回结构化的RPG游戏数据
+        
+        Args:
+            text: 待分析的文本
+            cache: 是否使用结果缓存（重复出现的状态栏/旁白文本直接返回缓存结果的副本）
         """
-        nodes_to_add = []
-        edges_to_add = []
+        if not cache:
+            return self._extract_uncached(text)
+        
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._result_cache_lock:
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                self._result_cache.move_to_end(key)
+        if cached is not None:
+            logger.debug("命中RPG提取结果缓存")
+            return copy.deepcopy(cached)
+        
+        result = self._extract_uncached(text)
+        snapshot = copy.deepcopy(result)
+        with self._result_cache_lock:
+            self._result_cache[key] = snapshot
+            while len(self._result_cache) > _RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+        return result
+
+    def _extract_uncached(self, text: str) -> Dict[str, Any]:
+        """extract_rpg_entities_and_relations 的实际提取逻辑（不经过缓存）"""
+        # 同一实体常被多个模式命中：按ID合并节点（后出现的属性覆盖前者），按 (源, 目标, 关系) 去重边
+        nodes_by_id: Dict[str, Dict[str, Any]] = {}
+        edges_by_key: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
         
         logger.info(f"开始分析RPG文本: {text[:100]}...")
+        lowered_text = text.lower()
+        has_cjk = _CJK_CHAR_RE.search(text) is not None
         
         # 1. 提取RPG实体
         for entity_type, patterns in self.rpg_entity_patterns.items():
+            if not self._entity_gates[entity_type].search(text):
+                continue
             for pattern in patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
+                if not self._may_match(pattern, lowered_text, has_cjk):
+                    continue
+                matches = pattern.finditer(text)
                 for match in matches:
                     entity_name = self._extract_entity_name_from_match(match)
                     if entity_name and len(entity_name) > 1:
@@ -161,7 +380,7 @@ class RPGTextProcessor:
                             if level_info:
                                 attributes.update(level_info)
                         
-                        nodes_to_add.append({
+                        self._merge_node(nodes_by_id, {
                             "node_id": entity_id,
                             "type": entity_type,
                             "attributes": attributes
@@ -170,29 +389,34 @@ class RPGTextProcessor:
         # 2. 提取数值属性变化
         numerical_updates = self._extract_numerical_changes(text)
         for update in numerical_updates:
-            nodes_to_add.append(update)
+            self._merge_node(nodes_by_id, update)
         
         # 3. 提取RPG关系
-        for pattern, relation_type in self.rpg_relation_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        relation_patterns = self.rpg_relation_patterns if self._relation_gate.search(text) else ()
+        for pattern, relation_type in relation_patterns:
+            if not self._may_match(pattern, lowered_text, has_cjk):
+                continue
+            matches = pattern.finditer(text)
             for match in matches:
-                if len(match.groups()) >= 2:
-                    source_name = match.group(1).strip()
-                    target_name = match.group(2).strip()
+                source_name = match.group("source").strip()
+                target_name = match.group("target").strip()
+                
+                if source_name and target_name:
+                    source_id = self._generate_rpg_entity_id(source_name, "unknown")
+                    target_id = self._generate_rpg_entity_id(target_name, "unknown")
                     
-                    if source_name and target_name:
-                        source_id = self._generate_rpg_entity_id(source_name, "unknown")
-                        target_id = self._generate_rpg_entity_id(target_name, "unknown")
-                        
-                        edges_to_add.append({
-                            "source": source_id,
-                            "target": target_id,
-                            "relationship": relation_type
-                        })
+                    edges_by_key.setdefault((source_id, target_id, relation_type), {
+                        "source": source_id,
+                        "target": target_id,
+                        "relationship": relation_type
+                    })
         
         # 4. 提取技能和状态效果
-        skill_updates = self._extract_skills_and_effects(text)
-        edges_to_add.extend(skill_updates)
+        for edge in self._extract_skills_and_effects(text):
+            edges_by_key.setdefault((edge["source"], edge["target"], edge["relationship"]), edge)
+        
+        nodes_to_add = list(nodes_by_id.values())
+        edges_to_add = list(edges_by_key.values())
         
         result = {
             "nodes_to_add": nodes_to_add,
@@ -210,6 +434,35 @@ class RPGTextProcessor:
         logger.info(f"RPG提取完成: {len(nodes_to_add)} 个实体, {len(edges_to_add)} 个关系, {len(result.get('deletion_events', []))} 个删除事件")
         return result
 
+    @staticmethod
+    def _merge_node(nodes_by_id: Dict[str, Dict[str, Any]], node: Dict[str, Any]):
+        """将节点并入 {节点ID: 节点}，ID已存在时合并属性"""
+        existing = nodes_by_id.get(node["node_id"])
+        if existing is None:
+            nodes_by_id[node["node_id"]] = node
+        else:
+            existing["attributes"].update(node["attributes"])
+
+    def extract_many(self, texts: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        批量提取多段文本（例如导入聊天记录），按文本分发到多个进程并行处理
+        
+        Args:
+            texts: 待分析的文本列表
+            workers: 进程数，默认为CPU核数
+            
+        Returns:
+            与texts顺序一致的提取结果列表
+        """
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(texts) < _MIN_PARALLEL_TEXTS:
+            return [self.extract_rpg_entities_and_relations(text) for text in texts]
+        
+        # 每个进程分到若干块，减少进程间通信次数
+        chunksize = max(1, len(texts) // workers // 4)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.extract_rpg_entities_and_relations, texts, chunksize=chunksize))
+
     def _extract_deletion_events(self, text: str) -> Dict[str, Any]:
         """
         检测并处理删除/死亡/丢失事件
@@ -223,12 +476,17 @@ class RPGTextProcessor:
         nodes_to_delete = []
         edges_to_delete = []
         deletion_events = []
+        lowered_text = text.lower()
+        has_cjk = _CJK_CHAR_RE.search(text) is not None
         
-        for pattern, event_type in self.deletion_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        deletion_patterns = self.deletion_patterns if self._deletion_gate.search(text) else ()
+        for pattern, event_type in deletion_patterns:
+            if not self._may_match(pattern, lowered_text, has_cjk):
+                continue
+            matches = pattern.finditer(text)
             for match in matches:
                 if event_type == "character_death":
-                    character_name = match.group(1)
+                    character_name = match.group("character")
                     char_id = self._generate_rpg_entity_id(character_name, "character")
                     
                     nodes_to_delete.append({
@@ -245,7 +503,7 @@ class RPGTextProcessor:
                     })
                     
                 elif event_type == "item_lost":
-                    item_name = match.group(1)
+                    item_name = match.group("item")
                     item_id = self._generate_rpg_entity_id(item_name, "item")
                     
                     nodes_to_delete.append({
@@ -262,7 +520,7 @@ class RPGTextProcessor:
                     })
                     
                 elif event_type == "item_stolen":
-                    item_name = match.group(1)
+                    item_name = match.group("item")
                     item_id = self._generate_rpg_entity_id(item_name, "item")
                     
                     # 物品被偷走，删除装备关系，但保留物品节点
@@ -281,8 +539,8 @@ class RPGTextProcessor:
                     })
                     
                 elif event_type == "relationship_broken":
-                    entity1 = match.group(1)
-                    entity2 = match.group(2)
+                    entity1 = match.group("entity1")
+                    entity2 = match.group("entity2")
                     entity1_id = self._generate_rpg_entity_id(entity1, "character")
                     entity2_id = self._generate_rpg_entity_id(entity2, "character")
                     
@@ -310,8 +568,8 @@ class RPGTextProcessor:
                     })
                     
                 elif event_type == "left_organization":
-                    character = match.group(1)
-                    organization = match.group(2)
+                    character = match.group("character")
+                    organization = match.group("organization")
                     char_id = self._generate_rpg_entity_id(character, "character")
                     org_id = self._generate_rpg_entity_id(organization, "guild_organization")
                     
@@ -331,8 +589,8 @@ class RPGTextProcessor:
                     })
                     
                 elif event_type == "left_location":
-                    character = match.group(1)
-                    location = match.group(2)
+                    character = match.group("character")
+                    location = match.group("location")
                     char_id = self._generate_rpg_entity_id(character, "character")
                     loc_id = self._generate_rpg_entity_id(location, "location")
                     
@@ -365,64 +623,61 @@ class RPGTextProcessor:
     def _extract_equipment_stats(self, equipment_text: str) -> Dict[str, Any]:
         """从装备文本中提取数值属性"""
         stats = {}
-        
-        # 提取攻击力
-        atk_match = re.search(r"(?:攻击力|伤害|ATK)[+\-]?(\d+)", equipment_text)
-        if atk_match:
-            stats["attack"] = int(atk_match.group(1))
-        
-        # 提取防御力
-        def_match = re.search(r"(?:防御力|防御|DEF|护甲)[+\-]?(\d+)", equipment_text)
-        if def_match:
-            stats["defense"] = int(def_match.group(1))
-        
-        # 提取强化等级
-        enhance_match = re.search(r"[+](\d+)", equipment_text)
-        if enhance_match:
-            stats["enhancement_level"] = int(enhance_match.group(1))
-        
-        # 提取稀有度
-        rarity_match = re.search(r"(史诗|传说|稀有|普通|魔法)", equipment_text)
-        if rarity_match:
-            stats["rarity"] = rarity_match.group(1)
+        for match in _EQUIP_STATS_RE.finditer(equipment_text):
+            stat_name = match.lastgroup
+            if stat_name not in stats:
+                value = match.group(stat_name)
+                stats[stat_name] = value if stat_name == "rarity" else int(value)
         
         return stats
 
     def _extract_character_level(self, character_text: str) -> Optional[Dict[str, Any]]:
         """从角色文本中提取等级信息"""
-        level_match = re.search(r"(?:等级|Lv\.?|Level)\s*(\d+)", character_text)
+        level_match = _CHARACTER_LEVEL_RE.search(character_text)
         if level_match:
             return {"level": int(level_match.group(1))}
         return None
 
     def _extract_numerical_changes(self, text: str) -> List[Dict[str, Any]]:
         """提取数值变化，如血量、经验值等"""
-        updates = []
+        # 所有数值都写到同一个虚拟玩家节点上：直接累积到一个属性字典，而不是每个匹配构造一个节点字典
+        player_attributes: Dict[str, int] = {}
+        lowered_text = text.lower()
+        has_cjk = _CJK_CHAR_RE.search(text) is not None
         
         for category, patterns in self.numerical_patterns.items():
+            if not self._numerical_gates[category].search(text):
+                continue
             for pattern in patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
+                if not self._may_match(pattern, lowered_text, has_cjk):
+                    continue
+                matches = pattern.finditer(text)
                 for match in matches:
                     # 根据匹配内容判断是哪个属性
                     attr_name = self._determine_attribute_name(match.group(0))
                     if attr_name:
-                        value = int(match.group(1))
-                        
-                        # 创建虚拟的角色节点来存储数值变化
-                        updates.append({
-                            "node_id": "player", # 默认假设是玩家
-                            "type": "character",
-                            "attributes": {attr_name: value}
-                        })
+                        player_attributes[attr_name] = int(match.group(1))
         
-        return updates
+        if not player_attributes:
+            return []
+        # 创建虚拟的角色节点来存储数值变化
+        return [{
+            "node_id": "player", # 默认假设是玩家
+            "type": "character",
+            "attributes": player_attributes
+        }]
 
     def _extract_skills_and_effects(self, text: str) -> List[Dict[str, Any]]:
         """提取技能使用和状态效果"""
         relations = []
+        lowered_text = text.lower()
+        has_cjk = _CJK_CHAR_RE.search(text) is not None
         
-        for pattern in self.skill_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        skill_patterns = self.skill_patterns if self._skill_gate.search(text) else ()
+        for pattern in skill_patterns:
+            if not self._may_match(pattern, lowered_text, has_cjk):
+                continue
+            matches = pattern.finditer(text)
             for match in matches:
                 skill_name = match.group(1).strip()
                 if skill_name:
@@ -436,19 +691,12 @@ class RPGTextProcessor:
 
     def _determine_attribute_name(self, text: str) -> Optional[str]:
         """根据文本内容判断属性名称"""
-        if re.search(r"攻击力|伤害|ATK", text):
-            return "attack"
-        elif re.search(r"防御力|防御|DEF", text):
-            return "defense" 
-        elif re.search(r"血量|生命|HP", text):
-            return "health"
-        elif re.search(r"魔法|法力|MP", text):
-            return "mana"
-        elif re.search(r"等级|级别|Lv", text):
-            return "level"
-        elif re.search(r"经验|EXP", text):
-            return "experience"
-        return None
+        # 数值匹配片段通常只含一个属性词；含多个时按优先级取，与逐个判断的结果一致
+        return min(
+            (match.lastgroup for match in _ATTRIBUTE_NAME_RE.finditer(text)),
+            key=_ATTRIBUTE_PRIORITY.__getitem__,
+            default=None
+        )
 
     def _extract_entity_name_from_match(self, match) -> Optional[str]:
         """从正则匹配中提取实体名称"""
@@ -460,34 +708,18 @@ class RPGTextProcessor:
                     return group.strip()
         return None
 
-    def _generate_rpg_entity_id(self, name: str, entity_type: str) -> str:
-        """生成RPG实体ID"""
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _generate_rpg_entity_id(name: str, entity_type: str) -> str:
+        """生成RPG实体ID（纯函数，同一文本中反复出现的名称直接命中缓存）"""
         # 清理名称
-        clean_name = re.sub(r'[^\w\u4e00-\u9fa5]+', '_', name.lower())
-        
-        # RPG专用的翻译映射
-        rpg_translation_map = {
-            # 职业
-            "战士": "warrior", "法师": "mage", "盗贼": "thief", "牧师": "priest",
-            "骑士": "knight", "弓箭手": "archer", "刺客": "assassin", "德鲁伊": "druid",
-            
-            # 装备
-            "长剑": "longsword", "战斧": "battleaxe", "法杖": "staff", "匕首": "dagger",
-            "盔甲": "armor", "盾牌": "shield", "头盔": "helmet", "靴子": "boots",
-            
-            # 地点
-            "酒馆": "tavern", "铁匠铺": "blacksmith", "魔法塔": "magic_tower",
-            "地牢": "dungeon", "城堡": "castle", "森林": "forest", "沙漠": "desert",
-            
-            # 通用
-            "玩家": "player", "敌人": "enemy", "NPC": "npc",
-        }
+        clean_name = _ENTITY_ID_CLEAN_RE.sub('_', name.lower())
         
-        if clean_name in rpg_translation_map:
-            return rpg_translation_map[clean_name]
+        if clean_name in _RPG_TRANSLATION_MAP:
+            return _RPG_TRANSLATION_MAP[clean_name]
         
         # 如果没有映射，使用类型前缀
         if entity_type != "unknown":
             return f"{entity_type}_{clean_name}"
         else:
-            return clean_name
\ No newline at end of file
+            return clean_name
@@ -4,15 +4,20 @@
 解决SillyTavern对话历史不稳定性问题
 """
 
-from collections import deque
+import sys
+from collections import OrderedDict
+from itertools import islice
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timezone
 import uuid
 from loguru import logger
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
 
+# Python 3.10+ 的 dataclass 支持 slots=True：去掉实例 __dict__，节省内存并加快属性访问
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+
+@dataclass(**_DATACLASS_SLOTS)
 class ConversationTurn:
     """单轮对话数据结构"""
     turn_id: str
@@ -23,13 +28,24 @@ class ConversationTurn:
     grag_processed: bool = False
     grag_timestamp: Optional[datetime] = None
     version: int = 1
+    # turn_id 的前8位，构造时算一次，日志里直接引用
+    short_id: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.short_id = self.turn_id[:8]
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
-        data = asdict(self)
-        data['timestamp'] = self.timestamp.isoformat()
-        data['grag_timestamp'] = self.grag_timestamp.isoformat() if self.grag_timestamp else None
-        return data
+        return {
+            'turn_id': self.turn_id,
+            'sequence': self.sequence,
+            'timestamp': self.timestamp.isoformat(),
+            'user_input': self.user_input,
+            'llm_response': self.llm_response,
+            'grag_processed': self.grag_processed,
+            'grag_timestamp': self.grag_timestamp.isoformat() if self.grag_timestamp else None,
+            'version': self.version,
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'ConversationTurn':
@@ -52,11 +68,24 @@ class SlidingWindowManager:
         """
         self.window_size = window_size
         self.processing_delay = processing_delay
-        self.conversations: deque[ConversationTurn] = deque(maxlen=window_size)
+        # 轮次ID -> 对话轮次，按加入顺序排列：同一个结构既负责按ID查找，也负责先进先出淘汰
+        self._turns: "OrderedDict[str, ConversationTurn]" = OrderedDict()
         self.sequence_counter = 0
-        self.turn_id_map: Dict[str, ConversationTurn] = {}
+        # 窗口内已处理轮次数随增删改增量维护；窗口状态信息在下一次变更前缓存
+        self._processed_count = 0
+        self._info_cache: Optional[Dict[str, Any]] = None
         
         logger.info(f"滑动窗口管理器初始化: 窗口大小={window_size}, 延迟={processing_delay}")
+
+    @property
+    def conversations(self) -> List[ConversationTurn]:
+        """窗口内的对话轮次（从旧到新）"""
+        return list(self._turns.values())
+
+    @property
+    def turn_id_map(self) -> Dict[str, ConversationTurn]:
+        """轮次ID -> 对话轮次（只读视图，请通过管理器方法修改窗口）"""
+        return self._turns
     
     def add_turn(self, user_input: str, llm_response: str) -> ConversationTurn:
         """
@@ -79,17 +108,17 @@ class SlidingWindowManager:
         )
         
         # 如果窗口满了，移除最旧的对话
-        if len(self.conversations) >= self.window_size:
-            old_turn = self.conversations[0]  # 即将被移除的对话
-            if old_turn.turn_id in self.turn_id_map:
-                del self.turn_id_map[old_turn.turn_id]
-            logger.debug(f"移除旧对话: 序号={old_turn.sequence}, ID={old_turn.turn_id[:8]}")
+        if self._turns and len(self._turns) >= self.window_size:
+            _, old_turn = self._turns.popitem(last=False)
+            if old_turn.grag_processed:
+                self._processed_count -= 1
+            logger.debug(f"移除旧对话: 序号={old_turn.sequence}, ID={old_turn.short_id}")
         
         # 添加新对话到窗口
-        self.conversations.append(turn)
-        self.turn_id_map[turn.turn_id] = turn
+        self._turns[turn.turn_id] = turn
+        self._info_cache = None
         
-        logger.info(f"添加新对话: 序号={turn.sequence}, ID={turn.turn_id[:8]}, 窗口大小={len(self.conversations)}")
+        logger.info(f"添加新对话: 序号={turn.sequence}, ID={turn.short_id}, 窗口大小={len(self._turns)}")
         
         return turn
     
@@ -100,19 +129,18 @@ class SlidingWindowManager:
         Returns:
             待处理的对话轮次，如果没有则返回None
         """
-        if len(self.conversations) <= self.processing_delay:
+        if len(self._turns) <= self.processing_delay:
             logger.debug(f"对话轮数不足，需要至少{self.processing_delay + 1}轮")
             return None
         
-        # 获取倒数第(processing_delay + 1)个对话
-        target_index = -(self.processing_delay + 1)
-        target_turn = self.conversations[target_index]
+        # 获取倒数第(processing_delay + 1)个对话：从新到旧只走 processing_delay + 1 步
+        target_turn = next(islice(reversed(self._turns.values()), self.processing_delay, None))
         
         if target_turn.grag_processed:
             logger.debug(f"目标轮次已处理: 序号={target_turn.sequence}")
             return None
             
-        logger.info(f"找到待处理轮次: 序号={target_turn.sequence}, ID={target_turn.turn_id[:8]}")
+        logger.info(f"找到待处理轮次: 序号={target_turn.sequence}, ID={target_turn.short_id}")
         return target_turn
     
     def mark_processed(self, turn_id: str, success: bool = True) -> bool:
@@ -126,13 +154,16 @@ class SlidingWindowManager:
         Returns:
             是否成功标记
         """
-        if turn_id not in self.turn_id_map:
+        turn = self._turns.get(turn_id)
+        if turn is None:
             logger.warning(f"未找到对话轮次: {turn_id[:8]}")
             return False
-        
-        turn = self.turn_id_map[turn_id]
+
+        if success != turn.grag_processed:
+            self._processed_count += 1 if success else -1
         turn.grag_processed = success
         turn.grag_timestamp = datetime.now(timezone.utc) if success else None
+        self._info_cache = None
         
         logger.info(f"标记处理状态: 序号={turn.sequence}, 成功={success}")
         return True
@@ -149,12 +180,11 @@ class SlidingWindowManager:
         Returns:
             是否成功更新
         """
-        if turn_id not in self.turn_id_map:
+        turn = self._turns.get(turn_id)
+        if turn is None:
             logger.warning(f"未找到对话轮次: {turn_id[:8]}")
             return False
         
-        turn = self.turn_id_map[turn_id]
-        
         # 更新内容
         if user_input is not None:
             turn.user_input = user_input
@@ -162,10 +192,13 @@ class SlidingWindowManager:
             turn.llm_response = llm_response
         
         # 重置处理状态，因为内容已修改
+        if turn.grag_processed:
+            self._processed_count -= 1
         turn.grag_processed = False
         turn.grag_timestamp = None
         turn.version += 1
         turn.timestamp = datetime.now(timezone.utc)
+        self._info_cache = None
         
         logger.info(f"更新对话轮次: 序号={turn.sequence}, 版本={turn.version}")
         return True
@@ -180,47 +213,59 @@ class SlidingWindowManager:
         Returns:
             最近的对话列表
         """
-        recent_turns = list(self.conversations)[-max_turns:]
+        if max_turns > 0:
+            # 从最新一轮往回取 max_turns 个，不复制整个窗口
+            recent_turns = list(islice(reversed(self._turns.values()), max_turns))
+            recent_turns.reverse()
+        else:
+            recent_turns = list(self._turns.values())[-max_turns:]
         logger.debug(f"获取最近{len(recent_turns)}轮对话上下文")
         return recent_turns
     
     def get_all_turns(self) -> List[ConversationTurn]:
         """获取窗口内所有对话轮次"""
-        return list(self.conversations)
+        return list(self._turns.values())
     
     def get_turn_by_id(self, turn_id: str) -> Optional[ConversationTurn]:
         """根据ID获取对话轮次"""
-        return self.turn_id_map.get(turn_id)
+        return self._turns.get(turn_id)
     
     def is_in_window(self, turn_id: str) -> bool:
         """检查对话轮次是否在滑动窗口内"""
-        return turn_id in self.turn_id_map
+        return turn_id in self._turns
     
-    def get_window_info(self) -> Dict[str, Any]:
-        """获取窗口状态信息"""
-        processed_count = sum(1 for turn in self.conversations if turn.grag_processed)
-        pending_target = self.get_processing_target()
-        
+    def get_window_counts(self) -> Dict[str, Any]:
+        """获取窗口计数信息（不查找待处理目标，只需要计数的调用方用这个）"""
+        turns = self._turns.values()
         return {
             "window_size": self.window_size,
-            "current_turns": len(self.conversations),
-            "processed_turns": processed_count,
-            "pending_turns": len(self.conversations) - processed_count,
-            "next_processing_target": pending_target.turn_id[:8] if pending_target else None,
-            "oldest_sequence": self.conversations[0].sequence if self.conversations else None,
-            "newest_sequence": self.conversations[-1].sequence if self.conversations else None
+            "current_turns": len(self._turns),
+            "processed_turns": self._processed_count,
+            "pending_turns": len(self._turns) - self._processed_count,
+            "oldest_sequence": next(iter(turns)).sequence if turns else None,
+            "newest_sequence": next(reversed(turns)).sequence if turns else None
         }
+
+    def get_window_info(self) -> Dict[str, Any]:
+        """获取窗口状态信息（窗口未变更时直接返回缓存结果的副本）"""
+        if self._info_cache is None:
+            pending_target = self.get_processing_target()
+            info = self.get_window_counts()
+            info["next_processing_target"] = pending_target.short_id if pending_target else None
+            self._info_cache = info
+        return dict(self._info_cache)
     
     def clear_window(self):
         """清空滑动窗口（用于测试或重置）"""
-        self.conversations.clear()
-        self.turn_id_map.clear()
+        self._turns.clear()
         self.sequence_counter = 0
+        self._processed_count = 0
+        self._info_cache = None
         logger.info("滑动窗口已清空")
 
 
 # 配置类
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class SlidingWindowConfig:
     """滑动窗口配置"""
     window_size: int = 4
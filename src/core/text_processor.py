@@ -2,17 +2,33 @@
 文本处理器 - 替代LLM客户端进行本地文本分析
 专门为SillyTavern插件设计，不依赖外部LLM调用
 """
+import functools
 import re
 import json
 from typing import Dict, Any, List
 from loguru import logger
 
+# 简单的中英文转换映射（可以扩展）
+_TRANSLATION_MAP = {
+    "我": "player",
+    "你": "you",
+    "主角": "protagonist",
+    "商店": "shop",
+    "酒馆": "tavern",
+    "房间": "room",
+    "剑": "sword",
+    "盾牌": "shield"
+}
+
+_ENTITY_ID_CLEAN_RE = re.compile(r'[^a-zA-Z\u4e00-\u9fa5]+')
+
+
 class TextProcessor:
     """本地文本处理器，用于替代LLM进行简单的信息提取"""
     
     def __init__(self):
-        # 基础实体识别模式
-        self.entity_patterns = {
+        # 基础实体识别模式（在初始化时统一预编译）
+        entity_patterns = {
             "character": [
                 r"(我|你|他|她|它)(?:是|叫|名字叫|被称为)([^，。！？\s]+)",
                 r"([A-Za-z\u4e00-\u9fa5]+)(?:是一个|是个)(?:角色|人物|角色扮演|character)",
@@ -28,12 +44,47 @@ class TextProcessor:
         }
         
         # 关系识别模式
-        self.relation_patterns = [
+        relation_patterns = [
             (r"([^，。！？\s]+)(?:属于|归属于|是)([^，。！？\s]+)的", "belongs_to"),
             (r"([^，。！？\s]+)(?:位于|在)([^，。！？\s]+)", "located_in"),
             (r"([^，。！？\s]+)(?:持有|拥有|带着)([^，。！？\s]+)", "owns"),
             (r"([^，。！？\s]+)(?:认识|知道|见过)([^，。！？\s]+)", "knows"),
         ]
+
+        # 状态变化模式
+        state_patterns = [
+            (r"([^，。！？\s]+)(?:的)?(?:位置|地点)(?:变成了|变为|是)([^，。！？\s]+)", "location"),
+            (r"([^，。！？\s]+)(?:的)?(?:状态|情况)(?:变成了|变为|是)([^，。！？\s]+)", "status"),
+            (r"([^，。！？\s]+)(?:的)?(?:血量|生命|HP)(?:变成了|变为|是)([^，。！？\s]+)", "health"),
+            (r"([^，。！？\s]+)(?:现在|目前)(?:在|位于)([^，。！？\s]+)", "location"),
+        ]
+
+        self.entity_patterns = {
+            entity_type: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            for entity_type, patterns in entity_patterns.items()
+        }
+        self.relation_patterns = [
+            (re.compile(pattern, re.IGNORECASE), relation_type)
+            for pattern, relation_type in relation_patterns
+        ]
+        self._state_patterns = [
+            (re.compile(pattern, re.IGNORECASE), attribute)
+            for pattern, attribute in state_patterns
+        ]
+
+        # 每组模式合并成一个交替正则作为闸门：一次扫描即可判断该组是否可能命中，
+        # 未命中时跳过整组。闸门只做判断，逐个模式的finditer保留，因为同组模式之间
+        # 允许重叠匹配，单次交替扫描会丢失这些结果
+        self._entity_gate = self._combine_patterns(
+            [pattern for patterns in self.entity_patterns.values() for pattern in patterns]
+        )
+        self._relation_gate = self._combine_patterns([pattern for pattern, _ in self.relation_patterns])
+        self._state_gate = self._combine_patterns([pattern for pattern, _ in self._state_patterns])
+
+    @staticmethod
+    def _combine_patterns(patterns: List[re.Pattern]) -> re.Pattern:
+        """将一组已编译模式合并为一个交替正则"""
+        return re.compile("|".join(f"(?:{pattern.pattern})" for pattern in patterns), re.IGNORECASE)
         
     def extract_entities_and_relations(self, text: str) -> Dict[str, Any]:
         """
@@ -44,9 +95,10 @@ class TextProcessor:
         edges_to_add = []
         
         # 1. 提取实体
-        for entity_type, patterns in self.entity_patterns.items():
+        entity_patterns = self.entity_patterns.items() if self._entity_gate.search(text) else ()
+        for entity_type, patterns in entity_patterns:
             for pattern in patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
+                matches = pattern.finditer(text)
                 for match in matches:
                     if len(match.groups()) >= 2:
                         entity_name = match.group(2).strip()
@@ -67,8 +119,9 @@ class TextProcessor:
                         })
         
         # 2. 提取关系
-        for pattern, relation_type in self.relation_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        relation_patterns = self.relation_patterns if self._relation_gate.search(text) else ()
+        for pattern, relation_type in relation_patterns:
+            matches = pattern.finditer(text)
             for match in matches:
                 if len(match.groups()) >= 2:
                     source_name = match.group(1).strip()
@@ -100,16 +153,9 @@ class TextProcessor:
         nodes_to_update = []
         edges_to_add = []
         
-        # 状态变化模式
-        state_patterns = [
-            (r"([^，。！？\s]+)(?:的)?(?:位置|地点)(?:变成了|变为|是)([^，。！？\s]+)", "location"),
-            (r"([^，。！？\s]+)(?:的)?(?:状态|情况)(?:变成了|变为|是)([^，。！？\s]+)", "status"),
-            (r"([^，。！？\s]+)(?:的)?(?:血量|生命|HP)(?:变成了|变为|是)([^，。！？\s]+)", "health"),
-            (r"([^，。！？\s]+)(?:现在|目前)(?:在|位于)([^，。！？\s]+)", "location"),
-        ]
-        
+        state_patterns = self._state_patterns if self._state_gate.search(text) else ()
         for pattern, attribute in state_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+            matches = pattern.finditer(text)
             for match in matches:
                 if len(match.groups()) >= 2:
                     entity_name = match.group(1).strip()
@@ -130,28 +176,18 @@ class TextProcessor:
         logger.info(f"状态更新提取完成: {len(nodes_to_update)} 个节点更新")
         return result
     
-    def _generate_entity_id(self, name: str, entity_type: str) -> str:
-        """生成实体ID，将中文名转换为英文ID"""
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def _generate_entity_id(name: str, entity_type: str) -> str:
+        """生成实体ID，将中文名转换为英文ID（纯函数，反复出现的名称直接命中缓存）"""
         # 简单的名称清理
-        clean_name = re.sub(r'[^a-zA-Z\u4e00-\u9fa5]+', '_', name.lower())
-        
-        # 简单的中英文转换映射（可以扩展）
-        translation_map = {
-            "我": "player",
-            "你": "you", 
-            "主角": "protagonist",
-            "商店": "shop",
-            "酒馆": "tavern",
-            "房间": "room",
-            "剑": "sword",
-            "盾牌": "shield"
-        }
+        clean_name = _ENTITY_ID_CLEAN_RE.sub('_', name.lower())
         
-        if clean_name in translation_map:
-            return translation_map[clean_name]
+        if clean_name in _TRANSLATION_MAP:
+            return _TRANSLATION_MAP[clean_name]
         
         # 如果没有映射，使用原名生成ID
         if entity_type != "unknown":
             return f"{entity_type}_{clean_name}"
         else:
-            return clean_name
\ No newline at end of file
+            return clean_name
@@ -1,7 +1,31 @@
 import networkx as nx
 import json
+import os
 from loguru import logger
-from typing import List, Dict, Any, Optional, Tuple
+from src.utils import json_utils
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+# 文本表示中不输出的节点字段：type 已单独展示，其余为内部记录（与GRAG分析Prompt的排除字段一致）
+_TEXT_EXCLUDED_NODE_KEYS = frozenset({"type", "_deleted_timestamp", "_history"})
+_TEXT_EXCLUDED_EDGE_KEYS = frozenset({"relationship"})
+
+# search_nodes 倒排索引的n-gram长度；短于此长度的查询直接扫描全部节点
+_SEARCH_NGRAM = 3
+
+# 属性冲突解决使用的属性名集合
+_HEALTH_KEYS = frozenset({"health", "hp", "血量"})
+_MONOTONIC_KEYS = frozenset({"max_health", "max_hp", "最大血量", "level", "等级", "experience", "exp", "经验"})  # 只增不减，取较大值
+_LOCATION_KEYS = frozenset({"location", "位置"})
+_STATUS_KEYS = frozenset({"status", "状态"})
+
+
+def _format_attributes(attrs: Dict[str, Any], excluded_keys) -> str:
+    """将属性格式化为 "k: v" 列表，字符串值使用 repr"""
+    return ", ".join(
+        f"{k}: {v!r}" if isinstance(v, str) else f"{k}: {v}"
+        for k, v in attrs.items() if k not in excluded_keys
+    )
+
 
 class KnowledgeGraph:
     """
@@ -12,6 +36,20 @@ class KnowledgeGraph:
     def __init__(self):
         """初始化一个有向图。"""
         self.graph = nx.DiGraph()
+        # 图谱版本号：每次通过本类修改图谱时递增，供派生索引/缓存判断是否失效
+        self.version = 0
+        # search_nodes 的检索索引：节点ID -> 小写的“ID + 全部属性值”拼接串，
+        # 以及按需构建的 三字片段 -> 节点ID集合 倒排索引；按(图谱版本, 节点数)整体失效
+        self._search_index: Dict[str, str] = {}
+        self._search_ngrams: Optional[Dict[str, Set[str]]] = None
+        self._search_index_key: Optional[Tuple[int, int]] = None
+        # get_active_nodes 的结果，同样按图谱版本失效
+        self._active_nodes: List[str] = []
+        self._active_nodes_version = -1
+        # to_text_representation 中每个节点的文本行，按(图谱版本, 节点数)整体失效，
+        # 不同实体组合的子图共享同一节点时不再重复格式化
+        self._node_text_cache: Dict[str, str] = {}
+        self._node_text_key: Optional[Tuple[int, int]] = None
         logger.info("KnowledgeGraph initialized with a directed graph.")
 
     def add_or_update_node(self, node_id: str, node_type: str, **kwargs):
@@ -29,9 +67,11 @@ class KnowledgeGraph:
 
         if self.graph.has_node(node_id):
             self.graph.nodes[node_id].update(attributes)
+            self.version += 1
             logger.info(f"Node '{node_id}' updated with attributes: {attributes}")
         else:
             self.graph.add_node(node_id, **attributes)
+            self.version += 1
             logger.info(f"Node '{node_id}' added with attributes: {attributes}")
 
     def add_edge(self, source_node: str, target_node: str, relationship: str, **kwargs):
@@ -52,8 +92,101 @@ class KnowledgeGraph:
             return
 
         self.graph.add_edge(source_node, target_node, relationship=relationship, **kwargs)
+        self.version += 1
         logger.info(f"Edge added from '{source_node}' to '{target_node}' with relationship '{relationship}'.")
 
+    def bulk_add_or_update_nodes(self, nodes: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """
+        批量添加或更新节点。已存在的节点走冲突解决逻辑，新节点通过一次 add_nodes_from 插入。
+
+        Args:
+            nodes (List[Tuple[str, str, Dict[str, Any]]]): (节点ID, 节点类型, 属性) 列表。
+
+        Returns:
+            int: 处理的节点数量。
+        """
+        new_nodes: Dict[str, Dict[str, Any]] = {}
+        updated = 0
+        for node_id, node_type, attributes in nodes:
+            if node_id in new_nodes:
+                # 同一批次中重复出现的新节点，合并属性
+                new_nodes[node_id].update(attributes)
+                new_nodes[node_id]['type'] = node_type
+            elif self.graph.has_node(node_id):
+                self.add_or_update_node_with_conflict_resolution(node_id, node_type, **attributes)
+                updated += 1
+            else:
+                new_attributes = dict(attributes)
+                new_attributes['type'] = node_type
+                new_nodes[node_id] = new_attributes
+
+        if new_nodes:
+            self.graph.add_nodes_from(new_nodes.items())
+            self.version += 1
+        logger.info(f"Bulk node update: {len(new_nodes)} added, {updated} updated.")
+        return len(new_nodes) + updated
+
+    def bulk_add_edges(self, edges: List[Tuple[str, str, str, Dict[str, Any]]]) -> int:
+        """
+        批量添加关系边。先一次性检查端点是否存在，再通过一次 add_edges_from 插入。
+
+        Args:
+            edges (List[Tuple[str, str, str, Dict[str, Any]]]): (源节点ID, 目标节点ID, 关系, 其他属性) 列表。
+
+        Returns:
+            int: 实际添加的边数量。
+        """
+        nodes = self.graph.nodes
+        valid_edges = []
+        for source_node, target_node, relationship, attributes in edges:
+            if source_node in nodes and target_node in nodes:
+                edge_attributes = dict(attributes)
+                edge_attributes['relationship'] = relationship
+                valid_edges.append((source_node, target_node, edge_attributes))
+            else:
+                logger.warning(f"Edge '{source_node}' -> '{target_node}' skipped: endpoint not found.")
+
+        if valid_edges:
+            self.graph.add_edges_from(valid_edges)
+            self.version += 1
+        logger.info(f"Bulk-added {len(valid_edges)}/{len(edges)} edges.")
+        return len(valid_edges)
+
+    def bulk_load_nodes(self, nodes: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        从持久化数据批量载入节点，通过一次 add_nodes_from 完成。
+        与逐个调用 add_or_update_node 等价：已存在的节点直接合并属性，不走冲突解决。
+
+        Args:
+            nodes (List[Tuple[str, Dict[str, Any]]]): (节点ID, 属性) 列表，属性中应包含 'type'。
+
+        Returns:
+            int: 载入的节点数量。
+        """
+        if nodes:
+            self.graph.add_nodes_from(nodes)
+            self.version += 1
+        logger.info(f"Bulk-loaded {len(nodes)} nodes.")
+        return len(nodes)
+
+    def bulk_delete_nodes(self, node_ids: List[str]) -> int:
+        """
+        批量删除节点及其所有相关边，通过一次 remove_nodes_from 完成。
+
+        Args:
+            node_ids (List[str]): 要删除的节点ID列表，不存在的节点会被忽略。
+
+        Returns:
+            int: 实际删除的节点数量。
+        """
+        nodes = self.graph.nodes
+        existing = [node_id for node_id in dict.fromkeys(node_ids) if node_id in nodes]
+        if existing:
+            self.graph.remove_nodes_from(existing)
+            self.version += 1
+        logger.info(f"Bulk-deleted {len(existing)} nodes.")
+        return len(existing)
+
     def get_node(self, node_id: str) -> Optional[Dict[str, Any]]:
         """
         获取单个节点及其所有属性。
@@ -80,12 +213,18 @@ class KnowledgeGraph:
         Returns:
             nx.DiGraph: 包含相关实体及其关系的子图。
         """
-        relevant_nodes = set()
-        for entity_id in entity_ids:
-            if self.graph.has_node(entity_id):
-                relevant_nodes.add(entity_id)
-                subgraph = nx.ego_graph(self.graph, entity_id, radius=depth)
-                relevant_nodes.update(subgraph.nodes)
+        # 多源逐层BFS：与 ego_graph 一致只沿出边扩展，但不为每个实体构建中间图
+        successors = self.graph.succ
+        frontier = {entity_id for entity_id in entity_ids if entity_id in successors}
+        relevant_nodes = set(frontier)
+        for _ in range(depth):
+            next_frontier = set()
+            for node_id in frontier:
+                next_frontier.update(successors[node_id])
+            frontier = next_frontier - relevant_nodes
+            if not frontier:
+                break
+            relevant_nodes |= frontier
         
         return self.graph.subgraph(relevant_nodes)
 
@@ -99,26 +238,42 @@ class KnowledgeGraph:
             return "The knowledge graph is empty."
 
         text_parts = ["[Nodes]"]
+        append = text_parts.append
+        # 只有本图谱（或其子图视图）的节点属性与缓存一致，外部传入的其他图不使用缓存
+        if target_graph is self.graph or getattr(target_graph, '_graph', None) is self.graph:
+            text_key = (self.version, self.graph.number_of_nodes())
+            if self._node_text_key != text_key:
+                self._node_text_cache = {}
+                self._node_text_key = text_key
+            node_text_cache = self._node_text_cache
+        else:
+            node_text_cache = {}
         for node, attrs in target_graph.nodes(data=True):
-            attr_list = [f"{k}: {repr(v)}" if isinstance(v, str) else f"{k}: {v}" for k, v in attrs.items() if k != 'type']
-            attr_str = ", ".join(attr_list)
-            if attr_str:
-                text_parts.append(f"- {node} (type: {attrs.get('type', 'N/A')}): {{ {attr_str} }}")
-            else:
-                text_parts.append(f"- {node} (type: {attrs.get('type', 'N/A')})")
+            node_text = node_text_cache.get(node)
+            if node_text is None:
+                node_text = node_text_cache[node] = self._format_node_line(node, attrs)
+            append(node_text)
 
-        text_parts.append("\n[Relationships]")
+        append("\n[Relationships]")
         for source, target, attrs in target_graph.edges(data=True):
             rel = attrs.get('relationship', 'related_to')
-            attr_list = [f"{k}: {repr(v)}" if isinstance(v, str) else f"{k}: {v}" for k, v in attrs.items() if k != 'relationship']
-            attr_str = ", ".join(attr_list)
+            attr_str = _format_attributes(attrs, _TEXT_EXCLUDED_EDGE_KEYS)
             if attr_str:
-                text_parts.append(f"- {source} -> {target} ({rel}): {{ {attr_str} }}")
+                append(f"- {source} -> {target} ({rel}): {{ {attr_str} }}")
             else:
-                text_parts.append(f"- {source} -> {target} ({rel})")
+                append(f"- {source} -> {target} ({rel})")
         
         return "\n".join(text_parts)
 
+    @staticmethod
+    def _format_node_line(node: str, attrs: Dict[str, Any]) -> str:
+        """格式化文本表示中的一行节点信息"""
+        attr_str = _format_attributes(attrs, _TEXT_EXCLUDED_NODE_KEYS)
+        node_type = attrs.get('type', 'N/A')
+        if attr_str:
+            return f"- {node} (type: {node_type}): {{ {attr_str} }}"
+        return f"- {node} (type: {node_type})"
+
     def search_nodes(self, query: str) -> List[str]:
         """
         在知识图谱中搜索匹配查询字符串的节点。
@@ -127,57 +282,90 @@ class KnowledgeGraph:
         if not query: # 如果查询为空，返回所有节点
             return sorted(list(self.graph.nodes()))
 
-        matching_nodes = []
         query_lower = query.lower()
+        index_key = (self.version, self.graph.number_of_nodes())
+        if self._search_index_key != index_key:
+            self._search_index = {node_id: self._search_text(node_id, attrs)
+                                  for node_id, attrs in self.graph.nodes(data=True)}
+            self._search_ngrams = None
+            self._search_index_key = index_key
 
-        for node_id, attrs in self.graph.nodes(data=True):
-            # 检查节点ID是否匹配
-            if query_lower in node_id.lower():
-                matching_nodes.append(node_id)
-                continue # 找到匹配后，不再检查属性
-
-            # 检查节点属性值是否匹配
-            for value in attrs.values():
-                if isinstance(value, str) and query_lower in value.lower():
-                    matching_nodes.append(node_id)
-                    break # 找到匹配后，跳出属性循环
-                elif not isinstance(value, str) and query_lower in str(value).lower():
-                    matching_nodes.append(node_id)
-                    break
-        
-        return sorted(list(set(matching_nodes))) # 去重并排序
+        search_index = self._search_index
+        if len(query_lower) >= _SEARCH_NGRAM:
+            # 先用倒排索引求出包含查询全部三字片段的节点，再做精确的子串校验
+            candidates = self._search_candidates(query_lower)
+        else:
+            candidates = search_index
+        return sorted(node_id for node_id in candidates if query_lower in search_index[node_id])
+
+    def _search_candidates(self, query_lower: str) -> Set[str]:
+        """返回检索文本包含查询中每一个三字片段的节点ID（倒排索引在首次需要时构建）"""
+        ngram_index = self._search_ngrams
+        if ngram_index is None:
+            ngram_index = {}
+            n = _SEARCH_NGRAM
+            for node_id, search_text in self._search_index.items():
+                for ngram in {search_text[i:i + n] for i in range(len(search_text) - n + 1)}:
+                    ngram_index.setdefault(ngram, set()).add(node_id)
+            self._search_ngrams = ngram_index
+
+        n = _SEARCH_NGRAM
+        postings = []
+        for ngram in {query_lower[i:i + n] for i in range(len(query_lower) - n + 1)}:
+            posting = ngram_index.get(ngram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    @staticmethod
+    def _search_text(node_id: str, attrs: Dict[str, Any]) -> str:
+        """拼接节点ID和全部属性值并转小写；以\\x00分隔，避免跨值拼出原本不存在的匹配"""
+        return "\x00".join([str(node_id), *map(str, attrs.values())]).lower()
 
-    def save_graph(self, file_path: str):
+    def save_graph(self, file_path: str) -> bool:
         """
         将图保存到文件。在保存前，将所有list类型的属性转换为JSON字符串。
+        先写入临时文件再原子替换，避免写入中途失败留下损坏的图谱文件。
+
+        Returns:
+            bool: 保存成功返回True。
         """
-        # 创建一个图的深拷贝以进行序列化，避免修改原始图
-        graph_to_save = self.graph.copy()
-        for _, data in graph_to_save.nodes(data=True):
-            for key, value in data.items():
-                if isinstance(value, list):
-                    data[key] = json.dumps(value)
+        tmp_path = f"{file_path}.tmp"
         try:
-            nx.write_graphml(graph_to_save, file_path)
+            # 创建一个图的深拷贝以进行序列化，避免修改原始图
+            graph_to_save = self.graph.copy()
+            for _, data in graph_to_save.nodes(data=True):
+                for key, value in data.items():
+                    if isinstance(value, list):
+                        data[key] = json.dumps(value)
+            nx.write_graphml(graph_to_save, tmp_path)
+            os.replace(tmp_path, file_path)
             logger.info(f"Graph saved to {file_path}")
+            return True
         except Exception as e:
             logger.error(f"Failed to save graph to {file_path}: {e}")
+            return False
 
     def load_graph(self, file_path: str):
         """
         从文件加载图。在加载后，将所有JSON字符串的属性转换回list。
         """
         try:
-            self.graph = nx.read_graphml(file_path)
-            for _, data in self.graph.nodes(data=True):
+            graph = nx.read_graphml(file_path)
+            loads = json_utils.loads
+            for _, data in graph.nodes(data=True):
                 for key, value in data.items():
                     # 检查值是否为字符串，并且看起来像一个JSON列表
                     if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
                         try:
-                            data[key] = json.loads(value)
+                            data[key] = loads(value)
                         except json.JSONDecodeError:
                             # 如果解析失败，则保持原样
                             pass
+            self.graph = graph
+            self.version += 1
             logger.info(f"Graph loaded from {file_path} and attributes deserialized.")
         except FileNotFoundError:
             logger.warning(f"Graph file not found at {file_path}. Starting with an empty graph.")
@@ -203,6 +391,7 @@ class KnowledgeGraph:
         out_degree = self.graph.out_degree(node_id)
         
         self.graph.remove_node(node_id)
+        self.version += 1
         logger.info(f"Node '{node_id}' deleted along with {in_degree + out_degree} edges.")
         return True
 
@@ -230,6 +419,7 @@ class KnowledgeGraph:
                 return False
         
         self.graph.remove_edge(source_node, target_node)
+        self.version += 1
         logger.info(f"Edge from '{source_node}' to '{target_node}' deleted.")
         return True
 
@@ -248,18 +438,12 @@ class KnowledgeGraph:
         """
         # 数值类型的智能合并
         if isinstance(old_value, (int, float)) and isinstance(new_value, (int, float)):
-            if attribute in ["health", "hp", "血量"]:
+            if attribute in _HEALTH_KEYS:
                 # 血量取较新的值，但不超过最大值
                 max_health = self.graph.nodes[node_id].get("max_health", new_value)
                 return min(new_value, max_health)
-            elif attribute in ["max_health", "max_hp", "最大血量"]:
-                # 最大血量取较大值
-                return max(old_value, new_value)
-            elif attribute in ["level", "等级"]:
-                # 等级取较大值（通常只会增长）
-                return max(old_value, new_value)
-            elif attribute in ["experience", "exp", "经验"]:
-                # 经验取较大值
+            if attribute in _MONOTONIC_KEYS:
+                # 最大血量、等级、经验取较大值（通常只会增长）
                 return max(old_value, new_value)
         
         # 列表类型的合并
@@ -271,11 +455,11 @@ class KnowledgeGraph:
         
         # 字符串类型的处理
         if isinstance(old_value, str) and isinstance(new_value, str):
-            if attribute in ["location", "位置"]:
+            if attribute in _LOCATION_KEYS:
                 # 位置信息，新值优先
                 logger.info(f"Location updated for '{node_id}': '{old_value}' → '{new_value}'")
                 return new_value
-            elif attribute in ["status", "状态"]:
+            elif attribute in _STATUS_KEYS:
                 # 状态信息，新值优先
                 logger.info(f"Status updated for '{node_id}': '{old_value}' → '{new_value}'")
                 return new_value
@@ -312,10 +496,12 @@ class KnowledgeGraph:
                     resolved_attrs[key] = new_value
             
             self.graph.nodes[node_id].update(resolved_attrs)
+            self.version += 1
             logger.info(f"Node '{node_id}' updated with conflict resolution. Attributes: {attributes}")
         else:
             # 新节点，直接添加
             self.graph.add_node(node_id, **attributes)
+            self.version += 1
             logger.info(f"Node '{node_id}' added with attributes: {attributes}")
 
     def get_node_history(self, node_id: str) -> Optional[List[Dict[str, Any]]]:
@@ -350,6 +536,7 @@ class KnowledgeGraph:
         
         from datetime import datetime
         self.graph.nodes[node_id]['_deleted_timestamp'] = datetime.now().isoformat()
+        self.version += 1
         
         logger.info(f"Node '{node_id}' marked as deleted. Reason: {reason}")
 
@@ -360,8 +547,11 @@ class KnowledgeGraph:
         Returns:
             List[str]: 活跃节点ID列表
         """
-        return [node_id for node_id, data in self.graph.nodes(data=True) 
-                if not data.get('_deleted', False)]
+        if self._active_nodes_version != self.version:
+            self._active_nodes = [node_id for node_id, data in self.graph.nodes(data=True)
+                                  if not data.get('_deleted', False)]
+            self._active_nodes_version = self.version
+        return list(self._active_nodes)
 
     def cleanup_deleted_nodes(self, days_threshold: int = 30):
         """
@@ -389,6 +579,8 @@ class KnowledgeGraph:
         for node_id in nodes_to_remove:
             self.graph.remove_node(node_id)
             logger.info(f"Permanently removed deleted node '{node_id}' after {days_threshold} days.")
+        if nodes_to_remove:
+            self.version += 1
         
         return len(nodes_to_remove)
     
@@ -399,6 +591,7 @@ class KnowledgeGraph:
             edge_count = self.graph.number_of_edges()
             
             self.graph.clear()
+            self.version += 1
             
             logger.info(f"知识图谱已清空: 删除了 {node_count} 个节点和 {edge_count} 条边")
             
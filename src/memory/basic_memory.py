@@ -1,9 +1,18 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Tuple
 from collections import deque
 from datetime import datetime
-import json
+import os
+import shutil
+import time
 from pathlib import Path
 from loguru import logger
+from src.utils import json_utils
+
+# 增量维护的最近对话上下文包含的轮数
+_RECENT_CONTEXT_TURNS = 3
+
+# 记忆的当前存档文件名（每次保存原子覆盖）
+_CURRENT_MEMORY_FILE = "memory_current.json"
 
 class BasicMemory:
     """基础记忆系统 - MVP版本"""
@@ -17,49 +26,125 @@ class BasicMemory:
         
         # 向后兼容的别名
         self.hot_memory = self.conversation_history
+        
+        # 最近几轮对话的预格式化文本，随 add_conversation 增量更新
+        self._recent_turn_texts = deque(maxlen=_RECENT_CONTEXT_TURNS)
+        self._recent_context = ""
+        self._context_anchor = None  # 生成缓存时的最后一条对话，用于发现外部对历史的修改
     
     def add_conversation(self, user_input: str, ai_response: str):
         """添加对话到热记忆"""
         conversation = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": time.time(),  # 记录为时间戳，保存到文件时才格式化
             "user": user_input,
             "ai": ai_response
         }
         self.conversation_history.append(conversation)
-        logger.info(f"添加对话到记忆，当前记忆条目：{len(self.conversation_history)}")
+        
+        previous = self.conversation_history[-2] if len(self.conversation_history) > 1 else None
+        if previous is not self._context_anchor:
+            self._rebuild_recent_context()
+        else:
+            self._recent_turn_texts.append(self._format_turn(conversation))
+            self._recent_context = "\n".join(self._recent_turn_texts)
+            self._context_anchor = conversation
+        logger.opt(lazy=True).debug("添加对话到记忆，当前记忆条目：{}", lambda: len(self.conversation_history))
+    
+    def get_recent_context(self) -> str:
+        """获取最近几轮对话上下文（增量缓存，通常只是一次属性读取）"""
+        last = self.conversation_history[-1] if self.conversation_history else None
+        if last is not self._context_anchor:
+            # 历史被外部清空或修改过，按当前内容重建
+            self._rebuild_recent_context()
+        return self._recent_context
+    
+    def _rebuild_recent_context(self):
+        """按当前对话历史重建最近上下文缓存"""
+        self._recent_turn_texts.clear()
+        start = max(len(self.conversation_history) - _RECENT_CONTEXT_TURNS, 0)
+        for index in range(start, len(self.conversation_history)):
+            self._recent_turn_texts.append(self._format_turn(self.conversation_history[index]))
+        self._recent_context = "\n".join(self._recent_turn_texts)
+        self._context_anchor = self.conversation_history[-1] if self.conversation_history else None
+    
+    @staticmethod
+    def _format_turn(conversation: Dict[str, Any]) -> str:
+        return f"用户: {conversation['user']}\nAI: {conversation['ai']}"
     
     def get_context(self, recent_turns: int = 3) -> str:
         """获取最近对话上下文"""
-        recent_conversations = list(self.conversation_history)[-recent_turns:]
+        if recent_turns == _RECENT_CONTEXT_TURNS:
+            return self.get_recent_context()
         
-        context_parts = []
-        for conv in recent_conversations:
-            context_parts.append(f"用户: {conv['user']}")
-            context_parts.append(f"AI: {conv['ai']}")
+        history = self.conversation_history
+        if recent_turns > 0:
+            # 只按下标取末尾的几轮，不复制整个历史
+            start = max(len(history) - recent_turns, 0)
+            recent_conversations = (history[index] for index in range(start, len(history)))
+        else:
+            recent_conversations = list(history)[-recent_turns:]
         
-        return "\n".join(context_parts)
+        return "\n".join(map(self._format_turn, recent_conversations))
     
     def update_state(self, key: str, value: Any):
         """更新状态表格"""
         self.state_table[key] = {
             "value": value,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": time.time()
         }
-        logger.info(f"更新状态: {key} = {value}")
+        logger.opt(lazy=True).debug("更新状态: {} = {}", lambda: key, lambda: value)
     
     def get_state(self, key: str) -> Any:
         """获取状态值"""
         return self.state_table.get(key, {}).get("value")
     
-    def save_to_file(self):
-        """保存记忆到文件"""
-        memory_data = {
-            "conversations": list(self.conversation_history),
-            "states": self.state_table
-        }
+    @staticmethod
+    def _with_iso_timestamp(record: Dict[str, Any]) -> Dict[str, Any]:
+        """返回时间戳格式化为ISO字符串的记录副本（文件格式保持不变）"""
+        timestamp = record.get("timestamp")
+        if isinstance(timestamp, (int, float)):
+            record = dict(record)
+            record["timestamp"] = datetime.fromtimestamp(timestamp).isoformat()
+        return record
+    
+    def snapshot_state(self) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        返回当前对话历史和状态表的浅拷贝，供其他线程写盘。
+        对话记录和状态条目在更新时整体替换、不会原地修改，浅拷贝即可。
+        """
+        return list(self.conversation_history), dict(self.state_table)
+    
+    def save_to_file(self, snapshot: bool = False):
+        """
+        保存记忆到当前存档文件（先写临时文件再原子替换）
+        
+        Args:
+            snapshot: 是否额外保留一份带时间戳的快照
+        """
+        self.write_to_file(self.conversation_history, self.state_table, snapshot=snapshot)
+    
+    def write_to_file(self, conversations: Iterable[Dict[str, Any]], states: Dict[str, Any], snapshot: bool = False):
+        """
+        将给定的对话历史和状态表写入当前存档文件（先写临时文件再原子替换）
+        
+        Args:
+            conversations: 对话记录序列
+            states: 状态表
+            snapshot: 是否额外保留一份带时间戳的快照
+        """
+        file_path = self.data_path / _CURRENT_MEMORY_FILE
+        tmp_path = self.data_path / f"{_CURRENT_MEMORY_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            # 对话逐条序列化写出，不复制整个历史
+            json_utils.dump_document(f, (
+                ("conversations", map(self._with_iso_timestamp, conversations)),
+                ("states", {key: self._with_iso_timestamp(entry) for key, entry in states.items()}),
+            ))
+        os.replace(tmp_path, file_path)
         
-        file_path = self.data_path / f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(memory_data, f, ensure_ascii=False, indent=2)
+        if snapshot:
+            snapshot_path = self.data_path / f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            shutil.copyfile(file_path, snapshot_path)
+            logger.info(f"记忆快照已保存到: {snapshot_path}")
         
         logger.info(f"记忆已保存到: {file_path}")
@@ -1,9 +1,59 @@
-from collections import deque
-from typing import List, Dict, Any, Optional
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import List, Dict, Any, FrozenSet, Optional, Tuple
 from loguru import logger
 
 from src.memory.basic_memory import BasicMemory
 from src.graph.knowledge_graph import KnowledgeGraph
+from src.utils import json_utils
+
+# 后台写盘的合并间隔（秒）：这段时间内的多次修改只触发一次保存
+_GRAPH_FLUSH_INTERVAL = 2.0
+
+# 知识图谱上下文文本的缓存条数（按实体集合和检索深度缓存，图谱变化后整体失效）
+_GRAPH_CONTEXT_CACHE_SIZE = 256
+
+# 来自 entities.json 的实体节点类型，重新加载实体时先清掉这些节点
+_ENTITY_NODE_TYPES = frozenset({'character', 'location', 'item', 'event', 'concept'})
+
+# 同步到 entities.json 时单独成字段、不放进 attributes 的节点/关系属性
+_NODE_SYSTEM_KEYS = frozenset({'type', 'description', 'created_time', 'last_modified'})
+_EDGE_SYSTEM_KEYS = frozenset({'relationship', 'description'})
+
+# 从 entities.json 载入时作为节点属性保留的实体字段（值为空时跳过）
+_ENTITY_BASE_KEYS = ('description', 'created_time', 'last_modified')
+
+# 存在待写入图谱的记忆实例，进程退出时统一落盘
+_pending_graph_writers: "weakref.WeakSet[GRAGMemory]" = weakref.WeakSet()
+
+
+def _flush_pending_graphs():
+    for memory in list(_pending_graph_writers):
+        memory.flush_graph()
+
+
+atexit.register(_flush_pending_graphs)
+
+
+def _graph_writer_loop(memory_ref: "weakref.ref[GRAGMemory]", dirty: threading.Event):
+    """后台写盘线程：等待脏标记，合并一段时间内的修改后写盘；记忆实例被回收后退出。"""
+    while True:
+        if not dirty.wait(timeout=_GRAPH_FLUSH_INTERVAL):
+            if memory_ref() is None:
+                return
+            continue
+        time.sleep(_GRAPH_FLUSH_INTERVAL)
+        memory = memory_ref()
+        if memory is None:
+            return
+        memory.flush_graph()
+        del memory
 
 class GRAGMemory:
     """
@@ -30,38 +80,63 @@ class GRAGMemory:
         if self.graph_save_path:
             self.knowledge_graph.load_graph(self.graph_save_path)
 
+        # 知识图谱上下文缓存：(实体集合, 深度) -> 子图文本
+        self._graph_context_cache: "OrderedDict[Tuple[FrozenSet[str], int], str]" = OrderedDict()
+        self._graph_context_key: Optional[Tuple[int, int, int]] = None
+        self._graph_context_lock = threading.Lock()
+
+        # UI实体文件路径，只解析一次
+        self._entities_file = Path(__file__).resolve().parent.parent.parent / "data" / "entities.json"
+        self._entities_file.parent.mkdir(parents=True, exist_ok=True)
+
         # 加载UI中的实体数据到知识图谱
         self._load_entities_from_json()
 
-        # 数据变化追踪
+        # 数据变化追踪：_memory_changed 只记录热、温记忆的变化，图谱变化按版本号判断
         self._data_changed = False
+        self._memory_changed = False
         self._last_conversation_count = 0
 
+        # 图谱异步写盘（write-behind）
+        self._graph_dirty = threading.Event()
+        self._graph_flush_lock = threading.Lock()
+        self._graph_writer: Optional[threading.Thread] = None
+
+        # 热、温记忆异步写盘：调用线程只做快照，单个后台线程写盘，
+        # 写盘期间再次提交的快照合并为一次（只写最新的一份）
+        self._save_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="MemoryWriter")
+        self._save_lock = threading.Lock()
+        self._pending_memory_state: Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]] = None
+        self._memory_save_running = False
+        self._memory_save_future: Optional[concurrent.futures.Future] = None
+
+        # 最近一次写盘/同步时的图谱状态，没有变化时跳过重复写入
+        self._saved_graph_key = self._graph_state_key()
+        self._entities_synced_key: Optional[Tuple] = None
+
         logger.info("GRAGMemory initialized with Hot, Warm, and Cold memory layers.")
 
+    def _graph_state_key(self) -> Tuple[int, int]:
+        """标识当前图谱内容的键：图对象 + 版本号"""
+        return id(self.knowledge_graph.graph), self.knowledge_graph.version
+
     def _load_entities_from_json(self):
         """从UI的entities.json文件加载实体到知识图谱中"""
-        import json
-        import os
-        from pathlib import Path
-        
-        # 实体文件路径
-        entities_file = Path(__file__).parent.parent.parent / "data" / "entities.json"
+        entities_file = self._entities_file
         
         if not entities_file.exists():
             logger.info(f"实体文件 {entities_file} 不存在，跳过加载")
             return
         
         try:
-            with open(entities_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = json_utils.load_file(entities_file)
             
             entities = data.get('entities', [])
             if not entities:
                 logger.info("实体文件中没有实体数据")
                 return
             
-            entities_loaded = 0
+            nodes_to_load = []
             for entity in entities:
                 entity_name = entity.get('name')
                 entity_type = entity.get('type', 'concept')
@@ -70,29 +145,29 @@ class GRAGMemory:
                     logger.warning(f"跳过没有名称的实体: {entity}")
                     continue
                 
-                # 准备属性
+                # 准备属性，每个字段只查找一次
                 attributes = {}
-                if entity.get('description'):
-                    attributes['description'] = entity['description']
-                if entity.get('created_time'):
-                    attributes['created_time'] = entity['created_time']
-                if entity.get('last_modified'):
-                    attributes['last_modified'] = entity['last_modified']
+                for key in _ENTITY_BASE_KEYS:
+                    value = entity.get(key)
+                    if value:
+                        attributes[key] = value
                 
                 # 添加动态属性
-                if entity.get('attributes'):
-                    for key, value in entity['attributes'].items():
-                        attributes[key] = value
+                dynamic_attributes = entity.get('attributes')
+                if dynamic_attributes:
+                    attributes.update(dynamic_attributes)
                 
-                # 将实体添加到知识图谱
-                self.knowledge_graph.add_or_update_node(entity_name, entity_type, **attributes)
-                entities_loaded += 1
+                attributes['type'] = entity_type
+                nodes_to_load.append((entity_name, attributes))
+            
+            # 文件中的实体没有冲突需要解决，一次性加入知识图谱
+            entities_loaded = self.knowledge_graph.bulk_load_nodes(nodes_to_load)
             
             logger.info(f"✅ 成功从 entities.json 加载了 {entities_loaded} 个实体到知识图谱")
             
             # 加载关系
             relationships = data.get('relationships', [])
-            relationships_loaded = 0
+            edges_to_add = []
             
             for rel in relationships:
                 try:
@@ -102,31 +177,28 @@ class GRAGMemory:
                     description = rel.get('description', '')
                     
                     if source and target:
-                        # 检查源节点和目标节点是否存在
-                        if (self.knowledge_graph.graph.has_node(source) and 
-                            self.knowledge_graph.graph.has_node(target)):
-                            
-                            # 添加关系属性
-                            rel_attrs = {'relationship': relationship_type}
-                            if description:
-                                rel_attrs['description'] = description
-                            
-                            # 添加其他属性
-                            if rel.get('attributes'):
-                                rel_attrs.update(rel['attributes'])
-                            
-                            # 添加边到知识图谱
-                            self.knowledge_graph.graph.add_edge(source, target, **rel_attrs)
-                            relationships_loaded += 1
-                            
-                        else:
-                            logger.warning(f"跳过关系 {source} -> {target}：节点不存在")
+                        # 添加关系属性
+                        rel_attrs = {}
+                        if description:
+                            rel_attrs['description'] = description
+                        
+                        # 添加其他属性
+                        if rel.get('attributes'):
+                            rel_attrs.update(rel['attributes'])
+                        
+                        # 端点是否存在由 bulk_add_edges 统一检查
+                        edges_to_add.append(
+                            (source, target, rel_attrs.pop('relationship', relationship_type), rel_attrs)
+                        )
                     else:
                         logger.warning(f"跳过无效关系: {rel}")
                         
                 except Exception as e:
                     logger.warning(f"加载关系失败 {rel}: {e}")
             
+            # 所有关系一次性加入知识图谱
+            relationships_loaded = self.knowledge_graph.bulk_add_edges(edges_to_add) if edges_to_add else 0
+            
             logger.info(f"✅ 成功从 entities.json 加载了 {relationships_loaded} 个关系到知识图谱")
             
         except Exception as e:
@@ -135,76 +207,78 @@ class GRAGMemory:
     
     def sync_entities_to_json(self):
         """将知识图谱中的实体同步到entities.json文件"""
-        import json
-        import time
-        from pathlib import Path
+        entities_file = self._entities_file
         
-        # 实体文件路径
-        entities_file = Path(__file__).parent.parent.parent / "data" / "entities.json"
-        entities_file.parent.mkdir(exist_ok=True, parents=True)
+        graph = self.knowledge_graph.graph
+        try:
+            file_mtime = entities_file.stat().st_mtime_ns
+        except OSError:
+            file_mtime = None
+        # 图谱和文件自上次同步后都没有变化时跳过整次重写
+        sync_key = (*self._graph_state_key(), graph.number_of_nodes(), graph.number_of_edges(), file_mtime)
+        if sync_key == self._entities_synced_key:
+            logger.debug("图谱未变化，跳过同步 entities.json")
+            return
         
         try:
-            entities = []
+            now = time.time()
             
-            # 从知识图谱中获取所有节点
-            for node_id, attrs in self.knowledge_graph.graph.nodes(data=True):
-                entity = {
-                    'name': node_id,
-                    'type': attrs.get('type', 'concept'),
-                    'description': attrs.get('description', ''),
-                    'created_time': attrs.get('created_time', time.time()),
-                    'last_modified': attrs.get('last_modified', time.time()),
-                    'attributes': {}
-                }
-                
-                # 添加动态属性，排除系统属性
-                excluded_keys = {'type', 'description', 'created_time', 'last_modified'}
-                for key, value in attrs.items():
-                    if key not in excluded_keys:
-                        entity['attributes'][key] = value
-                
-                entities.append(entity)
+            def iter_entities():
+                # 从知识图谱中逐个生成实体记录
+                for node_id, attrs in graph.nodes(data=True):
+                    yield {
+                        'name': node_id,
+                        'type': attrs.get('type', 'concept'),
+                        'description': attrs.get('description', ''),
+                        'created_time': attrs.get('created_time', now),
+                        'last_modified': attrs.get('last_modified', now),
+                        # 添加动态属性，排除系统属性
+                        'attributes': {k: v for k, v in attrs.items() if k not in _NODE_SYSTEM_KEYS}
+                    }
             
-            # 获取所有关系
-            relationships = []
-            for source, target, attrs in self.knowledge_graph.graph.edges(data=True):
-                relationship = {
-                    'source': source,
-                    'target': target,
-                    'relationship': attrs.get('relationship', 'related_to'),
-                    'description': attrs.get('description', ''),
-                    'attributes': {k: v for k, v in attrs.items() if k not in ['relationship', 'description']}
-                }
-                relationships.append(relationship)
+            def iter_relationships():
+                # 逐条生成关系记录
+                for source, target, attrs in graph.edges(data=True):
+                    yield {
+                        'source': source,
+                        'target': target,
+                        'relationship': attrs.get('relationship', 'related_to'),
+                        'description': attrs.get('description', ''),
+                        'attributes': {k: v for k, v in attrs.items() if k not in _EDGE_SYSTEM_KEYS}
+                    }
             
-            # 保存到文件
-            data = {
-                'entities': entities,
-                'relationships': relationships,  # 新增：保存关系
-                'last_modified': time.time()
-            }
+            self._write_entities_file(entities_file, iter_entities(), iter_relationships(), now)
+            self._entities_synced_key = sync_key[:-1] + (entities_file.stat().st_mtime_ns,)
             
-            with open(entities_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"✅ 成功同步 {len(entities)} 个实体和 {len(relationships)} 个关系到 entities.json")
+            entity_count, relationship_count = graph.number_of_nodes(), graph.number_of_edges()
+            logger.info(f"✅ 成功同步 {entity_count} 个实体和 {relationship_count} 个关系到 entities.json")
             
         except Exception as e:
             logger.error(f"❌ 同步实体到 entities.json 失败: {e}")
             logger.exception("详细错误信息:")
 
+    @staticmethod
+    def _write_entities_file(entities_file, entities, relationships, now: float):
+        """逐条序列化写入临时文件，落盘后原子替换，避免写入中途失败留下损坏的文件"""
+        tmp_file = entities_file.with_name(entities_file.name + ".tmp")
+        with open(tmp_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            json_utils.dump_document(f, (
+                ('entities', entities),
+                ('relationships', relationships),  # 新增：保存关系
+                ('last_modified', now),
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, entities_file)
+
     def reload_entities_from_json(self):
         """重新加载entities.json文件中的实体"""
         logger.info("🔄 重新加载实体数据...")
         
         # 清空现有节点（只清空实体节点，保留其他节点）
-        nodes_to_remove = []
-        for node_id, attrs in self.knowledge_graph.graph.nodes(data=True):
-            if attrs.get('type') in ['character', 'location', 'item', 'event', 'concept']:
-                nodes_to_remove.append(node_id)
-        
-        for node_id in nodes_to_remove:
-            self.knowledge_graph.graph.remove_node(node_id)
+        nodes_to_remove = [node_id for node_id, node_type in self.knowledge_graph.graph.nodes(data='type')
+                           if node_type in _ENTITY_NODE_TYPES]
+        self.knowledge_graph.bulk_delete_nodes(nodes_to_remove)
         
         # 重新加载
         self._load_entities_from_json()
@@ -217,6 +291,7 @@ class GRAGMemory:
         """向热记忆中添加一轮对话。"""
         self.basic_memory.add_conversation(user_input, ai_response)
         self._data_changed = True  # 标记数据已变化
+        self._memory_changed = True
 
     def get_recent_conversation(self, turns: int = 5) -> str:
         """获取最近几轮的对话历史。"""
@@ -226,6 +301,7 @@ class GRAGMemory:
         """更新温记忆中的状态。"""
         self.basic_memory.update_state(key, value)
         self._data_changed = True  # 标记数据已变化
+        self._memory_changed = True
 
     def get_state(self, key: str) -> Any:
         """从温记忆中获取状态。"""
@@ -243,6 +319,20 @@ class GRAGMemory:
         self.knowledge_graph.add_edge(source, target, relationship, **kwargs)
         self._data_changed = True  # 标记数据已变化
 
+    def bulk_add_or_update_nodes(self, nodes: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """批量添加或更新节点 (节点ID, 类型, 属性)，返回处理的节点数量。"""
+        count = self.knowledge_graph.bulk_add_or_update_nodes(nodes)
+        if count:
+            self._data_changed = True  # 标记数据已变化
+        return count
+
+    def bulk_add_edges(self, edges: List[Tuple[str, str, str, Dict[str, Any]]]) -> int:
+        """批量添加关系 (源, 目标, 关系, 属性)，返回实际添加的边数量。"""
+        count = self.knowledge_graph.bulk_add_edges(edges)
+        if count:
+            self._data_changed = True  # 标记数据已变化
+        return count
+
     def delete_node(self, node_id: str) -> bool:
         """从知识图谱中删除节点及其所有关系。"""
         result = self.knowledge_graph.delete_node(node_id)
@@ -282,9 +372,28 @@ class GRAGMemory:
         """
         if not entity_ids:
             return "No entities provided for knowledge graph retrieval."
-        
+
+        graph = self.knowledge_graph.graph
+        graph_key = (id(graph), self.knowledge_graph.version, graph.number_of_nodes())
+        cache_key = (frozenset(entity_ids), depth)
+        with self._graph_context_lock:
+            if self._graph_context_key != graph_key:
+                self._graph_context_cache.clear()
+                self._graph_context_key = graph_key
+            cached_text = self._graph_context_cache.get(cache_key)
+            if cached_text is not None:
+                self._graph_context_cache.move_to_end(cache_key)
+                return cached_text
+
         subgraph = self.knowledge_graph.get_subgraph_for_context(entity_ids, depth)
-        return self.knowledge_graph.to_text_representation(subgraph)
+        context_text = self.knowledge_graph.to_text_representation(subgraph)
+
+        with self._graph_context_lock:
+            if self._graph_context_key == graph_key:
+                self._graph_context_cache[cache_key] = context_text
+                if len(self._graph_context_cache) > _GRAPH_CONTEXT_CACHE_SIZE:
+                    self._graph_context_cache.popitem(last=False)
+        return context_text
 
     # --- Unified Retrieval ---
 
@@ -306,39 +415,121 @@ class GRAGMemory:
         # 2. 从温记忆获取关键状态 (这里可以根据实体来决定查询哪些状态)
         # 简单起见，我们先假设有一个全局状态需要展示
         world_time = self.get_state("world_time")
-        world_state_context = f"[Current World State]\n- World Time: {world_time if world_time else 'Not set'}\n"
 
         # 3. 从冷记忆获取相关的知识图谱信息
         graph_context = self.get_knowledge_graph_context(entities_in_query, depth=1)
 
-        # 4. 组合所有上下文
-        full_context = (
-            f"## Recent Conversation History\n{conversation_context}\n\n"
-            f"## {world_state_context}\n"
-            f"## Relevant Knowledge Graph\n{graph_context}"
-        )
+        # 4. 组合所有上下文（一次join，不生成中间字符串）
+        full_context = "".join((
+            "## Recent Conversation History\n", conversation_context,
+            "\n\n## [Current World State]\n- World Time: ", str(world_time) if world_time else "Not set",
+            "\n\n## Relevant Knowledge Graph\n", graph_context,
+        ))
 
-        logger.info("Generated combined context for prompt.")
+        logger.debug("Generated combined context for prompt.")
         return full_context
 
-    def save_all_memory(self):
-        """只在有数据变化时保存记忆状态。"""
-        if not self._data_changed:
-            logger.info("没有数据变化，跳过保存")
+    def schedule_graph_save(self):
+        """
+        标记知识图谱需要保存，由后台线程合并后写盘，不阻塞当前请求。
+        进程退出时会自动完成最后一次写盘。
+        """
+        if not self.graph_save_path:
+            return
+        self._graph_dirty.set()
+        _pending_graph_writers.add(self)
+        if self._graph_writer is None or not self._graph_writer.is_alive():
+            self._graph_writer = threading.Thread(
+                target=_graph_writer_loop,
+                args=(weakref.ref(self), self._graph_dirty),
+                name="GraphWriter",
+                daemon=True
+            )
+            self._graph_writer.start()
+
+    def flush_graph(self):
+        """如果有待保存的修改，立即同步写盘。"""
+        with self._graph_flush_lock:
+            if not self._graph_dirty.is_set():
+                return
+            self._graph_dirty.clear()
+            if not self.graph_save_path:
+                return
+            graph_key = self._graph_state_key()
+            if self.knowledge_graph.save_graph(self.graph_save_path):
+                self._saved_graph_key = graph_key
+            else:
+                # 保存失败（例如写盘期间图谱被并发修改），留待下次重试
+                self._graph_dirty.set()
+
+    def _queue_memory_save(self):
+        """提交热、温记忆的快照，由后台线程写盘；已有写盘任务在运行时只替换待写快照。"""
+        state = self.basic_memory.snapshot_state()
+        with self._save_lock:
+            self._pending_memory_state = state
+            if not self._memory_save_running:
+                self._memory_save_running = True
+                self._memory_save_future = self._save_executor.submit(self._write_pending_memory)
+
+    def _write_pending_memory(self):
+        """后台写盘任务：循环写出最新的快照，直到没有新的提交。"""
+        while True:
+            with self._save_lock:
+                state = self._pending_memory_state
+                self._pending_memory_state = None
+                if state is None:
+                    self._memory_save_running = False
+                    return
+            try:
+                self.basic_memory.write_to_file(*state)
+            except Exception as e:
+                logger.error(f"保存热、温记忆失败: {e}")
+                self._memory_changed = True  # 留待下次保存重试
+
+    def _wait_for_memory_save(self):
+        """等待已提交的热、温记忆写盘完成"""
+        future = self._memory_save_future
+        if future is not None:
+            future.result()
+
+    def save_all_memory(self, wait: bool = False):
+        """
+        只在有数据变化时保存记忆状态，且只保存发生变化的那一层。
+        写盘在后台线程中进行，不阻塞当前请求。
+
+        Args:
+            wait (bool): 是否等待写盘完成（例如退出程序前）。
+        """
+        graph_changed = self._graph_state_key() != self._saved_graph_key
+        if not self._data_changed and not graph_changed:
+            logger.debug("没有数据变化，跳过保存")
+            if wait:
+                self._wait_for_memory_save()
             return
         
         # 保存热、温记忆
-        self.basic_memory.save_to_file()
+        if self._memory_changed:
+            self._memory_changed = False
+            self._queue_memory_save()
         
-        # 保存冷记忆 (知识图谱)
-        if self.graph_save_path:
-            self.knowledge_graph.save_graph(self.graph_save_path)
-        else:
-            logger.warning("Knowledge graph save path is not set. Graph will not be saved.")
+        # 保存冷记忆 (知识图谱)，后台线程已写过当前版本时跳过
+        if graph_changed:
+            if not self.graph_save_path:
+                logger.warning("Knowledge graph save path is not set. Graph will not be saved.")
+            elif wait:
+                # 同时清掉待写盘标记
+                self._graph_dirty.set()
+                self.flush_graph()
+            else:
+                self.schedule_graph_save()
         
         # 重置变化标记
         self._data_changed = False
-        logger.info("记忆状态已保存")
+        if wait:
+            self._wait_for_memory_save()
+            logger.info("记忆状态已保存")
+        else:
+            logger.debug("记忆状态已提交后台保存")
     
     def clear_all(self):
         """清空所有记忆层的数据"""
@@ -350,11 +541,13 @@ class GRAGMemory:
             # 清空冷记忆（知识图谱）
             self.knowledge_graph.clear()
             
-            # 同步清空entities.json文件
-            self.sync_entities_to_json()
+            # 同步清空entities.json文件：图谱已清空，直接写入空结构，不再走一遍完整同步
+            self._write_entities_file(self._entities_file, [], [], time.time())
+            self._entities_synced_key = (*self._graph_state_key(), 0, 0, self._entities_file.stat().st_mtime_ns)
             
             # 重置变化标记
             self._data_changed = True
+            self._memory_changed = True
             self._last_conversation_count = 0
             
             logger.info("所有记忆层数据已清空，包括entities.json文件")
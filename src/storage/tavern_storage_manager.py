@@ -2,13 +2,27 @@
 SillyTavern专用存储管理器
 负责按酒馆角色卡分类管理GRAG记忆数据，支持多会话和测试环境
 """
+import errno
 import os
-import json
+import re
 import shutil
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, Iterator, List, Tuple
 from loguru import logger
+from src.utils import json_utils
+
+# 角色名转目录名：去掉特殊字符，空白和连字符合并为下划线
+_RE_NONWORD = re.compile(r'[^\w\s-]')
+_RE_SEP = re.compile(r'[-\s]+')
+
+# 角色映射和活跃会话合并保存在一个文件中；旧版本分别保存的两个文件在启动时迁移一次
+_GLOBAL_STATE_FILE = "global_state.json"
+_LEGACY_MAPPING_FILE = "character_mapping.json"
+_LEGACY_SESSIONS_FILE = "active_sessions.json"
+
 
 class TavernStorageManager:
     """酒馆角色卡分类存储管理器"""
@@ -23,8 +37,21 @@ class TavernStorageManager:
         self._ensure_directory_structure()
         
         # 加载映射和配置
-        self.character_mapping = self._load_character_mapping()
-        self.active_sessions = self._load_active_sessions()
+        self.character_mapping, self.active_sessions, migrated = self._load_global_state()
+        self._legacy_state_pending = migrated
+        
+        # 已被映射占用的本地目录名（计数），重名检查时不必扫描整个映射
+        self._used_dir_names = Counter(self.character_mapping.values())
+        
+        # 全局映射/会话记录的待写盘标记，在一次操作（或一批操作）结束时统一写出
+        self._mapping_dirty = migrated
+        self._sessions_dirty = migrated
+        self._index_dirty = False
+        self._batch_depth = 0
+        
+        # 所有角色 meta.json 的汇总索引（本地目录名 -> 元数据），列出角色时不必逐个读取
+        self.character_index = self._load_character_index()
+        self.flush()
         
         logger.info(f"TavernStorageManager initialized with base path: {self.base_path}")
 
@@ -42,53 +69,124 @@ class TavernStorageManager:
         
         logger.debug("Storage directory structure ensured")
 
-    def _load_character_mapping(self) -> Dict[str, str]:
-        """加载角色ID映射"""
-        mapping_file = self.global_path / "character_mapping.json"
+    def _load_global_state(self) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]], bool]:
+        """
+        加载角色ID映射和活跃会话记录
+        
+        Returns:
+            (角色映射, 活跃会话, 是否从旧版的两个文件迁移而来)
+        """
+        state_file = self.global_path / _GLOBAL_STATE_FILE
         try:
-            if mapping_file.exists():
-                with open(mapping_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            if state_file.exists():
+                state = json_utils.load_file(state_file)
+                return state.get("mapping", {}), state.get("sessions", {}), False
         except Exception as e:
-            logger.warning(f"Failed to load character mapping: {e}")
-        return {}
+            logger.warning(f"Failed to load global state: {e}")
+            return {}, {}, False
+        
+        mapping, sessions = {}, {}
+        migrated = False
+        for file_name, target in ((_LEGACY_MAPPING_FILE, mapping), (_LEGACY_SESSIONS_FILE, sessions)):
+            legacy_file = self.global_path / file_name
+            if not legacy_file.exists():
+                continue
+            try:
+                target.update(json_utils.load_file(legacy_file))
+                migrated = True
+            except Exception as e:
+                logger.warning(f"Failed to load legacy {file_name}: {e}")
+        if migrated:
+            logger.info(f"Migrating character mapping and active sessions to {_GLOBAL_STATE_FILE}")
+        return mapping, sessions, migrated
 
-    def _save_character_mapping(self):
-        """保存角色ID映射"""
-        mapping_file = self.global_path / "character_mapping.json"
+    def _save_global_state(self):
+        """保存角色ID映射和活跃会话记录；首次保存成功后删除旧版的两个文件"""
+        state_file = self.global_path / _GLOBAL_STATE_FILE
         try:
-            with open(mapping_file, 'w', encoding='utf-8') as f:
-                json.dump(self.character_mapping, f, ensure_ascii=False, indent=2)
+            json_utils.dump_file(state_file, {"mapping": self.character_mapping, "sessions": self.active_sessions})
         except Exception as e:
-            logger.error(f"Failed to save character mapping: {e}")
+            logger.error(f"Failed to save global state: {e}")
+            return
+        if self._legacy_state_pending:
+            self._legacy_state_pending = False
+            for file_name in (_LEGACY_MAPPING_FILE, _LEGACY_SESSIONS_FILE):
+                (self.global_path / file_name).unlink(missing_ok=True)
 
-    def _load_active_sessions(self) -> Dict[str, Dict[str, Any]]:
-        """加载活跃会话记录"""
-        sessions_file = self.global_path / "active_sessions.json"
+    def _load_character_index(self) -> Dict[str, Dict[str, Any]]:
+        """加载角色元数据索引；索引文件不存在时从各角色的 meta.json 重建一次"""
+        index_file = self.global_path / "characters_index.json"
         try:
-            if sessions_file.exists():
-                with open(sessions_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            if index_file.exists():
+                return json_utils.load_file(index_file)
         except Exception as e:
-            logger.warning(f"Failed to load active sessions: {e}")
-        return {}
+            logger.warning(f"Failed to load character index, rebuilding: {e}")
+        
+        index = {}
+        for local_dir_name in self._used_dir_names:
+            meta_file = self.tavern_chars_path / local_dir_name / "meta.json"
+            if meta_file.exists():
+                try:
+                    index[local_dir_name] = json_utils.load_file(meta_file)
+                except Exception as e:
+                    logger.warning(f"Failed to load metadata for {local_dir_name}: {e}")
+        self._index_dirty = True
+        return index
 
-    def _save_active_sessions(self):
-        """保存活跃会话记录"""
-        sessions_file = self.global_path / "active_sessions.json"
+    def _save_character_index(self):
+        """保存角色元数据索引"""
+        index_file = self.global_path / "characters_index.json"
         try:
-            with open(sessions_file, 'w', encoding='utf-8') as f:
-                json.dump(self.active_sessions, f, ensure_ascii=False, indent=2)
+            json_utils.dump_file(index_file, self.character_index)
         except Exception as e:
-            logger.error(f"Failed to save active sessions: {e}")
+            logger.error(f"Failed to save character index: {e}")
+
+    def _write_character_metadata(self, local_dir_name: str, metadata: Dict[str, Any]):
+        """写入角色的 meta.json，并同步更新索引"""
+        json_utils.dump_file(self.tavern_chars_path / local_dir_name / "meta.json", metadata)
+        self.character_index[local_dir_name] = metadata
+        self._index_dirty = True
+
+    def flush(self):
+        """将有修改的全局映射、会话记录和角色索引写盘"""
+        if self._mapping_dirty or self._sessions_dirty:
+            self._mapping_dirty = self._sessions_dirty = False
+            self._save_global_state()
+        if self._index_dirty:
+            self._index_dirty = False
+            self._save_character_index()
+
+    @contextmanager
+    def batch_updates(self) -> Iterator["TavernStorageManager"]:
+        """
+        批量操作（例如一次导入多个角色）期间推迟全局记录的写盘，结束时只写一次，
+        避免每注册一个角色都重写一遍完整的映射和会话文件
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
+
+    def _flush_unless_batching(self):
+        """不在批量操作中时立即写盘"""
+        if not self._batch_depth:
+            self.flush()
+
+    def _release_dir_name(self, local_dir_name: Optional[str]):
+        """映射中不再使用某个目录名时减少其占用计数"""
+        if local_dir_name is None:
+            return
+        self._used_dir_names[local_dir_name] -= 1
+        if self._used_dir_names[local_dir_name] <= 0:
+            del self._used_dir_names[local_dir_name]
 
     def _sanitize_character_name(self, character_name: str) -> str:
         """将酒馆角色名转换为安全的目录名"""
-        import re
         # 移除特殊字符，转为小写，用下划线连接
-        sanitized = re.sub(r'[^\w\s-]', '', character_name.lower())
-        sanitized = re.sub(r'[-\s]+', '_', sanitized)
-        return sanitized.strip('_')
+        return _RE_SEP.sub('_', _RE_NONWORD.sub('', character_name.lower())).strip('_')
 
     def register_tavern_character(self, character_data: Dict[str, Any], session_id: str) -> str:
         """
@@ -97,6 +195,7 @@ class TavernStorageManager:
         """
         character_name = character_data.get('name', 'Unknown Character')
         character_id = character_data.get('character_id', character_name)  # 酒馆可能有ID
+        now_iso = datetime.now().isoformat()
         
         # 生成本地目录名
         local_dir_name = self._sanitize_character_name(character_name)
@@ -104,7 +203,7 @@ class TavernStorageManager:
         # 避免重名冲突
         base_dir_name = local_dir_name
         counter = 1
-        while local_dir_name in self.character_mapping.values():
+        while self._used_dir_names[local_dir_name]:
             local_dir_name = f"{base_dir_name}_{counter}"
             counter += 1
         
@@ -116,36 +215,36 @@ class TavernStorageManager:
         
         # 保存角色卡信息副本
         character_file = char_path / "character_data.json"
-        with open(character_file, 'w', encoding='utf-8') as f:
-            json.dump(character_data, f, ensure_ascii=False, indent=2)
+        json_utils.dump_file(character_file, character_data)
         
         # 创建元数据
         metadata = {
             "character_name": character_name,
             "character_id": character_id,
             "local_dir_name": local_dir_name,
-            "created_at": datetime.now().isoformat(),
+            "created_at": now_iso,
             "session_count": 1,
-            "last_active": datetime.now().isoformat()
+            "last_active": now_iso
         }
         
-        meta_file = char_path / "meta.json"
-        with open(meta_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        self._write_character_metadata(local_dir_name, metadata)
         
         # 更新映射
         mapping_key = f"{character_id}_{character_name}" if character_id != character_name else character_name
+        self._release_dir_name(self.character_mapping.get(mapping_key))
         self.character_mapping[mapping_key] = local_dir_name
-        self._save_character_mapping()
+        self._used_dir_names[local_dir_name] += 1
+        self._mapping_dirty = True
         
         # 记录活跃会话
         self.active_sessions[session_id] = {
             "character_mapping_key": mapping_key,
             "local_dir_name": local_dir_name,
             "character_name": character_name,
-            "created_at": datetime.now().isoformat()
+            "created_at": now_iso
         }
-        self._save_active_sessions()
+        self._sessions_dirty = True
+        self._flush_unless_batching()
         
         logger.info(f"Registered tavern character: {character_name} -> {local_dir_name}")
         return local_dir_name
@@ -164,10 +263,10 @@ class TavernStorageManager:
         if is_test:
             return self.ui_test_path / "test_character" / "current"
         
-        if session_id not in self.active_sessions:
+        session_info = self.active_sessions.get(session_id)
+        if session_info is None:
             raise ValueError(f"Session {session_id} not found in active sessions")
         
-        session_info = self.active_sessions[session_id]
         local_dir_name = session_info["local_dir_name"]
         
         return self.tavern_chars_path / local_dir_name / "sessions" / "current"
@@ -192,25 +291,34 @@ class TavernStorageManager:
         Returns:
             新会话ID
         """
-        if character_mapping_key not in self.character_mapping:
+        local_dir_name = self.character_mapping.get(character_mapping_key)
+        if local_dir_name is None:
             raise ValueError(f"Character {character_mapping_key} not found")
         
-        local_dir_name = self.character_mapping[character_mapping_key]
         char_path = self.tavern_chars_path / local_dir_name
         
         # 生成新会话ID和目录
-        session_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        now = datetime.now()
+        now_iso = now.isoformat()
+        session_timestamp = now.strftime("%Y%m%d_%H%M%S")
         new_session_id = f"{local_dir_name}_{session_timestamp}"
         
         # 备份当前会话到历史
         current_session_path = char_path / "sessions" / "current"
         if current_session_path.exists() and any(current_session_path.iterdir()):
             backup_path = char_path / "sessions" / session_timestamp
-            shutil.copytree(current_session_path, backup_path)
+            try:
+                # 同一文件系统内直接重命名目录，不逐个复制文件
+                os.rename(current_session_path, backup_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # 跨设备无法重命名，退回复制后删除
+                shutil.copytree(current_session_path, backup_path)
+                shutil.rmtree(current_session_path)
             logger.info(f"Backed up session to {backup_path}")
             
-            # 清空当前会话目录
-            shutil.rmtree(current_session_path)
+            # 重新创建空的当前会话目录
             current_session_path.mkdir()
         
         # 更新会话记录
@@ -218,12 +326,13 @@ class TavernStorageManager:
             "character_mapping_key": character_mapping_key,
             "local_dir_name": local_dir_name,
             "character_name": self._get_character_name(character_mapping_key),
-            "created_at": datetime.now().isoformat()
+            "created_at": now_iso
         }
-        self._save_active_sessions()
+        self._sessions_dirty = True
         
         # 更新角色元数据
-        self._update_character_metadata(local_dir_name)
+        self._update_character_metadata(local_dir_name, now_iso)
+        self._flush_unless_batching()
         
         logger.info(f"Created new session: {new_session_id}")
         return new_session_id
@@ -247,11 +356,11 @@ class TavernStorageManager:
 
     def clear_character_data(self, character_mapping_key: str):
         """清空指定角色的所有数据"""
-        if character_mapping_key not in self.character_mapping:
+        local_dir_name = self.character_mapping.get(character_mapping_key)
+        if local_dir_name is None:
             logger.warning(f"Character {character_mapping_key} not found for clearing")
             return
         
-        local_dir_name = self.character_mapping[character_mapping_key]
         char_path = self.tavern_chars_path / local_dir_name
         
         try:
@@ -259,78 +368,68 @@ class TavernStorageManager:
                 shutil.rmtree(char_path)
                 logger.info(f"Cleared all data for character: {character_mapping_key}")
             
-            # 从映射中移除
+            # 从映射中移除（目录删除成功后才移除，失败时保留映射）
             del self.character_mapping[character_mapping_key]
-            self._save_character_mapping()
+            self._release_dir_name(local_dir_name)
+            self._mapping_dirty = True
+            if self.character_index.pop(local_dir_name, None) is not None:
+                self._index_dirty = True
             
             # 清理相关的活跃会话
-            sessions_to_remove = [
-                sid for sid, info in self.active_sessions.items() 
-                if info.get("character_mapping_key") == character_mapping_key
-            ]
-            for sid in sessions_to_remove:
-                del self.active_sessions[sid]
-            self._save_active_sessions()
+            self.active_sessions = {
+                sid: info for sid, info in self.active_sessions.items()
+                if info.get("character_mapping_key") != character_mapping_key
+            }
+            self._sessions_dirty = True
             
         except Exception as e:
             logger.error(f"Failed to clear character data: {e}")
+        finally:
+            self._flush_unless_batching()
 
     def list_characters(self) -> List[Dict[str, Any]]:
         """列出所有已注册的角色"""
         characters = []
         for mapping_key, local_dir_name in self.character_mapping.items():
-            char_path = self.tavern_chars_path / local_dir_name
-            meta_file = char_path / "meta.json"
-            
-            if meta_file.exists():
-                try:
-                    with open(meta_file, 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-                        characters.append({
-                            "mapping_key": mapping_key,
-                            "local_dir": local_dir_name,
-                            "character_name": metadata.get("character_name", "Unknown"),
-                            "created_at": metadata.get("created_at"),
-                            "session_count": metadata.get("session_count", 0),
-                            "last_active": metadata.get("last_active")
-                        })
-                except Exception as e:
-                    logger.warning(f"Failed to load metadata for {local_dir_name}: {e}")
+            # 元数据取自内存中的索引，不逐个读取 meta.json
+            metadata = self.character_index.get(local_dir_name)
+            if metadata is not None:
+                characters.append({
+                    "mapping_key": mapping_key,
+                    "local_dir": local_dir_name,
+                    "character_name": metadata.get("character_name", "Unknown"),
+                    "created_at": metadata.get("created_at"),
+                    "session_count": metadata.get("session_count", 0),
+                    "last_active": metadata.get("last_active")
+                })
         
         return characters
 
     def _get_character_name(self, character_mapping_key: str) -> str:
         """获取角色名称"""
-        if character_mapping_key not in self.character_mapping:
+        local_dir_name = self.character_mapping.get(character_mapping_key)
+        if local_dir_name is None:
             return "Unknown"
         
-        local_dir_name = self.character_mapping[character_mapping_key]
-        char_path = self.tavern_chars_path / local_dir_name
-        meta_file = char_path / "meta.json"
-        
-        try:
-            with open(meta_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-                return metadata.get("character_name", "Unknown")
-        except Exception:
+        metadata = self.character_index.get(local_dir_name)
+        if metadata is None:
             return character_mapping_key
+        return metadata.get("character_name", "Unknown")
 
-    def _update_character_metadata(self, local_dir_name: str):
-        """更新角色元数据"""
+    def _update_character_metadata(self, local_dir_name: str, now_iso: Optional[str] = None):
+        """更新角色元数据（now_iso 为调用方已取得的当前时间）"""
         char_path = self.tavern_chars_path / local_dir_name
         meta_file = char_path / "meta.json"
         
         try:
-            metadata = {}
-            if meta_file.exists():
-                with open(meta_file, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
+            metadata = dict(self.character_index.get(local_dir_name, {}))
+            if not metadata and meta_file.exists():
+                metadata = json_utils.load_file(meta_file)
             
             metadata["session_count"] = metadata.get("session_count", 0) + 1
-            metadata["last_active"] = datetime.now().isoformat()
+            metadata["last_active"] = now_iso or datetime.now().isoformat()
             
-            with open(meta_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            self._write_character_metadata(local_dir_name, metadata)
         except Exception as e:
             logger.warning(f"Failed to update metadata for {local_dir_name}: {e}")
 
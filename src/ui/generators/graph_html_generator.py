@@ -2,46 +2,17 @@
 知识图谱HTML模板生成器
 生成D3.js交互式图谱的HTML页面
 """
+import re
 from pathlib import Path
+from typing import List, Optional
 
+# 模板中的数据占位符（模板按字节处理）
+_NODES_PLACEHOLDER = b'{{NODES_DATA}}'
+_LINKS_PLACEHOLDER = b'{{LINKS_DATA}}'
+_PLACEHOLDER_RE = re.compile(b'(' + re.escape(_NODES_PLACEHOLDER) + b'|' + re.escape(_LINKS_PLACEHOLDER) + b')')
 
-class GraphHTMLGenerator:
-    """知识图谱HTML生成器"""
-    
-    def __init__(self):
-        self.template_path = Path(__file__).parent / ".." / "templates" / "graph-template.html"
-    
-    def generate_graph_html(self, nodes_json, links_json, output_path):
-        """生成图谱HTML文件"""
-        try:
-            # 如果模板文件存在，使用模板
-            if self.template_path.exists():
-                return self._generate_from_template(nodes_json, links_json, output_path)
-            else:
-                # 否则使用内置模板
-                return self._generate_builtin_template(nodes_json, links_json, output_path)
-        except Exception as e:
-            # 如果生成失败，创建简化版本
-            self._generate_fallback_html(output_path)
-            raise e
-    
-    def _generate_from_template(self, nodes_json, links_json, output_path):
-        """从模板文件生成HTML"""
-        with open(self.template_path, 'r', encoding='utf-8') as f:
-            template = f.read()
-        
-        # 替换模板中的占位符
-        html_content = template.replace('{{NODES_DATA}}', nodes_json)
-        html_content = html_content.replace('{{LINKS_DATA}}', links_json)
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        return True
-    
-    def _generate_builtin_template(self, nodes_json, links_json, output_path):
-        """生成内置HTML模板"""
-        html_content = f"""<!DOCTYPE html>
+# 内置HTML模板在数据插入点切开的三段，导入时编码一次
+_BUILTIN_PREFIX = """<!DOCTYPE html>
 <html>
 <head>
     <title>ChronoForge Knowledge Graph</title>
@@ -85,21 +56,74 @@ class GraphHTMLGenerator:
     <script src="assets/js/graph.js"></script>
     <script>
         // 设置数据
-        window.graphData = {{
-            nodes: {nodes_json},
-            links: {links_json}
-        }};
+        window.graphData = {
+            nodes: """.encode('utf-8')
+_BUILTIN_MIDDLE = """,
+            links: """.encode('utf-8')
+_BUILTIN_SUFFIX = """
+        };
         
         // 初始化图谱
-        document.addEventListener('DOMContentLoaded', function() {{
+        document.addEventListener('DOMContentLoaded', function() {
             initializeGraphWithData(window.graphData.nodes, window.graphData.links);
-        }});
+        });
     </script>
 </body>
-</html>"""
+</html>""".encode('utf-8')
+
+
+class GraphHTMLGenerator:
+    """知识图谱HTML生成器"""
+    
+    def __init__(self):
+        self.template_path = Path(__file__).parent / ".." / "templates" / "graph-template.html"
+        # 按占位符切分好的模板片段，模板文件修改后重新读取
+        self._template_parts: Optional[List[bytes]] = None
+        self._template_mtime: Optional[int] = None
+    
+    def generate_graph_html(self, nodes_json, links_json, output_path):
+        """生成图谱HTML文件"""
+        try:
+            # 如果模板文件存在，使用模板
+            if self.template_path.exists():
+                return self._generate_from_template(nodes_json, links_json, output_path)
+            else:
+                # 否则使用内置模板
+                return self._generate_builtin_template(nodes_json, links_json, output_path)
+        except Exception as e:
+            # 如果生成失败，创建简化版本
+            self._generate_fallback_html(output_path)
+            raise e
+    
+    def _get_template_parts(self) -> List[bytes]:
+        """
+        读取模板字节并按占位符切分（占位符本身作为单独的片段保留），结果按文件修改时间缓存。
+        模板片段保持UTF-8字节，生成时不再解码和重新编码模板内容。
+        """
+        mtime = self.template_path.stat().st_mtime_ns
+        if self._template_parts is None or mtime != self._template_mtime:
+            self._template_parts = _PLACEHOLDER_RE.split(self.template_path.read_bytes())
+            self._template_mtime = mtime
+        return self._template_parts
+    
+    def _generate_from_template(self, nodes_json, links_json, output_path):
+        """从模板文件生成HTML"""
+        # 只编码数据部分，与模板字节片段一次拼接后写出
+        values = {_NODES_PLACEHOLDER: nodes_json.encode('utf-8'), _LINKS_PLACEHOLDER: links_json.encode('utf-8')}
+        html_bytes = b"".join([values.get(part, part) for part in self._get_template_parts()])
+        Path(output_path).write_bytes(html_bytes)
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        return True
+    
+    def _generate_builtin_template(self, nodes_json, links_json, output_path):
+        """生成内置HTML模板"""
+        html_bytes = b"".join((
+            _BUILTIN_PREFIX, nodes_json.encode('utf-8'),
+            _BUILTIN_MIDDLE, links_json.encode('utf-8'),
+            _BUILTIN_SUFFIX
+        ))
+        
+        Path(output_path).write_bytes(html_bytes)
         
         return True
     
@@ -1,14 +1,36 @@
 """
 对话管理器
 负责对话的创建、删除、重命名和切换
+
+每个对话保存为 {id}.json（元数据和消息快照），之后新增的消息逐条追加到 {id}.jsonl，
+加载时按快照的 last_modified 回放其后的消息；整体保存对话时重写快照并删除追加日志。
+对话头信息（不含消息）另存一份索引，启动时文件未变化的对话只取头信息，消息在首次使用时读取。
 """
+import bisect
+import os
+import sys
 import time
 import uuid
 import json
 from pathlib import Path
-from typing import Dict, List, Optional
-from PySide6.QtCore import QObject, Signal
+from typing import Any, Dict, List, Optional, Set, Tuple
+from PySide6.QtCore import QObject, QTimer, Signal
 from loguru import logger
+from src.utils import json_utils
+
+# 整体保存对话的合并延迟（毫秒），短时间内的多次修改只写一次文件
+_SAVE_DEBOUNCE_MS = 250
+
+# 追加消息日志的打开方式（Windows 下需要二进制模式，避免换行被转换）
+_LOG_OPEN_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+
+def _intern_keys(data: Dict) -> Dict:
+    """
+    驻留字典的键：json 只在单次解析内复用相同的键字符串，
+    驻留后所有对话和消息共用同一份 'id'、'role'、'content' 等键
+    """
+    return {sys.intern(key): value for key, value in data.items()}
 
 
 class ConversationManager(QObject):
@@ -24,34 +46,174 @@ class ConversationManager(QObject):
         self.storage_path.mkdir(exist_ok=True, parents=True)
         self.current_conversation_id: Optional[str] = None
         self.conversations: Dict[str, Dict] = {}
+        # (-修改时间, 对话ID) 的有序列表，修改时间变化时增量调整，发出列表时不再整体排序
+        self._order: List[Tuple[float, str]] = []
+        # 对话文件 -> ((快照修改时间, 追加日志修改时间), 解析结果)，文件未变化时不重新解析
+        self._file_cache: Dict[Path, Tuple[Tuple[int, Optional[int]], Dict]] = {}
+        # 等待整体保存的对话ID，由定时器合并写盘
+        self._dirty_ids: Set[str] = set()
+        self._flush_pending = False
+        # 对话文件名 -> {"stamp": 文件修改时间, "header": 不含消息的对话信息}
+        self._index_file = storage_path / "conversation_index.json"
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+        self._index_dirty = False
+        # 当前对话消息日志的文件描述符，切换对话或日志被合并时关闭
+        self._log_fd: Optional[int] = None
+        self._log_fd_conv_id: Optional[str] = None
         self.load_conversations()
     
     def load_conversations(self):
-        """加载所有对话"""
-        self.conversations.clear()
+        """加载所有对话（只重新解析新增或修改过的文件）"""
+        conversations = {}
+        file_cache = {}
         
         for conv_file in self.storage_path.glob("*.json"):
             try:
-                with open(conv_file, 'r', encoding='utf-8') as f:
-                    conversation = json.load(f)
-                    self.conversations[conversation['id']] = conversation
+                stamp = self._file_stamp(conv_file)
+                cached = self._file_cache.get(conv_file)
+                entry = self._index.get(conv_file.name)
+                if cached is not None and cached[0] == stamp:
+                    conversation = cached[1]
+                elif entry is not None and tuple(entry['stamp']) == stamp:
+                    # 文件与索引一致，只取头信息，消息留待首次使用时读取
+                    conversation = dict(entry['header'])
+                else:
+                    conversation, stamp = self._read_conversation_file(conv_file, stamp)
+                    self._update_index(conv_file, stamp, conversation)
+                conversations[conversation['id']] = conversation
+                file_cache[conv_file] = (stamp, conversation)
             except Exception as e:
                 logger.error(f"加载对话文件 {conv_file} 失败: {e}")
         
-        # 按修改时间排序
-        sorted_conversations = sorted(
-            self.conversations.values(), 
-            key=lambda x: x.get('last_modified', 0), 
-            reverse=True
-        )
+        # 已删除的文件随之从缓存和索引中移除
+        self._file_cache = file_cache
+        stale_names = self._index.keys() - {conv_file.name for conv_file in file_cache}
+        for name in stale_names:
+            del self._index[name]
+        if stale_names or self._index_dirty:
+            self._save_index()
+        self.conversations.clear()
+        self.conversations.update(conversations)
+        self._order = sorted(self._order_key(conv) for conv in conversations.values())
         
-        self.conversation_list_updated.emit(sorted_conversations)
+        sorted_conversations = self._emit_conversation_list()
         
         # 如果没有当前对话，选择最新的（但如果已经有了就不要重复触发）
         if not self.current_conversation_id and sorted_conversations:
             self.current_conversation_id = sorted_conversations[0]['id']
+            self._ensure_messages(sorted_conversations[0])
             self.conversation_changed.emit(self.current_conversation_id)
     
+    def _read_conversation_file(self, conv_file: Path, stamp: Tuple[int, Optional[int]]) -> Tuple[Dict, Tuple[int, Optional[int]]]:
+        """完整读取一个对话（快照 + 追加日志），返回对话及读取后的文件修改时间"""
+        with open(conv_file, 'r', encoding='utf-8') as f:
+            conversation = _intern_keys(json.load(f))
+        conversation['messages'] = [_intern_keys(message) for message in conversation.get('messages', [])]
+        if stamp[1] is not None and not self._replay_message_log(conversation, conv_file.with_suffix('.jsonl')):
+            # 日志有残行，立即重写快照，避免之后追加的消息接在残行后面
+            self._write_conversation(conversation)
+            stamp = self._file_stamp(conv_file)
+        return conversation, stamp
+    
+    def _ensure_messages(self, conversation: Dict):
+        """按需读取只加载了头信息的对话的消息"""
+        if 'messages' in conversation:
+            return
+        conv_file = self.storage_path / f"{conversation['id']}.json"
+        full_conversation, stamp = self._read_conversation_file(conv_file, self._file_stamp(conv_file))
+        # 只补上消息，内存中的头信息可能已有尚未写盘的修改（例如重命名）
+        conversation['messages'] = full_conversation['messages']
+        self._file_cache[conv_file] = (stamp, conversation)
+    
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        """加载对话头信息索引（索引只是缓存，损坏时忽略）"""
+        try:
+            if self._index_file.exists():
+                with open(self._index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                for entry in index.values():
+                    entry['header'] = _intern_keys(entry['header'])
+                return index
+        except Exception as e:
+            logger.warning(f"加载对话索引失败，将重新建立: {e}")
+        return {}
+    
+    def _save_index(self):
+        """保存对话头信息索引"""
+        self._index_dirty = False
+        try:
+            with open(self._index_file, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"保存对话索引失败: {e}")
+    
+    def _update_index(self, conv_file: Path, stamp: Tuple[int, Optional[int]], conversation: Dict):
+        """记录对话文件当前的修改时间和头信息"""
+        self._index[conv_file.name] = {
+            'stamp': stamp,
+            'header': {key: value for key, value in conversation.items() if key != 'messages'}
+        }
+        self._index_dirty = True
+    
+    @staticmethod
+    def _file_stamp(conv_file: Path) -> Tuple[int, Optional[int]]:
+        """对话快照和追加日志的修改时间（没有追加日志时为 None）"""
+        try:
+            log_mtime = conv_file.with_suffix('.jsonl').stat().st_mtime_ns
+        except FileNotFoundError:
+            log_mtime = None
+        return conv_file.stat().st_mtime_ns, log_mtime
+    
+    @staticmethod
+    def _replay_message_log(conversation: Dict, log_file: Path) -> bool:
+        """
+        把快照之后追加的消息合并进对话（快照中已有的消息按时间戳跳过）
+        
+        Returns:
+            日志是否完好（没有无法解析的行）
+        """
+        snapshot_time = conversation.get('last_modified', 0)
+        intact = True
+        with open(log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    message = _intern_keys(json.loads(line))
+                except json.JSONDecodeError:
+                    # 写入中途中断留下的残行
+                    logger.warning(f"跳过对话日志 {log_file} 中无法解析的一行")
+                    intact = False
+                    continue
+                timestamp = message.get('timestamp', 0)
+                if timestamp > snapshot_time:
+                    conversation['messages'].append(message)
+                    conversation['last_modified'] = timestamp
+        return intact
+    
+    @staticmethod
+    def _order_key(conversation: Dict) -> Tuple[float, str]:
+        return -conversation.get('last_modified', 0), conversation['id']
+    
+    def _remove_from_order(self, conversation: Dict):
+        key = self._order_key(conversation)
+        index = bisect.bisect_left(self._order, key)
+        if index < len(self._order) and self._order[index] == key:
+            del self._order[index]
+    
+    def _touch(self, conversation: Dict, timestamp: float):
+        """更新对话的修改时间并调整其在有序列表中的位置"""
+        self._remove_from_order(conversation)
+        conversation['last_modified'] = timestamp
+        bisect.insort(self._order, self._order_key(conversation))
+    
+    def _emit_conversation_list(self) -> List[Dict]:
+        """按修改时间从新到旧发出对话列表更新信号"""
+        sorted_conversations = [self.conversations[conv_id] for _, conv_id in self._order]
+        
+        self.conversation_list_updated.emit(sorted_conversations)
+        return sorted_conversations
+    
     def create_conversation(self, name: str = None) -> str:
         """创建新对话"""
         conv_id = str(uuid.uuid4())
@@ -68,13 +230,14 @@ class ConversationManager(QObject):
         }
         
         self.conversations[conv_id] = conversation
+        bisect.insort(self._order, self._order_key(conversation))
         self._save_conversation(conversation)
         
         # 切换到新对话
         self.current_conversation_id = conv_id
         
-        # 重新加载更新列表，但不要触发自动选择逻辑
-        self.load_conversations()  
+        # 内存中的对话已是最新，直接更新列表，不重新读取文件
+        self._emit_conversation_list()
         
         # 手动发出对话切换信号
         self.conversation_changed.emit(conv_id)
@@ -84,27 +247,35 @@ class ConversationManager(QObject):
     def delete_conversation(self, conv_id: str) -> bool:
         """删除对话"""
         try:
-            if conv_id in self.conversations:
-                # 删除文件
-                conv_file = self.storage_path / f"{conv_id}.json"
-                if conv_file.exists():
-                    conv_file.unlink()
-                
-                del self.conversations[conv_id]
-                
-                # 如果删除的是当前对话，切换到其他对话
-                if self.current_conversation_id == conv_id:
-                    remaining_convs = list(self.conversations.keys())
-                    if remaining_convs:
-                        self.current_conversation_id = remaining_convs[0]
-                        self.conversation_changed.emit(self.current_conversation_id)
-                    else:
-                        self.current_conversation_id = None
-                        self.conversation_changed.emit("")
-                
-                self.load_conversations()
-                return True
-                
+            conversation = self.conversations.pop(conv_id, None)
+            if conversation is None:
+                return False
+            self._remove_from_order(conversation)
+            # 删除文件
+            conv_file = self.storage_path / f"{conv_id}.json"
+            if conv_file.exists():
+                conv_file.unlink()
+            self._close_message_log(conv_id)
+            conv_file.with_suffix('.jsonl').unlink(missing_ok=True)
+            self._file_cache.pop(conv_file, None)
+            if self._index.pop(conv_file.name, None) is not None:
+                self._index_dirty = True
+                self._schedule_flush()
+            self._dirty_ids.discard(conv_id)
+            
+            # 如果删除的是当前对话，切换到其他对话
+            if self.current_conversation_id == conv_id:
+                remaining_conv = next(iter(self.conversations.values()), None)
+                if remaining_conv is not None:
+                    self.current_conversation_id = remaining_conv['id']
+                    self._ensure_messages(remaining_conv)
+                    self.conversation_changed.emit(self.current_conversation_id)
+                else:
+                    self.current_conversation_id = None
+                    self.conversation_changed.emit("")
+            
+            self._emit_conversation_list()
+            return True
         except Exception as e:
             logger.error(f"删除对话 {conv_id} 失败: {e}")
             return False
@@ -112,11 +283,12 @@ class ConversationManager(QObject):
     def rename_conversation(self, conv_id: str, new_name: str) -> bool:
         """重命名对话"""
         try:
-            if conv_id in self.conversations:
-                self.conversations[conv_id]['name'] = new_name
-                self.conversations[conv_id]['last_modified'] = time.time()
-                self._save_conversation(self.conversations[conv_id])
-                self.load_conversations()
+            conv = self.conversations.get(conv_id)
+            if conv is not None:
+                conv['name'] = new_name
+                self._touch(conv, time.time())
+                self._save_conversation(conv)
+                self._emit_conversation_list()
                 return True
         except Exception as e:
             logger.error(f"重命名对话 {conv_id} 失败: {e}")
@@ -124,38 +296,111 @@ class ConversationManager(QObject):
     
     def switch_conversation(self, conv_id: str):
         """切换对话"""
-        if conv_id in self.conversations:
+        conv = self.conversations.get(conv_id)
+        if conv is not None:
+            if conv_id != self.current_conversation_id:
+                self._close_message_log()
             self.current_conversation_id = conv_id
+            self._ensure_messages(conv)
             self.conversation_changed.emit(conv_id)
     
     def get_current_conversation(self) -> Optional[Dict]:
-        """获取当前对话"""
-        if self.current_conversation_id and self.current_conversation_id in self.conversations:
-            return self.conversations[self.current_conversation_id]
+        """获取当前对话（消息尚未读取时在此加载）"""
+        conversation = self.conversations.get(self.current_conversation_id) if self.current_conversation_id else None
+        if conversation is not None:
+            self._ensure_messages(conversation)
+            return conversation
         return None
     
     def add_message(self, message: Dict):
         """添加消息到当前对话"""
         conv = self.get_current_conversation()
         if conv:
-            message['timestamp'] = time.time()
+            message['timestamp'] = timestamp = time.time()
+            self._touch(conv, timestamp)
             conv['messages'].append(message)
-            conv['last_modified'] = time.time()
-            self._save_conversation(conv)
+            self._append_message(conv, message)
     
     def clear_current_conversation(self):
         """清空当前对话的消息"""
         conv = self.get_current_conversation()
         if conv:
             conv['messages'].clear()
-            conv['last_modified'] = time.time()
+            self._touch(conv, time.time())
             self._save_conversation(conv)
     
+    def _append_message(self, conversation: Dict, message: Dict):
+        """把一条新消息追加到对话的消息日志，不重写整个对话文件"""
+        try:
+            conv_file = self.storage_path / f"{conversation['id']}.json"
+            if not conv_file.exists():
+                # 还没有快照（例如文件被外部删除），整体保存一次
+                self._save_conversation(conversation)
+                return
+            # 一次系统调用写入完整的一行
+            os.write(self._get_message_log_fd(conv_file), json_utils.dumps_line(message))
+            stamp = self._file_stamp(conv_file)
+            self._file_cache[conv_file] = (stamp, conversation)
+            # 索引随定时器合并写出，不随每条消息重写
+            self._update_index(conv_file, stamp, conversation)
+            self._schedule_flush()
+        except Exception as e:
+            logger.error(f"保存对话消息失败: {e}")
+    
+    def _get_message_log_fd(self, conv_file: Path) -> int:
+        """返回对话消息日志的文件描述符（按对话缓存）"""
+        conv_id = conv_file.stem
+        if self._log_fd is None or self._log_fd_conv_id != conv_id:
+            self._close_message_log()
+            self._log_fd = os.open(conv_file.with_suffix('.jsonl'), _LOG_OPEN_FLAGS, 0o644)
+            self._log_fd_conv_id = conv_id
+        return self._log_fd
+    
+    def _close_message_log(self, conv_id: Optional[str] = None):
+        """关闭缓存的消息日志描述符（指定对话ID时只在属于该对话时关闭）"""
+        if self._log_fd is None or (conv_id is not None and conv_id != self._log_fd_conv_id):
+            return
+        try:
+            os.close(self._log_fd)
+        except OSError:
+            pass
+        self._log_fd = None
+        self._log_fd_conv_id = None
+    
     def _save_conversation(self, conversation: Dict):
-        """保存单个对话到文件"""
+        """标记对话需要整体保存，稍后与同一时间段内的其他修改合并写盘"""
+        self._dirty_ids.add(conversation['id'])
+        self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """安排一次延迟写盘（已安排时不重复）"""
+        if not self._flush_pending:
+            self._flush_pending = True
+            QTimer.singleShot(_SAVE_DEBOUNCE_MS, self.flush_dirty)
+    
+    def flush_dirty(self):
+        """立即写出所有等待保存的对话和索引（程序退出前也应调用）"""
+        self._flush_pending = False
+        dirty_ids, self._dirty_ids = self._dirty_ids, set()
+        for conv_id in dirty_ids:
+            conversation = self.conversations.get(conv_id)
+            if conversation is not None:
+                self._write_conversation(conversation)
+        if self._index_dirty:
+            self._save_index()
+    
+    def _write_conversation(self, conversation: Dict):
+        """保存单个对话到文件（重写快照并合并掉追加日志）"""
         try:
+            # 只有头信息的对话先读出消息，避免覆盖掉文件中的消息
+            self._ensure_messages(conversation)
             conv_file = self.storage_path / f"{conversation['id']}.json"
             with open(conv_file, 'w', encoding='utf-8') as f:
                 json.dump(conversation, f, ensure_ascii=False, indent=2)
+            self._close_message_log(conversation['id'])
+            conv_file.with_suffix('.jsonl').unlink(missing_ok=True)
+            stamp = self._file_stamp(conv_file)
+            self._file_cache[conv_file] = (stamp, conversation)
+            self._update_index(conv_file, stamp, conversation)
         except Exception as e:
             logger.error(f"保存对话失败: {e}")
\ No newline at end of file
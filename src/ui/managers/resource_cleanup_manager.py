@@ -34,13 +34,11 @@ class ResourceCleanupManager:
     def cleanup_llm_threads(self):
         """清理LLM工作线程"""
         try:
-            if hasattr(self.main_window, 'play_page') and hasattr(self.main_window.play_page, 'llm_worker'):
-                if self.main_window.play_page.llm_worker and self.main_window.play_page.llm_worker.isRunning():
-                    logger.info("🧹 正在清理LLM工作线程...")
-                    self.main_window.play_page.llm_worker.terminate()
-                    self.main_window.play_page.llm_worker.wait(3000)  # 等待最多3秒
-                    self.main_window.play_page.llm_worker.deleteLater()
-                    logger.info("✅ LLM工作线程已清理")
+            if hasattr(self.main_window, 'play_page') and hasattr(self.main_window.play_page, 'llm_service'):
+                logger.info("🧹 正在清理LLM工作线程...")
+                # 先取消正在处理的消息并短暂等待线程退出，超时才强制终止
+                self.main_window.play_page.llm_service.shutdown()
+                logger.info("✅ LLM工作线程已清理")
         except Exception as e:
             logger.warning(f"清理LLM线程时出错: {e}")
     
@@ -65,9 +63,15 @@ class ResourceCleanupManager:
     
     def save_application_data(self):
         """保存应用程序数据"""
+        try:
+            if hasattr(self.main_window, 'play_page') and hasattr(self.main_window.play_page, 'conversation_manager'):
+                self.main_window.play_page.conversation_manager.flush_dirty()
+        except Exception as e:
+            logger.warning(f"保存对话时出错: {e}")
+        
         try:
             if hasattr(self.main_window, 'memory') and self.main_window.memory:
-                self.main_window.memory.save_all_memory()
+                self.main_window.memory.save_all_memory(wait=True)
                 logger.info("知识图谱已保存")
         except Exception as e:
             logger.warning(f"保存数据时出错: {e}")
\ No newline at end of file
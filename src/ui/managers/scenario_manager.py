@@ -28,30 +28,26 @@ class ScenarioManager:
             # 从场景数据创建实体
             logger.info("从场景数据创建《超时空之轮》核心实体...")
             
-            created_count = 0
             entities_data = scenario_data["entities"]
             
-            # 处理所有类型的实体
+            # 处理所有类型的实体，收集后一次性加入知识图谱
+            nodes_to_add = []
             for entity_type, entities_list in entities_data.items():
                 for entity in entities_list:
                     try:
-                        entity_name = entity["name"]
-                        entity_type_val = entity["type"]
-                        entity_desc = entity.get("description", "")
-                        
                         # 其余属性作为动态属性
                         attributes = {k: v for k, v in entity.items() if k not in ["name", "type"]}
-                        
-                        self.memory.add_or_update_node(entity_name, entity_type_val, **attributes)
-                        created_count += 1
+                        nodes_to_add.append((entity["name"], entity["type"], attributes))
                     except Exception as e:
                         logger.warning(f"创建实体失败: {entity}: {e}")
             
+            created_count = self.memory.bulk_add_or_update_nodes(nodes_to_add) if nodes_to_add else 0
+            
             logger.info(f"✅ 从场景文件创建了 {created_count} 个《超时空之轮》实体")
             
             # 创建关系连接
             relationships = scenario_data.get("relationships", [])
-            relationship_count = 0
+            edges_to_add = []
             
             for rel in relationships:
                 try:
@@ -60,15 +56,14 @@ class ScenarioManager:
                     relationship_type = rel["relationship"]
                     rel_description = rel.get("description", "")
                     
-                    # 直接添加关系到知识图谱（所有节点都已存在）
-                    self.memory.add_edge(
-                        from_node, to_node, relationship_type, description=rel_description
-                    )
-                    relationship_count += 1
-                    logger.info(f"✅ 创建关系: {from_node} --{relationship_type}--> {to_node}")
+                    edges_to_add.append((from_node, to_node, relationship_type, {"description": rel_description}))
+                    logger.debug("创建关系: {} --{}--> {}", from_node, relationship_type, to_node)
                 except Exception as e:
                     logger.warning(f"创建关系失败: {rel}: {e}")
             
+            # 所有关系一次性加入知识图谱，端点是否存在由 bulk_add_edges 统一检查
+            relationship_count = self.memory.bulk_add_edges(edges_to_add) if edges_to_add else 0
+            
             logger.info(f"✅ 从场景文件创建了 {relationship_count} 个关系连接")
             
             # 同步保存数据到entities.json文件
@@ -2,15 +2,39 @@
 窗口管理器
 处理主窗口的设置、样式和布局
 """
+import re
 from pathlib import Path
+from typing import Dict, Optional
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import QApplication
 from PySide6.QtGui import QIcon
 from loguru import logger
 
 
+_ASSETS_PATH = Path(__file__).resolve().parents[3] / "assets"
+_ICON_PATH = _ASSETS_PATH / "icons" / "chronoforge.png"
+
+# 压缩样式表：去掉注释、合并空白、去掉花括号和分号两侧的空白，减少 Qt 解析的字符数
+_QSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+_QSS_SPACE_RE = re.compile(r"\s+")
+_QSS_PUNCT_SPACE_RE = re.compile(r"\s*([{};])\s*")
+
+
+def _minify_qss(qss: str) -> str:
+    qss = _QSS_COMMENT_RE.sub("", qss)
+    qss = _QSS_SPACE_RE.sub(" ", qss)
+    return _QSS_PUNCT_SPACE_RE.sub(r"\1", qss).strip()
+
+
 class WindowManager:
     """窗口管理器，处理窗口设置和样式"""
     
+    # 深色主题样式表，首次使用时从 assets/styles 读取：
+    # dark.qss 是首屏即可见的控件，dark_deferred.qss 是对话框、滚动条、单选/复选框等
+    _QSS_CACHE: Dict[str, str] = {}
+    # 已加载的窗口图标（图标路径 -> QIcon），不存在的图标记为 None
+    _ICON_CACHE: Dict[Path, Optional[QIcon]] = {}
+    
     @staticmethod
     def setup_window(main_window):
         """设置窗口属性"""
@@ -18,14 +42,21 @@ class WindowManager:
         main_window.setMinimumSize(1200, 800)
         main_window.resize(1400, 900)
         
-        # 设置应用图标
-        icon_path = Path(__file__).parent.parent.parent / "assets" / "icons" / "chronoforge.png"
-        if icon_path.exists():
-            main_window.setWindowIcon(QIcon(str(icon_path)))
+        # 设置应用图标：在事件循环开始（首帧绘制）后再读取和解码图片
+        QTimer.singleShot(0, lambda: WindowManager._load_icon(main_window, _ICON_PATH))
         
         # 居中显示
         WindowManager.center_window(main_window)
     
+    @classmethod
+    def _load_icon(cls, main_window, icon_path: Path):
+        """加载（或复用已加载的）图标并设置到窗口"""
+        if icon_path not in cls._ICON_CACHE:
+            cls._ICON_CACHE[icon_path] = QIcon(str(icon_path)) if icon_path.exists() else None
+        icon = cls._ICON_CACHE[icon_path]
+        if icon is not None:
+            main_window.setWindowIcon(icon)
+    
     @staticmethod
     def center_window(window):
         """窗口居中显示"""
@@ -34,241 +65,26 @@ class WindowManager:
         frame_geometry.moveCenter(screen)
         window.move(frame_geometry.topLeft())
     
+    @classmethod
+    def _get_dark_qss(cls, include_deferred: bool = False) -> str:
+        """读取、压缩并缓存深色主题样式表，重复应用主题时传给 Qt 的是同一个字符串"""
+        key = "full" if include_deferred else "critical"
+        qss = cls._QSS_CACHE.get(key)
+        if qss is None:
+            styles_path = _ASSETS_PATH / "styles"
+            qss = (styles_path / "dark.qss").read_text(encoding="utf-8")
+            if include_deferred:
+                qss += "\n" + (styles_path / "dark_deferred.qss").read_text(encoding="utf-8")
+            qss = _minify_qss(qss)
+            cls._QSS_CACHE[key] = qss
+        return qss
+    
     @staticmethod
     def apply_dark_theme(app):
-        """应用深色主题"""
-        app.setStyleSheet("""
-            /* 主窗口 - Discord风格深色主题 */
-            QMainWindow {
-                background-color: #2f3136;
-                color: #dcddde;
-            }
-            
-            /* 标签页 */
-            QTabWidget::pane {
-                border: 1px solid #40444b;
-                background-color: #36393f;
-                border-radius: 4px;
-            }
-            QTabBar::tab {
-                background-color: #40444b;
-                color: #dcddde;
-                padding: 10px 20px;
-                margin-right: 2px;
-                border-top-left-radius: 4px;
-                border-top-right-radius: 4px;
-                min-width: 100px;
-            }
-            QTabBar::tab:selected {
-                background-color: #5865f2;
-                color: #ffffff;
-                font-weight: bold;
-            }
-            QTabBar::tab:hover {
-                background-color: #4f545c;
-            }
-            
-            /* 输入控件 */
-            QTextEdit, QLineEdit {
-                background-color: #40444b;
-                color: #dcddde;
-                border: 1px solid #4f545c;
-                border-radius: 4px;
-                padding: 8px;
-                font-size: 14px;
-            }
-            QTextEdit:focus, QLineEdit:focus {
-                border: 2px solid #5865f2;
-            }
-            
-            /* 下拉框 */
-            QComboBox {
-                background-color: #40444b;
-                color: #dcddde;
-                border: 1px solid #4f545c;
-                border-radius: 4px;
-                padding: 6px 10px;
-                min-width: 150px;
-            }
-            QComboBox:hover {
-                border: 1px solid #5865f2;
-            }
-            QComboBox::drop-down {
-                border: none;
-                background-color: #5865f2;
-                width: 20px;
-                border-radius: 2px;
-            }
-            QComboBox::down-arrow {
-                image: none;
-                border-left: 4px solid transparent;
-                border-right: 4px solid transparent;
-                border-top: 4px solid #ffffff;
-            }
-            QComboBox QAbstractItemView {
-                background-color: #40444b;
-                color: #dcddde;
-                selection-background-color: #5865f2;
-                border: 1px solid #4f545c;
-            }
-            
-            /* 按钮 */
-            QPushButton {
-                background-color: #5865f2;
-                color: #ffffff;
-                border: none;
-                padding: 10px 20px;
-                border-radius: 6px;
-                font-weight: bold;
-                font-size: 13px;
-            }
-            QPushButton:hover {
-                background-color: #4752c4;
-            }
-            QPushButton:pressed {
-                background-color: #3c45a5;
-            }
-            QPushButton:disabled {
-                background-color: #4f545c;
-                color: #72767d;
-            }
-            
-            /* 分组框 */
-            QGroupBox {
-                color: #dcddde;
-                border: 1px solid #4f545c;
-                border-radius: 8px;
-                margin-top: 1ex;
-                padding-top: 15px;
-                font-weight: bold;
-                background-color: #36393f;
-            }
-            QGroupBox::title {
-                subcontrol-origin: margin;
-                left: 15px;
-                padding: 0 8px 0 8px;
-                color: #5865f2;
-                font-size: 14px;
-            }
-            
-            /* 标签 */
-            QLabel {
-                color: #dcddde;
-                font-size: 13px;
-            }
-            
-            /* 列表 */
-            QListWidget {
-                background-color: #40444b;
-                color: #dcddde;
-                border: 1px solid #4f545c;
-                border-radius: 4px;
-                padding: 4px;
-            }
-            QListWidget::item {
-                padding: 6px;
-                border-radius: 2px;
-            }
-            QListWidget::item:selected {
-                background-color: #5865f2;
-            }
-            QListWidget::item:hover {
-                background-color: #4f545c;
-            }
-            
-            /* 分割器 */
-            QSplitter::handle {
-                background-color: #4f545c;
-            }
-            QSplitter::handle:horizontal {
-                width: 3px;
-            }
-            QSplitter::handle:vertical {
-                height: 3px;
-            }
-            
-            /* 单选按钮 */
-            QRadioButton {
-                color: #dcddde;
-                spacing: 8px;
-                font-size: 13px;
-            }
-            QRadioButton::indicator {
-                width: 16px;
-                height: 16px;
-                border-radius: 8px;
-                border: 2px solid #4f545c;
-                background-color: #40444b;
-            }
-            QRadioButton::indicator:checked {
-                background-color: #5865f2;
-                border-color: #5865f2;
-            }
-            QRadioButton::indicator:hover {
-                border-color: #5865f2;
-            }
-            QRadioButton::indicator:disabled {
-                background-color: #2f3136;
-                border-color: #72767d;
-            }
-            /* 复选框 */
-            QCheckBox {
-                color: #dcddde;
-                spacing: 8px;
-            }
-            QCheckBox::indicator {
-                width: 16px;
-                height: 16px;
-                border-radius: 2px;
-                border: 2px solid #4f545c;
-                background-color: #40444b;
-            }
-            QCheckBox::indicator:checked {
-                background-color: #5865f2;
-                border-color: #5865f2;
-            }
-            QCheckBox::indicator:checked:hover {
-                background-color: #4752c4;
-            }
-            
-            /* 滚动条 */
-            QScrollBar:vertical {
-                background-color: #2f3136;
-                width: 12px;
-                border-radius: 6px;
-            }
-            QScrollBar::handle:vertical {
-                background-color: #202225;
-                border-radius: 6px;
-                min-height: 20px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #40444b;
-            }
-            
-            /* 消息框和对话框样式 */
-            QMessageBox, QInputDialog, QDialog {
-                background-color: #36393f;
-                color: #dcddde;
-                border: 1px solid #4f545c;
-                border-radius: 8px;
-            }
-            QMessageBox QLabel, QInputDialog QLabel {
-                color: #dcddde;
-                background-color: transparent;
-            }
-            QMessageBox QPushButton, QInputDialog QPushButton, QDialog QPushButton {
-                background-color: #5865f2;
-                color: #ffffff;
-                border: none;
-                padding: 8px 16px;
-                border-radius: 4px;
-                min-width: 80px;
-            }
-            QMessageBox QPushButton:hover, QInputDialog QPushButton:hover, QDialog QPushButton:hover {
-                background-color: #4752c4;
-            }
-            QMessageBox QPushButton:pressed, QInputDialog QPushButton:pressed, QDialog QPushButton:pressed {
-                background-color: #3c45a5;
-            }
-        """)
\ No newline at end of file
+        """
+        应用深色主题
+        先只应用首屏控件的样式，其余样式在事件循环开始（主窗口显示）后补上，
+        减少创建主窗口时 Qt 需要匹配的选择器
+        """
+        app.setStyleSheet(WindowManager._get_dark_qss())
+        QTimer.singleShot(0, lambda: app.setStyleSheet(WindowManager._get_dark_qss(include_deferred=True)))
@@ -1,292 +1,499 @@
 """
 聊天界面相关组件
 包含聊天气泡、聊天显示区域、加载动画等
+
+气泡的样式统一写在聊天显示区域的样式表中，按气泡的动态属性匹配
+（role: user/ai/loading，delete_mode: 删除模式），Qt 只解析一次样式表，
+创建气泡时只需设置属性。
+聊天记录较长时只为最近的若干条消息创建气泡，更早的消息在滚动到顶部时分批创建。
 """
-import time
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict, deque
+from itertools import chain
+from typing import Deque, Dict, Any, List, Optional
 from PySide6.QtWidgets import (
-    QFrame, QVBoxLayout, QHBoxLayout, QLabel, QScrollArea, 
-    QWidget, QSizePolicy, QGraphicsOpacityEffect
+    QFrame, QVBoxLayout, QHBoxLayout, QLabel, QScrollArea, QWidget, QMessageBox
 )
-from PySide6.QtCore import Qt, Signal, QPropertyAnimation, QRect, QTimer
-from PySide6.QtGui import QFont, QColor, QTextCursor, QPainter, QPen, QBrush
+from PySide6.QtCore import Qt, Signal, QTimer
 from loguru import logger
 
 
+# 最多创建控件的消息数：更早的消息只保留数据，滚动到顶部时再分批创建气泡
+_MATERIALIZED_LIMIT = 50
+_MATERIALIZE_BATCH = 20
+
+# 淘汰旧消息时每累计这么多条才记录一次日志
+_EVICTION_LOG_INTERVAL = 100
+
+# 聊天显示区域（含所有气泡）的样式表 - 现代深色聊天背景（类似Discord/Slack）
+_CHAT_DISPLAY_QSS = """
+    QScrollArea {
+        border: none;
+        border-radius: 0px;
+        background-color: #2f3136;
+    }
+    QWidget {
+        background-color: #2f3136;
+    }
+    QScrollBar:vertical {
+        width: 8px;
+        border-radius: 4px;
+        background-color: #2f3136;
+        border: none;
+    }
+    QScrollBar::handle:vertical {
+        border-radius: 4px;
+        background-color: #202225;
+        min-height: 20px;
+    }
+    QScrollBar::handle:vertical:hover {
+        background-color: #40444b;
+    }
+    QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {
+        border: none;
+        background: none;
+        height: 0px;
+    }
+
+    /* 用户消息 - 简洁的蓝色 */
+    QFrame[role="user"] QLabel {
+        background-color: #5865f2;
+        color: #ffffff;
+        border-radius: 18px;
+        padding: 12px 16px;
+        font-size: 14px;
+        max-width: 400px;
+        min-height: 20px;
+        border: none;
+        font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
+        font-weight: 500;
+    }
+
+    /* AI消息 - Discord风格深色 */
+    QFrame[role="ai"] QLabel {
+        background-color: #36393f;
+        color: #dcddde;
+        border: 1px solid #40444b;
+        border-radius: 8px;
+        padding: 12px 16px;
+        font-size: 14px;
+        max-width: 450px;
+        min-height: 20px;
+        font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
+    }
+
+    /* 加载动画 */
+    QFrame[role="loading"] QLabel {
+        background-color: #36393f;
+        color: #72767d;
+        border: 1px solid #40444b;
+        border-radius: 8px;
+        padding: 12px 16px;
+        font-size: 14px;
+        min-width: 120px;
+        font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
+        font-style: italic;
+    }
+
+    /* 删除模式的视觉提示 */
+    QFrame[role][delete_mode="true"]:hover {
+        border: 2px solid #e74c3c;
+        background-color: rgba(231, 76, 60, 0.1);
+    }
+"""
+
+
 class ChatBubble(QFrame):
     """聊天气泡组件"""
-    
-    message_clicked = Signal(str)  # 消息被点击时发出信号
-    
+
+    message_clicked = Signal(object)  # 删除模式下点击消息时发出信号（参数为气泡本身）
+
     def __init__(self, message: str, is_user: bool, color: str = None):
         super().__init__()
         self.message = message
         self.is_user = is_user
-        self.color = color
-        self.delete_mode = False
+        self.color = color  # 自定义背景色，为空时使用样式表中的配色
+        self.delete_mode_enabled = False  # 是否处于删除模式
+        self.setProperty("role", "user" if is_user else "ai")
+        self.setProperty("delete_mode", False)
         self.setup_ui()
-        
-    def setup_ui(self):
-        """设置界面"""
-        self.setFrameStyle(QFrame.Box)
-        self.setLineWidth(1)
-        
-        # 设置气泡样式
-        if self.is_user:
-            # 用户消息 - 蓝色，右对齐
-            bg_color = self.color or "#5865f2"
-            text_color = "white"
-            alignment = "margin-left: 50px; margin-right: 10px;"
-        else:
-            # AI消息 - 深灰色，左对齐
-            bg_color = self.color or "#4f545c"
-            text_color = "#dcddde"
-            alignment = "margin-left: 10px; margin-right: 50px;"
-        
-        self.setStyleSheet(f"""
-            QFrame {{
-                background-color: {bg_color};
-                color: {text_color};
-                border: none;
-                border-radius: 15px;
-                padding: 10px 15px;
-                margin: 5px;
-                {alignment}
-            }}
-        """)
-        
-        # 创建布局和标签
-        layout = QVBoxLayout(self)
-        layout.setContentsMargins(0, 0, 0, 0)
-        
-        self.message_label = QLabel(self.message)
-        self.message_label.setWordWrap(True)
-        self.message_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        self.message_label.setFont(QFont("Arial", 10))
-        layout.addWidget(self.message_label)
-        
-        # 设置大小策略
-        self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Minimum)
-    
+
+    def set_delete_mode(self, enabled: bool):
+        """设置删除模式（只切换属性并重新套用样式，不重新解析样式表）"""
+        if enabled == self.delete_mode_enabled:
+            return
+        self.delete_mode_enabled = enabled
+        self.setCursor(Qt.PointingHandCursor if enabled else Qt.ArrowCursor)
+        self.setProperty("delete_mode", enabled)
+        self.style().unpolish(self)
+        self.style().polish(self)
+
     def mousePressEvent(self, event):
         """鼠标点击事件"""
-        if self.delete_mode and event.button() == Qt.LeftButton:
-            self.message_clicked.emit(self.message)
+        if self.delete_mode_enabled and event.button() == Qt.LeftButton:
+            self.message_clicked.emit(self)
         super().mousePressEvent(event)
-    
-    def set_delete_mode(self, enabled: bool):
-        """设置删除模式"""
-        self.delete_mode = enabled
-        if enabled:
-            self.setCursor(Qt.PointingHandCursor)
-            # 添加删除模式的视觉反馈
-            self.setStyleSheet(self.styleSheet() + """
-                QFrame:hover {
-                    border: 2px solid red;
-                }
-            """)
+
+    def setup_ui(self):
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(20, 8, 20, 8)
+
+        # 创建消息标签
+        self.message_label = QLabel(self.message)
+        self.message_label.setWordWrap(True)
+        if self.color:
+            self.message_label.setStyleSheet(f"QLabel {{ background-color: {self.color}; }}")
+        self.message_label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+
+        if self.is_user:
+            # 用户消息右对齐
+            layout.addStretch()
+            layout.addWidget(self.message_label)
         else:
-            self.setCursor(Qt.ArrowCursor)
-            # 移除悬停效果，重新设置原样式
-            self.setup_ui()
+            # AI消息左对齐
+            layout.addWidget(self.message_label)
+            layout.addStretch()
+
+    def set_message(self, message: str):
+        """更新气泡中的文字（流式输出时逐段刷新）"""
+        self.message = message
+        self.message_label.setText(message)
 
 
 class LoadingBubble(QFrame):
     """加载动画气泡"""
-    
+
+    # 各帧文字预先生成，动画刷新时不再拼接字符串
+    _FRAMES = tuple(f"助手正在思考{'.' * dots}" for dots in range(1, 7))
+
     def __init__(self):
         super().__init__()
-        self.timer = QTimer()
-        self.dots = 0
+        self.frame_index = 0
+        self.setProperty("role", "loading")
         self.setup_ui()
-        
-    def setup_ui(self):
-        """设置界面"""
-        self.setFrameStyle(QFrame.Box)
-        self.setLineWidth(1)
-        self.setStyleSheet("""
-            QFrame {
-                background-color: #4f545c;
-                color: #dcddde;
-                border: none;
-                border-radius: 15px;
-                padding: 10px 15px;
-                margin: 5px;
-                margin-left: 10px;
-                margin-right: 50px;
-            }
-        """)
-        
-        layout = QVBoxLayout(self)
-        layout.setContentsMargins(0, 0, 0, 0)
-        
-        self.loading_label = QLabel("正在思考")
-        self.loading_label.setFont(QFont("Arial", 10))
-        layout.addWidget(self.loading_label)
-        
-        # 连接定时器
+
+        # 设置定时器来更新动画（由 start_animation 启动）
+        self.timer = QTimer()
         self.timer.timeout.connect(self.update_animation)
-        self.timer.start(500)  # 每500ms更新一次
-        
-        self.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Minimum)
-    
+
+    def setup_ui(self):
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(20, 8, 20, 8)
+
+        self.message_label = QLabel("助手正在思考...")
+
+        layout.addWidget(self.message_label)
+        layout.addStretch()
+
     def update_animation(self):
-        """更新动画"""
-        self.dots = (self.dots + 1) % 4
-        text = "正在思考" + "." * self.dots
-        self.loading_label.setText(text)
-    
+        self.message_label.setText(self._FRAMES[self.frame_index])
+        self.frame_index = (self.frame_index + 1) % len(self._FRAMES)
+
+    def start_animation(self):
+        """从第一帧重新开始动画"""
+        self.frame_index = 0
+        self.message_label.setText("助手正在思考...")
+        self.timer.start(500)  # 每500ms更新一次
+
     def stop_animation(self):
-        """停止动画"""
-        if self.timer.isActive():
-            self.timer.stop()
+        self.timer.stop()
 
 
 class ChatDisplayWidget(QScrollArea):
-    """聊天显示区域组件"""
-    
+    """聊天显示组件"""
+
     def __init__(self):
         super().__init__()
-        self.message_widgets: List[Dict[str, Any]] = []
+        self.messages_layout = QVBoxLayout()
+        # 各轮对话共用的加载动画气泡，首次使用时创建，不显示时移出布局
         self.loading_bubble: Optional[LoadingBubble] = None
+        self._loading_visible = False
+        # id(气泡) -> 消息信息，按添加顺序排列；点击、淘汰最旧消息都是 O(1)
+        self.message_widgets: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # 比 message_widgets 更早、尚未创建气泡的消息（从旧到新）
+        self._pending_messages: Deque[Dict[str, Any]] = deque()
+        # 在顶部补上更早的消息后，需要保持的与底部的距离
+        self._scroll_anchor: Optional[int] = None
+        self._delete_mode = False
+        self._evicted_count = 0
+        # 正在流式输出的AI消息
+        self._streaming_info: Optional[Dict[str, Any]] = None
+        # 批量添加期间暂存的消息（None 表示不在批量添加中）
+        self._batch_messages: Optional[List[Dict[str, Any]]] = None
         self.setup_ui()
-    
+
     def setup_ui(self):
-        """设置界面"""
-        # 创建滚动内容区域
-        scroll_content = QWidget()
-        scroll_content.setObjectName("scroll_content")
-        
-        self.messages_layout = QVBoxLayout(scroll_content)
-        self.messages_layout.setSpacing(5)
-        self.messages_layout.setContentsMargins(10, 10, 10, 10)
-        self.messages_layout.addStretch()  # 添加弹性空间，使消息从上往下排列
-        
-        # 设置滚动区域
-        self.setWidget(scroll_content)
         self.setWidgetResizable(True)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        
-        # 设置样式
-        self.setStyleSheet("""
-            QScrollArea {
-                border: none;
-                border-radius: 0px;
-                background-color: #2f3136;
-            }
-            QWidget {
-                background-color: #2f3136;
-            }
-            QScrollBar:vertical {
-                background-color: #2f3136;
-                width: 12px;
-                border-radius: 6px;
-                margin: 0px;
-            }
-            QScrollBar::handle:vertical {
-                background-color: #5865f2;
-                border-radius: 6px;
-                min-height: 20px;
-            }
-            QScrollBar::handle:vertical:hover {
-                background-color: #4752c4;
-            }
-            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {
-                height: 0px;
-            }
-        """)
-    
+        self.setMinimumHeight(400)
+
+        # 创建容器widget
+        container = QWidget()
+        container_layout = QVBoxLayout(container)
+        container_layout.setSpacing(5)
+        container_layout.setContentsMargins(0, 10, 0, 10)
+        # 用对齐方式把消息推到顶部，不再在末尾放伸缩项，布局时无需为它分配剩余空间
+        container_layout.setAlignment(Qt.AlignTop)
+
+        # 添加消息布局
+        container_layout.addLayout(self.messages_layout)
+
+        self.setWidget(container)
+
+        # 滚动区域、容器和所有气泡共用这一份样式表
+        self.setStyleSheet(_CHAT_DISPLAY_QSS)
+
+        # 滚动到底部的定时器：连续添加多条消息时只滚动一次
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.setInterval(50)  # 延迟滚动以确保布局完成
+        self._scroll_timer.timeout.connect(self._do_scroll_bottom)
+
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.valueChanged.connect(self._on_scroll_value_changed)
+        scroll_bar.rangeChanged.connect(self._on_scroll_range_changed)
+
     def add_message(self, message: str, is_user: bool, color: str = None):
-        """添加消息"""
         # 限制消息历史大小，防止内存泄漏
         MAX_MESSAGES = 1000  # 最多保留1000条消息
-        
+
         # 如果超过限制，删除最旧的消息
-        if len(self.message_widgets) >= MAX_MESSAGES:
-            old_msg_info = self.message_widgets.pop(0)
-            old_widget = old_msg_info['widget']
-            self.messages_layout.removeWidget(old_widget)
-            old_widget.deleteLater()
-            logger.info(f"🧹 [UI] 删除旧消息以防止内存泄漏，当前消息数: {len(self.message_widgets)}")
-        
-        bubble = ChatBubble(message, is_user, color)
-        bubble.message_clicked.connect(self.on_message_clicked)  # 连接点击信号
-        self.messages_layout.addWidget(bubble)
-        self.message_widgets.append({
-            'widget': bubble,
+        batch_size = len(self._batch_messages) if self._batch_messages is not None else 0
+        if len(self.message_widgets) + len(self._pending_messages) + batch_size >= MAX_MESSAGES:
+            if self._pending_messages:
+                self._pending_messages.popleft()
+            elif self.message_widgets:
+                _, old_msg_info = self.message_widgets.popitem(last=False)
+                old_widget = old_msg_info['widget']
+                self.messages_layout.removeWidget(old_widget)
+                old_widget.deleteLater()
+            else:
+                self._batch_messages.pop(0)
+            self._evicted_count += 1
+            if self._evicted_count % _EVICTION_LOG_INTERVAL == 0:
+                logger.debug("🧹 [UI] 已累计删除 {} 条旧消息以防止内存泄漏，当前消息数: {}",
+                             self._evicted_count,
+                             len(self.message_widgets) + len(self._pending_messages)
+                             + len(self._batch_messages or ()))
+
+        msg_info = {
             'message': message,
             'is_user': is_user,
             'color': color
-        })
+        }
+        if self._batch_messages is not None:
+            # 批量添加时先暂存，end_batch 时统一创建气泡
+            self._batch_messages.append(msg_info)
+            return
+        self.messages_layout.addWidget(self._create_bubble(msg_info))
+        self._trim_materialized()
+        self.scroll_to_bottom()
+
+    def begin_batch(self):
+        """
+        开始批量添加消息（例如加载对话历史）：暂停容器重绘，add_message 只记录数据，
+        直到 end_batch 时一次性布局并滚动到底部
+        """
+        if self._batch_messages is not None:
+            return
+        self._batch_messages = []
+        self.widget().setUpdatesEnabled(False)
+
+    def end_batch(self):
+        """结束批量添加：只为最近的若干条消息创建气泡，更早的消息作为数据等待滚动时再创建"""
+        if self._batch_messages is None:
+            return
+        batch, self._batch_messages = self._batch_messages, None
+        keep = min(len(batch), _MATERIALIZED_LIMIT)
+        self._dematerialize_oldest(len(self.message_widgets) + keep - _MATERIALIZED_LIMIT)
+        self._pending_messages.extend(batch[:len(batch) - keep])
+        for msg_info in batch[len(batch) - keep:]:
+            self.messages_layout.addWidget(self._create_bubble(msg_info))
+
+        container = self.widget()
+        container.setUpdatesEnabled(True)
+        container.updateGeometry()
+        self.scroll_to_bottom()
+
+    def append_stream_chunk(self, chunk: str):
+        """把流式输出的一段回复追加到正在输出的AI消息（收到第一段时移除加载动画并创建气泡）"""
+        if self._streaming_info is None:
+            self.remove_loading_animation()
+            self.add_message("", False)
+            self._streaming_info = next(reversed(self.message_widgets.values()))
+        msg_info = self._streaming_info
+        msg_info['message'] += chunk
+        if 'widget' in msg_info:
+            msg_info['widget'].set_message(msg_info['message'])
         self.scroll_to_bottom()
-    
-    def on_message_clicked(self, message: str):
-        """处理消息点击事件"""
-        # 删除被点击的消息
-        for i, msg_info in enumerate(self.message_widgets):
-            if msg_info['message'] == message:
-                widget = msg_info['widget']
-                self.messages_layout.removeWidget(widget)
-                widget.deleteLater()
-                self.message_widgets.pop(i)
-                logger.info("🗑️ [UI] 删除消息")
-                break
-    
+
+    def finish_stream_message(self, message: Optional[str] = None) -> bool:
+        """
+        结束流式输出，以完整回复为准更新消息（message 为空时保留已收到的内容，例如输出被取消）
+
+        Returns:
+            是否有正在流式输出的消息（没有时调用方应按普通消息添加）
+        """
+        msg_info, self._streaming_info = self._streaming_info, None
+        if msg_info is None:
+            return False
+        if message is None:
+            return True
+        msg_info['message'] = message
+        if 'widget' in msg_info:
+            msg_info['widget'].set_message(message)
+        return True
+
+    def _create_bubble(self, msg_info: Dict[str, Any]) -> ChatBubble:
+        """为消息创建气泡并登记到 message_widgets（调用方负责放入布局）"""
+        bubble = ChatBubble(msg_info['message'], msg_info['is_user'], msg_info['color'])
+        bubble.message_clicked.connect(self.on_message_clicked)  # 连接点击信号
+        if self._delete_mode:
+            bubble.set_delete_mode(True)
+        msg_info['widget'] = bubble
+        self.message_widgets[id(bubble)] = msg_info
+        return bubble
+
+    def _trim_materialized(self):
+        """
+        停留在底部时只保留最近的若干个气泡，更早的消息转为数据。
+        用户向上翻看时不裁剪，避免内容在视野中跳动。
+        """
+        if len(self.message_widgets) <= _MATERIALIZED_LIMIT:
+            return
+        scroll_bar = self.verticalScrollBar()
+        if scroll_bar.value() < scroll_bar.maximum():
+            return
+        self._dematerialize_oldest(len(self.message_widgets) - _MATERIALIZED_LIMIT)
+
+    def _dematerialize_oldest(self, count: int):
+        """销毁最旧的 count 个气泡，对应消息转为数据追加到 _pending_messages 末尾"""
+        for _ in range(min(count, len(self.message_widgets))):
+            _, msg_info = self.message_widgets.popitem(last=False)
+            widget = msg_info.pop('widget')
+            self.messages_layout.removeWidget(widget)
+            widget.deleteLater()
+            self._pending_messages.append(msg_info)
+
+    def _materialize_older(self):
+        """在顶部补上一批更早的消息气泡"""
+        scroll_bar = self.verticalScrollBar()
+        self._scroll_anchor = scroll_bar.maximum() - scroll_bar.value()
+        for _ in range(min(_MATERIALIZE_BATCH, len(self._pending_messages))):
+            # 从较新的一条开始，逐条插到最前面
+            bubble = self._create_bubble(self._pending_messages.pop())
+            self.message_widgets.move_to_end(id(bubble), last=False)
+            self.messages_layout.insertWidget(0, bubble)
+
+    def _on_scroll_value_changed(self, value: int):
+        if self._pending_messages and value == self.verticalScrollBar().minimum():
+            self._materialize_older()
+
+    def _on_scroll_range_changed(self, minimum: int, maximum: int):
+        if self._scroll_anchor is not None:
+            # 补上更早的消息后保持当前看到的内容不动
+            anchor, self._scroll_anchor = self._scroll_anchor, None
+            self.verticalScrollBar().setValue(maximum - anchor)
+        elif self._pending_messages and minimum == maximum:
+            # 已有的气泡不足以出现滚动条时，无法通过滚动到顶部加载更早的消息
+            self._materialize_older()
+
     def set_delete_mode(self, enabled: bool):
         """设置所有气泡的删除模式"""
-        for msg_info in self.message_widgets:
+        self._delete_mode = enabled
+        for msg_info in self.message_widgets.values():
             msg_info['widget'].set_delete_mode(enabled)
-    
-    def show_loading_animation(self) -> LoadingBubble:
-        """显示加载动画"""
+
+    def on_message_clicked(self, bubble):
+        """处理消息气泡点击事件"""
+        # 找到对应的消息信息
+        msg_info = self.message_widgets.get(id(bubble))
+        if msg_info is None:
+            return
+
+        # 询问确认删除
+        reply = QMessageBox.question(
+            self,
+            "确认删除",
+            f"确定要删除这条{'用户' if msg_info['is_user'] else 'AI'}消息吗？",
+            QMessageBox.Yes | QMessageBox.No
+        )
+
+        if reply == QMessageBox.Yes:
+            # 从布局中移除
+            self.messages_layout.removeWidget(bubble)
+            bubble.deleteLater()
+
+            # 从记录中移除
+            self.message_widgets.pop(id(bubble), None)
+
+            # 发出删除信号通知父组件更新对话历史
+            # TODO: 实现对话历史同步
+
+    def show_loading_animation(self):
         if self.loading_bubble is None:
             self.loading_bubble = LoadingBubble()
-            self.messages_layout.addWidget(self.loading_bubble)
-            self.scroll_to_bottom()
+        elif self._loading_visible:
+            self.messages_layout.removeWidget(self.loading_bubble)
+
+        # 放到最后一条消息之后
+        self.messages_layout.addWidget(self.loading_bubble)
+        self.loading_bubble.start_animation()
+        self.loading_bubble.show()
+        self._loading_visible = True
+        self.scroll_to_bottom()
         return self.loading_bubble
-    
+
     def remove_loading_animation(self):
-        """移除加载动画"""
-        if self.loading_bubble is not None:
+        if self._loading_visible:
             self.loading_bubble.stop_animation()
+            self.loading_bubble.hide()
             self.messages_layout.removeWidget(self.loading_bubble)
-            self.loading_bubble.deleteLater()
-            self.loading_bubble = None
-    
+            self._loading_visible = False
+
+    def scroll_to_bottom(self):
+        # 已有待执行的滚动时不再重复安排
+        if not self._scroll_timer.isActive():
+            self._scroll_timer.start()
+
+    def _do_scroll_bottom(self):
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+
     def clear_messages(self):
-        """清空所有消息"""
-        for msg_info in self.message_widgets:
-            widget = msg_info['widget']
-            self.messages_layout.removeWidget(widget)
-            widget.deleteLater()
-        
-        self.message_widgets.clear()
+        # 清空所有消息（先移出共用的加载动画气泡，避免被一起删除）
         self.remove_loading_animation()
-        logger.info("🗑️ [UI] 清空聊天记录")
-    
-    def scroll_to_bottom(self):
-        """滚动到底部"""
-        QTimer.singleShot(10, lambda: self.verticalScrollBar().setValue(
-            self.verticalScrollBar().maximum()
-        ))
-    
-    def get_last_user_message(self) -> str:
+        while self.messages_layout.count():
+            child = self.messages_layout.takeAt(0)
+            if child.widget():
+                child.widget().deleteLater()
+        self.message_widgets.clear()
+        self._pending_messages.clear()
+        self._scroll_anchor = None
+        self._streaming_info = None
+        if self._batch_messages is not None:
+            self._batch_messages = []
+
+    def remove_last_ai_message(self):
+        """删除最后一条AI回复"""
+        # 从后往前找最后一条AI消息
+        for widget_id, msg_info in reversed(self.message_widgets.items()):
+            if not msg_info['is_user']:
+                # 找到最后一条AI消息，删除它
+                widget_to_remove = msg_info['widget']
+                self.messages_layout.removeWidget(widget_to_remove)
+                widget_to_remove.deleteLater()
+                del self.message_widgets[widget_id]
+                return True
+        for i in range(len(self._pending_messages) - 1, -1, -1):
+            if not self._pending_messages[i]['is_user']:
+                del self._pending_messages[i]
+                return True
+        return False
+
+    def get_last_user_message(self):
         """获取最后一条用户消息"""
-        for msg_info in reversed(self.message_widgets):
+        for msg_info in chain(reversed(self.message_widgets.values()), reversed(self._pending_messages)):
             if msg_info['is_user']:
                 return msg_info['message']
-        return ""
-    
-    def remove_last_ai_message(self) -> bool:
-        """删除最后一条AI消息"""
-        for i in range(len(self.message_widgets) - 1, -1, -1):
-            msg_info = self.message_widgets[i]
-            if not msg_info['is_user']:
-                widget = msg_info['widget']
-                self.messages_layout.removeWidget(widget)
-                widget.deleteLater()
-                self.message_widgets.pop(i)
-                logger.info("🔄 [UI] 删除最后一条AI消息以重新生成")
-                return True
-        return False
\ No newline at end of file
+        return None
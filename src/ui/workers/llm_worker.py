@@ -1,63 +1,153 @@
 """
 LLM工作线程
-处理LLM请求，避免UI阻塞
+在常驻后台线程中处理LLM请求，避免UI阻塞
 """
-from PySide6.QtCore import QThread, Signal
+import threading
+
+from typing import Optional
+
+from PySide6.QtCore import QObject, QThread, Signal, Slot
 from loguru import logger
 
+from src.core.llm_client import LLMClient
+from src.utils.config import config
+
+# 关闭服务时等待线程自行退出的时间，超时才强制终止
+_STOP_WAIT_MS = 500
+
+# 各次请求共用的LLM客户端（复用连接池），首次使用时创建
+_shared_client: Optional[LLMClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def _get_llm_client() -> LLMClient:
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = LLMClient()
+        return _shared_client
 
-class LLMWorkerThread(QThread):
-    """LLM处理工作线程，避免UI阻塞"""
+
+class LLMService(QObject):
+    """
+    常驻的LLM处理服务：对象移到一个长期运行的后台线程中，消息经 request 信号排队依次处理，
+    不再为每条消息创建新线程。提交新消息会取消仍在处理或排队中的旧消息
+    """
     
     # 定义信号
-    response_ready = Signal(str)  # LLM回复准备好
+    request = Signal(str)  # 提交待处理的用户消息（请通过 submit() 提交）
+    response_ready = Signal(str)  # LLM回复准备好（流式输出时为完整回复）
+    response_chunk = Signal(str)  # 流式输出时收到的一段回复
     error_occurred = Signal(str)  # 发生错误
     grag_data_ready = Signal(dict)  # GRAG数据准备好
     
-    def __init__(self, engine, message):
+    def __init__(self, engine):
         super().__init__()
         self.engine = engine
-        self.message = message
-        self.grag_data = {}
+        # 已提交但尚未开始处理的消息数；大于0说明当前消息已被更新的消息取代
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._shutdown = threading.Event()
+        
+        self._thread = QThread()
+        self.moveToThread(self._thread)
+        self.request.connect(self._process)
+        self._thread.start()
+    
+    def submit(self, message: str):
+        """提交一条消息，在后台线程中处理"""
+        with self._pending_lock:
+            self._pending += 1
+        self.request.emit(message)
+    
+    def is_cancelled(self) -> bool:
+        return self._pending > 0 or self._shutdown.is_set()
     
-    def run(self):
+    def shutdown(self, timeout_ms: int = _STOP_WAIT_MS) -> bool:
+        """
+        取消正在处理的消息并停止后台线程，超时仍未退出时才调用 terminate()
+        
+        Returns:
+            线程是否自行退出
+        """
+        self._shutdown.set()
+        self._thread.quit()
+        if self._thread.wait(timeout_ms):
+            return True
+        logger.warning(f"LLM服务线程 {timeout_ms}ms 内未退出，强制终止")
+        self._thread.terminate()
+        self._thread.wait()
+        return False
+    
+    @Slot(str)
+    def _process(self, message: str):
         """在后台线程中执行LLM处理"""
+        with self._pending_lock:
+            self._pending -= 1
+        if self.is_cancelled():
+            logger.info(f"LLM服务跳过已被取代的消息: {message}")
+            return
+        
         try:
-            from src.core.llm_client import LLMClient
-            
             # 1. 感知用户输入中的实体
-            logger.info(f"🔍 [GRAG] 开始分析用户输入: {self.message}")
+            logger.info(f"🔍 [GRAG] 开始分析用户输入: {message}")
             
-            perceived_entities = self.engine.perception_module.perceive_entities(self.message)
+            perceived_entities = self.engine.perception_module.perceive_entities(message)
             logger.info(f"🎯 [GRAG] 感知到 {len(perceived_entities)} 个相关实体: {perceived_entities}")
+            if self.is_cancelled():
+                return
             
             # 2. 构建知识图谱上下文
             logger.info(f"🔗 [GRAG] 开始构建知识图谱上下文...")
             context = self.engine.memory.get_context_for_entities(perceived_entities)
             logger.info(f"📋 [GRAG] 构建的上下文长度: {len(context)} 字符")
+            if self.is_cancelled():
+                return
             
             # 3. 准备GRAG数据供UI显示
-            self.grag_data = {
+            self.grag_data_ready.emit({
                 'entities': perceived_entities,
                 'context_length': len(context)
-            }
-            self.grag_data_ready.emit(self.grag_data)
+            })
             
             # 4. 调用LLM生成回复
             logger.info(f"💭 [LLM] 开始生成回复...")
-            llm_client = LLMClient()
+            llm_client = _get_llm_client()
             
             # 构建完整的提示词
-            full_prompt = self.engine._build_full_prompt(self.message, context)
+            full_prompt = self.engine._build_full_prompt(message, context)
+            if self.is_cancelled():
+                return
             
-            # 调用LLM
-            response = llm_client.generate_response(full_prompt)
+            # 调用LLM（开启流式输出时逐段发给UI）
+            if config.llm.stream:
+                response = self._stream_response(llm_client, full_prompt)
+                if response is None:
+                    logger.info("LLM处理已取消，停止接收回复")
+                    return
+            else:
+                response = llm_client.generate_response(full_prompt)
             logger.info(f"✅ [LLM] 回复生成完成，长度: {len(response)} 字符")
+            if self.is_cancelled():
+                logger.info("LLM处理已取消，丢弃回复")
+                return
             
             # 发送回复信号
             self.response_ready.emit(response)
             
         except Exception as e:
+            if self.is_cancelled():
+                return
             error_msg = f"LLM处理失败: {str(e)}"
             logger.error(f"❌ [GRAG] {error_msg}")
-            self.error_occurred.emit(error_msg)
\ No newline at end of file
+            self.error_occurred.emit(error_msg)
+    
+    def _stream_response(self, llm_client: LLMClient, full_prompt: str) -> Optional[str]:
+        """逐段接收并转发回复，返回完整回复；中途被取消时返回 None"""
+        parts = []
+        for chunk in llm_client.stream_response(full_prompt):
+            if self.is_cancelled():
+                return None
+            parts.append(chunk)
+            self.response_chunk.emit(chunk)
+        return "".join(parts)
@@ -1,16 +1,42 @@
 import os
 import yaml
+from functools import lru_cache
 from pathlib import Path
-from dotenv import load_dotenv
-from pydantic import BaseModel
-from typing import Optional
+from dotenv import find_dotenv, load_dotenv
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
 
-# 强制加载.env文件，覆盖系统环境变量
-env_file = Path('.env')
-if env_file.exists():
+# 记录已载入环境变量的.env文件（路径和修改时间），由子进程（如API服务器）继承
+_DOTENV_STAMP_VAR = "CHRONOFORGE_DOTENV_STAMP"
+
+
+def _load_env_file():
+    """
+    强制加载.env文件，覆盖系统环境变量。
+    父进程已载入同一份未修改过的.env时，继承来的环境变量已经是覆盖后的结果，不再重复解析
+    """
+    env_file = Path('.env')
+    if not env_file.exists():
+        found = find_dotenv()
+        if not found:
+            return
+        env_file = Path(found)
+    
+    stamp = f"{env_file.resolve()}:{env_file.stat().st_mtime_ns}"
+    if os.environ.get(_DOTENV_STAMP_VAR) == stamp:
+        return
     load_dotenv(env_file, override=True)
-else:
-    load_dotenv(override=True)
+    os.environ[_DOTENV_STAMP_VAR] = stamp
+
+
+_load_env_file()
+
+
+@lru_cache(maxsize=8)
+def _parse_yaml(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """解析YAML配置文件；按路径和修改时间缓存，返回结果由调用方只读使用"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
 
 class LLMConfig(BaseModel):
     provider: str = "openai"
@@ -21,6 +47,7 @@ class LLMConfig(BaseModel):
     api_key: Optional[str] = None
     base_url: Optional[str] = None
     request_timeout: int = 180  # 默认超时时间为180秒
+    max_concurrency: int = 8  # 异步调用时同时在途的最大请求数
 
 class MemoryConfig(BaseModel):
     max_hot_memory: int = 5
@@ -35,20 +62,28 @@ class SystemConfig(BaseModel):
     version: str = "0.1.0"
     debug: bool = True
 
+class AppConfig(BaseModel):
+    """完整配置，各段一次性校验"""
+    system: SystemConfig = Field(default_factory=SystemConfig)
+    llm: LLMConfig = Field(default_factory=LLMConfig)
+    memory: MemoryConfig = Field(default_factory=MemoryConfig)
+    game: GameConfig = Field(default_factory=GameConfig)
+
 class Config:
     def __init__(self, config_path: str = "config.yaml"):
         self.config_path = Path(config_path)
         self._load_config()
     
     def _load_config(self):
-        if self.config_path.exists():
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config_data = yaml.safe_load(f)
-        else:
+        try:
+            mtime_ns = self.config_path.stat().st_mtime_ns
+        except FileNotFoundError:
             config_data = {}
+        else:
+            config_data = _parse_yaml(str(self.config_path.resolve()), mtime_ns)
         
-        # 从环境变量获取API密钥、基础URL和模型名称
-        llm_config = config_data.get('llm', {})
+        # 从环境变量获取API密钥、基础URL和模型名称（复制一份，不改动缓存的解析结果）
+        llm_config = dict(config_data.get('llm') or {})
         llm_config['api_key'] = os.getenv('OPENAI_API_KEY')
         
         # 设置默认的外部API服务器地址，不指向本地服务器
@@ -63,10 +98,11 @@ class Config:
         if stream_env in ('true', '1', 't'):
             llm_config['stream'] = True
         
-        self.system = SystemConfig(**config_data.get('system', {}))
-        self.llm = LLMConfig(**llm_config)
-        self.memory = MemoryConfig(**config_data.get('memory', {}))
-        self.game = GameConfig(**config_data.get('game', {}))
+        parsed = AppConfig.model_validate({**config_data, 'llm': llm_config})
+        self.system = parsed.system
+        self.llm = parsed.llm
+        self.memory = parsed.memory
+        self.game = parsed.game
 
 # 全局配置实例
 config = Config()
@@ -0,0 +1,82 @@
+"""
+JSON 编解码工具
+优先使用 orjson（C实现，解析/序列化速度远快于标准库），未安装时回退到标准库 json。
+两种实现的解析错误都是 json.JSONDecodeError 的子类，调用方可以统一捕获。
+"""
+
+import json
+import mmap
+import os
+from typing import Any, Iterable, Iterator, TextIO, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+# 不小于该大小的文件通过 mmap 直接交给 orjson 解析，不先读出一份完整的字节副本
+_MMAP_THRESHOLD = 8 * 1024 * 1024
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """解析JSON文本或UTF-8字节串"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def load_file(path: Union[str, os.PathLike]) -> Any:
+    """读取并解析UTF-8编码的JSON文件"""
+    with open(path, 'rb') as f:
+        if orjson is not None and os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                return orjson.loads(view)
+        return loads(f.read())
+
+
+def dumps(obj: Any) -> bytes:
+    """将对象序列化为缩进2格的UTF-8 JSON字节串（非ASCII字符原样保留）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def dumps_line(obj: Any) -> bytes:
+    """将对象序列化为单行UTF-8 JSON字节串（以换行结尾），用于JSONL追加写入"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+def dump_file(path: Union[str, os.PathLike], obj: Any):
+    """将对象序列化后一次性写入文件"""
+    data = dumps(obj)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def dump_document(fp: TextIO, fields: Iterable[Tuple[str, Any]], indent: int = 2):
+    """
+    逐段写出一个顶层JSON对象，输出与 json.dump(dict(fields), fp, ensure_ascii=False, indent=indent) 逐字节一致。
+    值为迭代器（如生成器）时按数组逐条序列化并写出，不在内存中先构建完整列表。
+    """
+    pad = " " * indent
+    item_pad = pad * 2
+    fp.write("{")
+    first_field = True
+    for key, value in fields:
+        fp.write(("\n" if first_field else ",\n") + pad + json.dumps(key, ensure_ascii=False) + ": ")
+        first_field = False
+        if isinstance(value, Iterator):
+            first_item = True
+            for item in value:
+                # JSON字符串中的换行都已转义，按行缩进不会改动内容
+                encoded = json.dumps(item, ensure_ascii=False, indent=indent).replace("\n", "\n" + item_pad)
+                fp.write(("[\n" if first_item else ",\n") + item_pad + encoded)
+                first_item = False
+            fp.write("[]" if first_item else "\n" + pad + "]")
+        else:
+            fp.write(json.dumps(value, ensure_ascii=False, indent=indent).replace("\n", "\n" + pad))
+    fp.write("}" if first_field else "\n}")
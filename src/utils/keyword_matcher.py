@@ -0,0 +1,119 @@
+"""
+多关键词匹配器
+优先使用 pyahocorasick 构建 Aho-Corasick 自动机，一次线性扫描即可找出文本中出现的所有关键词；
+未安装时若有 marisa-trie，则在文本中每个可能的起始位置做一次前缀查询；
+两者都没有时回退到子串查找：关键词按首字符分桶，先用文本字符集合与桶键求交集，
+只检查首字符出现在文本中的关键词。三种方式结果一致。
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - 可选依赖
+    ahocorasick = None
+
+try:
+    import marisa_trie
+except ImportError:  # pragma: no cover - 可选依赖
+    marisa_trie = None
+
+
+class KeywordMatcher:
+    """
+    将关键词映射到一个或多个值（例如节点ID），在文本中查找所有出现的关键词。
+    关键词与待匹配文本都按小写处理。
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Any]]):
+        """
+        Args:
+            keywords: (关键词, 值) 序列；同一关键词可以对应多个值，空关键词会被忽略。
+        """
+        self._values: Dict[str, List[Any]] = {}
+        for keyword, value in keywords:
+            keyword = str(keyword).lower()
+            if not keyword:
+                continue
+            values = self._values.setdefault(keyword, [])
+            if value not in values:
+                values.append(value)
+
+        self._automaton = None
+        self._trie = None
+        self._by_first_char: Dict[str, List[Tuple[str, List[Any]]]] = {}
+        if ahocorasick is None:
+            for keyword, values in self._values.items():
+                self._by_first_char.setdefault(keyword[0], []).append((keyword, values))
+            if marisa_trie is not None and self._values:
+                self._trie = marisa_trie.Trie(self._values.keys())
+                self._max_keyword_len = max(map(len, self._values))
+        elif self._values:
+            automaton = ahocorasick.Automaton()
+            for keyword, values in self._values.items():
+                automaton.add_word(keyword, (keyword, values))
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str, List[Any]]]:
+        """
+        遍历文本（已小写）中的所有关键词出现位置，包括相互重叠的匹配。
+
+        Yields:
+            (起始位置, 结束位置(不含), 关键词, 值列表)
+        """
+        if self._automaton is not None:
+            for end_index, (keyword, values) in self._automaton.iter(text):
+                yield end_index - len(keyword) + 1, end_index + 1, keyword, values
+            return
+
+        if self._trie is not None:
+            first_chars = self._by_first_char.keys()
+            for start, char in enumerate(text):
+                if char not in first_chars:
+                    continue
+                for keyword in self._trie.prefixes(text[start:start + self._max_keyword_len]):
+                    yield start, start + len(keyword), keyword, self._values[keyword]
+            return
+
+        for keyword, values in self._candidates(text):
+            start = text.find(keyword)
+            while start != -1:
+                yield start, start + len(keyword), keyword, values
+                start = text.find(keyword, start + 1)
+
+    def find_values(self, text: str) -> Set[Any]:
+        """返回文本（已小写）中出现的所有关键词对应的值集合"""
+        if self._automaton is not None:
+            found = set()
+            for _, (_, values) in self._automaton.iter(text):
+                found.update(values)
+            return found
+
+        if self._trie is not None:
+            found = set()
+            for _, _, _, values in self.iter_matches(text):
+                found.update(values)
+            return found
+
+        found = set()
+        for keyword, values in self._candidates(text):
+            if keyword in text:
+                found.update(values)
+        return found
+
+    def count_values(self, text: str) -> Dict[Any, int]:
+        """返回 值 -> 文本（已小写）中对应关键词出现的总次数"""
+        counts: Dict[Any, int] = {}
+        for _, _, _, values in self.iter_matches(text):
+            for value in values:
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def _candidates(self, text: str) -> Iterator[Tuple[str, List[Any]]]:
+        """回退模式下首字符出现在文本中的关键词（集合交集在C层完成）"""
+        for first_char in self._by_first_char.keys() & set(text):
+            yield from self._by_first_char[first_char]